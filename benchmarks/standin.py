@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Stand-in SSH server on loopback for the benchmarks.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+import collections
+import paramiko
+
+
+BUFF_SIZE = 32768
+
+
+class StandInInterface(paramiko.ServerInterface):
+    """ Accepts any password and runs the exec requests in a shell.
+
+    The sftp subsystem is served by StandInSftp.
+    """
+
+    def __init__(self, root):
+        """ Initialise server interface object.
+
+        Arguments:
+        root -- str, working and home directory of the commands.
+
+        Returns:
+        interface -- StandInInterface, server interface object.
+
+        """
+        self.root = root
+
+
+    def get_allowed_auths(self, username):
+        """ Lists the authentication methods, only passwords.
+
+        Arguments:
+        username -- str, user name.
+
+        Returns:
+        methods -- str, comma separated authentication methods.
+
+        """
+        return "password"
+
+
+    def check_auth_password(self, username, password):
+        """ Accepts any password.
+
+        Arguments:
+        username -- str, user name.
+        password -- str, password.
+
+        Returns:
+        result -- int, paramiko.AUTH_SUCCESSFUL.
+
+        """
+        return paramiko.AUTH_SUCCESSFUL
+
+
+    def check_channel_request(self, kind, chanid):
+        """ Accepts the session channels only.
+
+        Arguments:
+        kind -- str, kind of channel.
+        chanid -- int, channel number.
+
+        Returns:
+        result -- int, paramiko channel open result.
+
+        """
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+    def check_channel_exec_request(self, channel, command):
+        """ Runs a command in the background for a channel.
+
+        Arguments:
+        channel -- paramiko.channel.Channel, channel of the request.
+        command -- bytes, command to run.
+
+        Returns:
+        result -- boolean, True.
+
+        """
+        threading.Thread(target=run_command, args=(channel,
+            command.decode(), self.root), daemon=True).start()
+
+        return True
+
+
+class StandInHandle(paramiko.SFTPHandle):
+    """ Open file of the SFTP subsystem. """
+
+    def stat(self):
+        """ Gets the attributes of the open file.
+
+        Arguments:
+
+        Returns:
+        attributes -- paramiko.SFTPAttributes or int, attributes of the
+            file or SFTP error code.
+
+        """
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(
+                self.readfile.fileno()))
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+
+class StandInSftp(paramiko.SFTPServerInterface):
+    """ Serves the files under the root directory over SFTP. """
+
+    def __init__(self, server, root):
+        """ Initialise SFTP interface object.
+
+        Arguments:
+        server -- StandInInterface, server interface of the connection.
+        root -- str, home directory of the sessions.
+
+        Returns:
+        interface -- StandInSftp, SFTP interface object.
+
+        """
+        super().__init__(server)
+        self.root = root
+
+
+    def local_path(self, path):
+        """ Converts an SFTP path to a local path.
+
+        Arguments:
+        path -- str, absolute or home relative path.
+
+        Returns:
+        path -- str, local path.
+
+        """
+        return os.path.join(self.root, path)
+
+
+    def list_folder(self, path):
+        """ Lists the attributes of the files of a directory.
+
+        Arguments:
+        path -- str, path to the directory.
+
+        Returns:
+        attributes -- list[paramiko.SFTPAttributes] or int, attributes
+            of the files or SFTP error code.
+
+        """
+        path = self.local_path(path)
+
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(
+                os.path.join(path, name)), name) for name in os.listdir(path)]
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+
+    def stat(self, path):
+        """ Gets the attributes of a file, links are followed.
+
+        Arguments:
+        path -- str, path to the file.
+
+        Returns:
+        attributes -- paramiko.SFTPAttributes or int, attributes of the
+            file or SFTP error code.
+
+        """
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(
+                self.local_path(path)))
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+
+    def lstat(self, path):
+        """ Gets the attributes of a file or link.
+
+        Arguments:
+        path -- str, path to the file.
+
+        Returns:
+        attributes -- paramiko.SFTPAttributes or int, attributes of the
+            file or SFTP error code.
+
+        """
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(
+                self.local_path(path)))
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+
+    def open(self, path, flags, attr):
+        """ Opens a file.
+
+        Arguments:
+        path -- str, path to the file.
+        flags -- int, os.open flags.
+        attr -- paramiko.SFTPAttributes, attributes of a new file.
+
+        Returns:
+        handle -- StandInHandle or int, open file or SFTP error code.
+
+        """
+        mode = 'wb' if flags & (os.O_WRONLY | os.O_RDWR) else 'rb'
+
+        try:
+            descriptor = os.open(self.local_path(path), flags,
+                    attr.st_mode or 0o644 if attr else 0o644)
+            handle = StandInHandle(flags)
+            handle.readfile = handle.writefile = os.fdopen(descriptor,
+                    mode)
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+        return handle
+
+
+    def mkdir(self, path, attr):
+        """ Creates a directory.
+
+        Arguments:
+        path -- str, path to the directory.
+        attr -- paramiko.SFTPAttributes, attributes of the directory.
+
+        Returns:
+        result -- int, SFTP result code.
+
+        """
+        try:
+            os.mkdir(self.local_path(path))
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+        return paramiko.SFTP_OK
+
+
+    def chattr(self, path, attr):
+        """ Changes the attributes of a file.
+
+        Arguments:
+        path -- str, path to the file.
+        attr -- paramiko.SFTPAttributes, new attributes.
+
+        Returns:
+        result -- int, SFTP result code.
+
+        """
+        try:
+            paramiko.SFTPServer.set_file_attr(self.local_path(path), attr)
+
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+        return paramiko.SFTP_OK
+
+
+def run_command(channel, command, root):
+    """ Runs a command and relays its streams over a channel.
+
+    Arguments:
+    channel -- paramiko.channel.Channel, channel of the exec request.
+    command -- str, command to run in a shell.
+    root -- str, working and home directory of the command.
+
+    Returns:
+
+    """
+    process = subprocess.Popen(command, shell=True, cwd=root,
+            env=dict(os.environ, HOME=root), stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def forward_stdin():
+        try:
+            for data in iter(lambda: channel.recv(BUFF_SIZE), b''):
+                process.stdin.write(data)
+                process.stdin.flush()
+
+        except (OSError, ValueError):
+            pass
+
+        finally:
+            process.stdin.close()
+
+    def forward_stderr():
+        for data in iter(lambda: process.stderr.read1(BUFF_SIZE), b''):
+            channel.sendall_stderr(data)
+
+    stdin_thread = threading.Thread(target=forward_stdin, daemon=True)
+    stderr_thread = threading.Thread(target=forward_stderr, daemon=True)
+    stdin_thread.start()
+    stderr_thread.start()
+
+    for data in iter(lambda: process.stdout.read1(BUFF_SIZE), b''):
+        channel.sendall(data)
+
+    process.wait()
+    stderr_thread.join()
+    channel.send_exit_status(process.returncode)
+    channel.shutdown_write()
+    channel.close()
+
+
+class Link:
+    """ Delays and throttles the data sent in one direction. """
+
+    def __init__(self, source, target, latency, bandwidth):
+        """ Initialise link object.
+
+        Arguments:
+        source -- socket.socket, socket to read from.
+        target -- socket.socket, socket to write to.
+        latency -- float, one way delay in seconds.
+        bandwidth -- float, bytes per second, 0 for no limit.
+
+        Returns:
+        link -- Link, link object.
+
+        """
+        self.source = source
+        self.target = target
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.free_at = 0.0
+
+
+    def start(self):
+        """ Starts the forwarding threads.
+
+        Arguments:
+
+        Returns:
+
+        """
+        threading.Thread(target=self.receive, daemon=True).start()
+        threading.Thread(target=self.deliver, daemon=True).start()
+
+
+    def receive(self):
+        """ Reads the data and schedules its delivery.
+
+        Arguments:
+
+        Returns:
+
+        """
+        while True:
+            try:
+                data = self.source.recv(BUFF_SIZE)
+
+            except OSError:
+                data = b''
+
+            now = time.monotonic()
+            due = now + self.latency
+
+            if self.bandwidth and data:
+                # The data leaves once the previous data is sent.
+                self.free_at = max(self.free_at, now) + \
+                        len(data)/self.bandwidth
+                due = max(due, self.free_at + self.latency)
+
+            with self.condition:
+                self.queue.append((due, data))
+                self.condition.notify()
+
+            if not data:
+                return None
+
+
+    def deliver(self):
+        """ Sends the data when it is due.
+
+        Arguments:
+
+        Returns:
+
+        """
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+
+                due, data = self.queue.popleft()
+
+            delay = due - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                if not data:
+                    self.target.shutdown(socket.SHUT_WR)
+                    return None
+
+                self.target.sendall(data)
+
+            except OSError:
+                return None
+
+
+def shape(client, latency, bandwidth):
+    """ Puts a delayed and throttled link in front of a connection.
+
+    Arguments:
+    client -- socket.socket, accepted connection.
+    latency -- float, one way delay in seconds.
+    bandwidth -- float, bytes per second in each direction, 0 for no
+        limit.
+
+    Returns:
+    sock -- socket.socket, socket to serve the connection on.
+
+    """
+    inner, outer = socket.socketpair()
+    Link(client, outer, latency, bandwidth).start()
+    Link(outer, client, latency, bandwidth).start()
+
+    return inner
+
+
+def serve_connection(client, host_key, root, latency, bandwidth):
+    """ Serves an SSH connection until it is closed.
+
+    Arguments:
+    client -- socket.socket, accepted connection.
+    host_key -- paramiko.pkey.PKey, host key of the server.
+    root -- str, working and home directory of the commands.
+    latency -- float, one way delay in seconds.
+    bandwidth -- float, bytes per second, 0 for no limit.
+
+    Returns:
+
+    """
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    if latency or bandwidth:
+        client = shape(client, latency, bandwidth)
+
+    transport = paramiko.Transport(client)
+    transport.add_server_key(host_key)
+    transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StandInSftp,
+            root)
+    transport.start_server(server=StandInInterface(root))
+
+    while transport.is_active():
+        time.sleep(0.5)
+
+
+def load_host_key(key_path):
+    """ Loads the host key, it is created if missing.
+
+    Arguments:
+    key_path -- str, path to the private key.
+
+    Returns:
+    host_key -- paramiko.rsakey.RSAKey, host key.
+
+    """
+    if not os.path.exists(key_path):
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+
+    return paramiko.RSAKey(filename=key_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=
+            "Runs a stand-in SSH server on loopback.")
+    parser.add_argument("--port", type=int, default=0, help=
+            "port to listen on, a free port by default")
+    parser.add_argument("--root", type=str, default=os.getcwd(), help=
+            "working and home directory of the commands")
+    parser.add_argument("--host-key", type=str, required=True, help=
+            "path to the host key, created if missing")
+    parser.add_argument("--latency", type=float, default=0.0, help=
+            "one way delay added to the connections in milliseconds")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help=
+            "bandwidth of the connections in MB/s, no limit by default")
+    args = parser.parse_args()
+
+    # Clients closing their connections are not errors.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    host_key = load_host_key(args.host_key)
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", args.port))
+    server.listen(50)
+
+    # The port is printed once the server is ready.
+    print(server.getsockname()[1], flush=True)
+
+    while True:
+        client, _ = server.accept()
+        threading.Thread(target=serve_connection, args=(client, host_key,
+            args.root, args.latency/1000., args.bandwidth*1e6),
+            daemon=True).start()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        sys.exit(0)
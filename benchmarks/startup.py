@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Start up time benchmark of the server commands.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "server-cli.py")
+
+# Modules that should only be loaded by the commands opening a
+# connection.
+HEAVY_MODULES = ["paramiko", "scp", "serverSync", "serverBundle"]
+
+
+def write_servers(file_path, count):
+    """ Writes a server list with generated servers.
+
+    Arguments:
+    file_path -- str, path to the server list.
+    count -- int, number of servers.
+
+    Returns:
+
+    """
+    with open(file_path, 'w') as f_handle:
+        for i in range(count):
+            f_handle.write("user{0}@host{0}.example 22  #server {0}\n".format(
+                i))
+
+
+def fake_ssh(bin_dir):
+    """ Creates an ssh program that exits at once.
+
+    The connect and command commands are then timed without the
+    connection itself.
+    Arguments:
+    bin_dir -- str, directory of the program, put first in PATH.
+
+    Returns:
+
+    """
+    ssh_path = os.path.join(bin_dir, "ssh")
+
+    with open(ssh_path, 'w') as f_handle:
+        f_handle.write("#!/bin/sh\nexit 0\n")
+
+    os.chmod(ssh_path, 0o755)
+
+
+def get_commands(server_path):
+    """ Gets the command lines to time.
+
+    Arguments:
+    server_path -- str, path to the server list.
+
+    Returns:
+    commands -- dict{str: list[str]}, arguments of each command.
+
+    """
+    return {
+        "help": ["--help"],
+        "list": ["list", "--path", server_path],
+        "list-filter": ["list", "--path", server_path, "--filter",
+            "host1234."],
+        "connect": ["connect", "1", "-P", server_path],
+        "command": ["command", "1", "true", "-P", server_path],
+        "upload": ["upload", "--help"],
+        "download": ["download", "--help"],
+        "broker": ["broker", "status"],
+    }
+
+
+def loaded_modules(python, arguments, env):
+    """ Lists the heavy modules loaded by a command.
+
+    Arguments:
+    python -- str, path to the python interpreter.
+    arguments -- list[str], arguments of the command.
+    env -- dict, environment of the command.
+
+    Returns:
+    modules -- list[str], heavy modules imported by the command.
+
+    """
+    result = subprocess.run([python, "-X", "importtime", CLI_PATH] +
+            arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            env=env, universal_newlines=True)
+    imported = set(line.split('|')[-1].strip()
+            for line in result.stderr.splitlines())
+
+    return [module for module in HEAVY_MODULES if module in imported]
+
+
+def time_command(python, arguments, env, runs):
+    """ Times a command started in a new interpreter.
+
+    Arguments:
+    python -- str, path to the python interpreter.
+    arguments -- list[str], arguments of the command.
+    env -- dict, environment of the command.
+    runs -- int, number of runs.
+
+    Returns:
+    timings -- list[float], wall clock time of each run in seconds.
+
+    """
+    timings = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([python, CLI_PATH] + arguments,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                env=env)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=
+            "Times the start up of the server commands.")
+    parser.add_argument("-n", "--runs", type=int, default=10, help=
+            "number of runs of each command")
+    parser.add_argument("-s", "--servers", type=int, default=10000, help=
+            "number of servers in the generated server list")
+    parser.add_argument("--python", type=str, default=sys.executable, help=
+            "python interpreter running the commands")
+    parser.add_argument("-c", "--commands", type=str, nargs='*', help=
+            "commands to time, all by default")
+    parser.add_argument("-o", "--output", type=str, help=
+            "JSON file to write the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server_path = os.path.join(tmp_dir, "servers")
+        write_servers(server_path, args.servers)
+        fake_ssh(tmp_dir)
+
+        # The broker socket and the bytecode cache of the home
+        # directory are not used.
+        env = dict(os.environ, HOME=tmp_dir, PATH=os.pathsep.join([tmp_dir,
+            os.environ.get("PATH", "")]))
+        commands = get_commands(server_path)
+        results = []
+
+        # Warm up the bytecode cache of the program.
+        time_command(args.python, commands["help"], env, 1)
+
+        for name in args.commands or commands:
+            timings = time_command(args.python, commands[name], env,
+                    args.runs)
+            result = {"command": name, "runs": args.runs,
+                    "min": round(min(timings), 4),
+                    "median": round(statistics.median(timings), 4),
+                    "max": round(max(timings), 4),
+                    "heavy_modules": loaded_modules(args.python,
+                        commands[name], env)}
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as f_handle:
+            json.dump({"python": platform.python_version(),
+                "servers": args.servers, "results": results}, f_handle,
+                indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Transfer throughput benchmark against a stand-in SSH server.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import getpass
+import argparse
+import contextlib
+import platform
+import resource
+import tempfile
+import subprocess
+import paramiko
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import serverFunctions
+
+
+WORKLOADS = ["huge", "tiny", "deep", "mixed"]
+
+# Modes of each direction and the matching arguments of Server.upload
+# and Server.download.
+UPLOAD_MODES = {"plain": {}, "jobs": {"jobs": 4}, "delta": {"delta": True},
+        "compress": {"compress": "auto"}, "bundle": {"bundle": True},
+        "sftp": {"backend": "sftp"}}
+DOWNLOAD_MODES = {"plain": {}, "resume": {"resume": True},
+        "compress": {"compress": "auto"}, "bundle": {"bundle": True},
+        "sftp": {"backend": "sftp"}, "ranged": {"jobs": 4}}
+
+
+def write_data(file_path, size, data_kind, rand):
+    """ Writes a file of generated data.
+
+    Arguments:
+    file_path -- str, path to the file.
+    size -- int, size of the file in bytes.
+    data_kind -- str, random for incompressible data or text.
+    rand -- random.Random, random generator.
+
+    Returns:
+
+    """
+    with open(file_path, 'wb') as f_handle:
+        while size > 0:
+            chunk = min(size, 1048576)
+
+            if data_kind == "text":
+                line = "{:08d} {}\n".format(rand.randrange(10**8),
+                        "lorem ipsum dolor sit amet " * 3).encode()
+                data = (line*(chunk//len(line) + 1))[:chunk]
+
+            else:
+                data = rand.getrandbits(8*chunk).to_bytes(chunk, "little")
+
+            f_handle.write(data)
+            size -= chunk
+
+
+def make_workload(name, root, scale, data_kind):
+    """ Creates the files of a workload.
+
+    Arguments:
+    name -- str, workload name, see WORKLOADS.
+    root -- str, directory to create the workload in.
+    scale -- float, multiplies the sizes and numbers of files.
+    data_kind -- str, random or text.
+
+    Returns:
+    path -- str, path to the directory of the workload.
+    file_count -- int, number of files.
+    total_size -- int, number of bytes.
+
+    """
+    rand = random.Random(name)
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    sizes = []
+
+    if name == "huge":
+        sizes.append((path, int(64*1048576*scale)))
+
+    elif name == "tiny":
+        sizes.extend((path, 1024) for _ in range(int(2000*scale)))
+
+    elif name == "deep":
+        directory = path
+
+        for _ in range(int(40*scale)):
+            sizes.extend((directory, 4096) for _ in range(5))
+            directory = os.path.join(directory, "d")
+            os.makedirs(directory)
+
+    elif name == "mixed":
+        sizes.extend((path, int(2**rand.uniform(10, 23)))
+                for _ in range(int(150*scale)))
+
+    for i, (directory, size) in enumerate(sizes):
+        write_data(os.path.join(directory, "f{}".format(i)), size,
+                data_kind, rand)
+
+    return path, len(sizes), sum(size for _, size in sizes)
+
+
+def start_standin(tmp_dir, root, latency, bandwidth):
+    """ Starts the stand-in server and trusts its host key.
+
+    Arguments:
+    tmp_dir -- str, home directory of the benchmark.
+    root -- str, home directory of the stand-in server.
+    latency -- float, one way delay in milliseconds.
+    bandwidth -- float, bandwidth in MB/s, 0 for no limit.
+
+    Returns:
+    process -- subprocess.Popen, stand-in server process.
+    port -- int, port of the stand-in server.
+
+    """
+    key_path = os.path.join(tmp_dir, "host_key")
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR,
+        "standin.py"), "--root", root, "--host-key", key_path,
+        "--latency", str(latency), "--bandwidth", str(bandwidth)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    port = int(process.stdout.readline())
+
+    host_key = paramiko.RSAKey(filename=key_path)
+    os.makedirs(os.path.join(tmp_dir, ".ssh"))
+
+    with open(os.path.join(tmp_dir, ".ssh", "known_hosts"), 'w') as f_handle:
+        f_handle.write("[127.0.0.1]:{} {} {}\n".format(port,
+            host_key.get_name(), host_key.get_base64()))
+
+    return process, port
+
+
+def measure(transfer):
+    """ Measures the wall clock and processor time of a transfer.
+
+    Arguments:
+    transfer -- function, runs the transfer.
+
+    Returns:
+    seconds -- float, wall clock time.
+    cpu_seconds -- float, user and system time of the program.
+    error -- str, error of the transfer, None if it succeeded.
+
+    """
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    error = None
+
+    try:
+        # The messages of the transfer are not part of the results.
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            transfer()
+
+    except SystemExit as err:
+        error = "exit status {}".format(err.code)
+
+    seconds = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = (end_usage.ru_utime - start_usage.ru_utime) + \
+            (end_usage.ru_stime - start_usage.ru_stime)
+
+    return seconds, cpu_seconds, error
+
+
+def result_entry(workload, direction, mode, file_count, total_size,
+        seconds, cpu_seconds, error):
+    """ Builds the result of one transfer.
+
+    Arguments:
+    workload -- str, workload name.
+    direction -- str, upload or download.
+    mode -- str, transfer mode.
+    file_count -- int, number of files.
+    total_size -- int, number of bytes.
+    seconds -- float, wall clock time.
+    cpu_seconds -- float, processor time of the program.
+    error -- str, error of the transfer, None if it succeeded.
+
+    Returns:
+    result -- dict, result of the transfer.
+
+    """
+    return {"workload": workload, "direction": direction, "mode": mode,
+            "files": file_count, "bytes": total_size,
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(total_size/seconds/1e6, 3),
+            "files_per_s": round(file_count/seconds, 2),
+            "cpu_seconds": round(cpu_seconds, 4),
+            "cpu_ns_per_byte": round(cpu_seconds*1e9/max(1, total_size),
+                3),
+            "error": error}
+
+
+def compare(results, baseline_path):
+    """ Prints the change of throughput against a previous run.
+
+    Arguments:
+    results -- list[dict], results of this run.
+    baseline_path -- str, path to the JSON file of a previous run.
+
+    Returns:
+
+    """
+    with open(baseline_path, 'r') as f_handle:
+        baseline = {(item["workload"], item["direction"], item["mode"]):
+                item for item in json.load(f_handle)["results"]}
+
+    for result in results:
+        key = (result["workload"], result["direction"], result["mode"])
+
+        if key not in baseline or baseline[key]["error"] or result["error"]:
+            continue
+
+        print("{:>6} {:>8} {:>8}: {:+.1f}% MB/s, {:+.1f}% cpu/byte".format(
+            *key, 100*(result["mb_per_s"]/max(1e-9,
+                baseline[key]["mb_per_s"]) - 1),
+            100*(result["cpu_ns_per_byte"]/max(1e-9,
+                baseline[key]["cpu_ns_per_byte"]) - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=
+            "Measures the transfers against a stand-in SSH server.")
+    parser.add_argument("-w", "--workloads", type=str, nargs='*',
+            default=WORKLOADS, choices=WORKLOADS, help="workloads to run")
+    parser.add_argument("-u", "--upload-modes", type=str, nargs='*',
+            default=["plain"], choices=list(UPLOAD_MODES), help=
+            "upload modes to measure")
+    parser.add_argument("-d", "--download-modes", type=str, nargs='*',
+            default=["plain"], choices=list(DOWNLOAD_MODES), help=
+            "download modes to measure")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help=
+            "multiplies the sizes and numbers of files of the workloads")
+    parser.add_argument("--data", type=str, default="random", choices=[
+        "random", "text"], help="content of the generated files")
+    parser.add_argument("--latency", type=float, default=0.0, help=
+            "one way delay added by the server in milliseconds")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help=
+            "bandwidth of the server in MB/s, no limit by default")
+    parser.add_argument("-o", "--output", type=str, help=
+            "JSON file to write the results to")
+    parser.add_argument("-c", "--compare", type=str, help=
+            "JSON file of a previous run to compare the results with")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="server-bench.")
+    local_root = os.path.join(tmp_dir, "local")
+    remote_root = os.path.join(tmp_dir, "remote")
+    os.makedirs(local_root)
+    os.makedirs(remote_root)
+
+    # Keep the known hosts and the broker socket of the user out of
+    # the benchmark, the stand-in server accepts any password.
+    os.environ["HOME"] = tmp_dir
+    getpass.getpass = lambda prompt: ""
+    process, port = start_standin(tmp_dir, remote_root, args.latency,
+            args.bandwidth)
+    server_object = serverFunctions.Server("bench@127.0.0.1 {}  #\n".format(
+        port))
+    results = []
+
+    try:
+        for workload in args.workloads:
+            path, file_count, total_size = make_workload(workload,
+                    local_root, args.scale, args.data)
+
+            for mode in args.upload_modes:
+                shutil.rmtree(os.path.join(remote_root, "bench"),
+                        ignore_errors=True)
+                os.makedirs(os.path.join(remote_root, "bench"))
+                measures = measure(lambda: server_object.upload([path],
+                    "bench", True, True, **UPLOAD_MODES[mode]))
+                results.append(result_entry(workload, "upload", mode,
+                    file_count, total_size, *measures))
+                print(json.dumps(results[-1]), flush=True)
+
+            if not args.upload_modes:
+                shutil.copytree(path, os.path.join(remote_root, "bench",
+                    workload))
+
+            for mode in args.download_modes:
+                target = os.path.join(tmp_dir, "download")
+                shutil.rmtree(target, ignore_errors=True)
+                os.makedirs(target)
+                measures = measure(lambda: server_object.download([
+                    "bench/" + workload], target, True, True,
+                    **DOWNLOAD_MODES[mode]))
+                results.append(result_entry(workload, "download", mode,
+                    file_count, total_size, *measures))
+                print(json.dumps(results[-1]), flush=True)
+
+            shutil.rmtree(path)
+
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f_handle:
+            json.dump({"python": platform.python_version(),
+                "paramiko": paramiko.__version__, "scale": args.scale,
+                "data": args.data, "latency": args.latency,
+                "bandwidth": args.bandwidth, "results": results}, f_handle,
+                indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,21 @@
 import os
 import sys
 import argparse
-import serverFunctions
+import contextlib
+import serverLazy
+import serverMetrics
+
+
+# Each command only loads the modules it uses, see serverLazy.
+serverBatch = serverLazy.lazy_import("serverBatch")
+serverBroker = serverLazy.lazy_import("serverBroker")
+serverCompress = serverLazy.lazy_import("serverCompress")
+serverProgress = serverLazy.lazy_import("serverProgress")
+serverSftp = serverLazy.lazy_import("serverSftp")
+serverRate = serverLazy.lazy_import("serverRate")
+serverTransport = serverLazy.lazy_import("serverTransport")
+serverProfile = serverLazy.lazy_import("serverProfile")
+serverFunctions = serverLazy.lazy_import("serverFunctions")
 
 
 def parser_list_servers(args):
@@ -16,7 +30,17 @@ def parser_list_servers(args):
 
     See serverFunctions.list_servers for more details.
     """
-    serverFunctions.list_servers(args.path, args.verbose)
+    serverFunctions.list_servers(args.path, args.verbose, args.filter,
+            args.probe)
+
+
+def parser_probe_servers(args):
+    """ Calls probe_servers() from the parser.
+
+    See serverFunctions.probe_servers for more details.
+    """
+    serverFunctions.probe_servers(args.path, args.server, args.timeout,
+            args.jobs, args.refresh)
 
 
 def parser_add_server(args):
@@ -59,8 +83,13 @@ def parser_upload_server(args):
     See serverFunctions.upload_server for more details.
     """
     args.options = serverFunctions.clean_options(args.options)
+    serverProgress.set_format(args.progress)
+    serverRate.set_limit(args.limit_rate)
+    serverTransport.set_tuning(args.transport)
     serverFunctions.upload_server(args.path, args.server, args.port,
-            args.options, args.source, args.target, args.recursive, args.quiet)
+            args.options, args.source, args.target, args.recursive, args.quiet,
+            args.jobs, args.delta, args.compress, args.bundle, args.backend,
+            args.window, args.refresh, args.verify)
 
 
 def parser_download_server(args):
@@ -69,8 +98,38 @@ def parser_download_server(args):
     See serverFunctions.download_server for more details.
     """
     args.options = serverFunctions.clean_options(args.options)
+    serverProgress.set_format(args.progress)
+    serverRate.set_limit(args.limit_rate)
+    serverTransport.set_tuning(args.transport)
     serverFunctions.download_server(args.path, args.server, args.port,
-            args.options, args.source, args.target, args.recursive, args.quiet)
+            args.options, args.source, args.target, args.recursive, args.quiet,
+            args.resume, args.compress, args.bundle, args.backend,
+            args.window, args.jobs, args.verify)
+
+
+def parser_copy_server(args):
+    """ Calls copy_server() from the parser.
+
+    See serverFunctions.copy_server for more details.
+    """
+    serverProgress.set_format(args.progress)
+    serverRate.set_limit(args.limit_rate)
+    serverTransport.set_tuning(args.transport)
+    serverFunctions.copy_server(args.path, args.source, args.target,
+            args.quiet, args.compress, args.direct)
+
+
+def parser_watch_server(args):
+    """ Calls watch_server() from the parser.
+
+    See serverFunctions.watch_server for more details.
+    """
+    args.options = serverFunctions.clean_options(args.options)
+    serverRate.set_limit(args.limit_rate)
+    serverTransport.set_tuning(args.transport)
+    serverFunctions.watch_server(args.path, args.server, args.port,
+            args.options, args.local_dir, args.target, args.exclude,
+            args.interval)
 
 
 def parser_command_server(args):
@@ -80,9 +139,44 @@ def parser_command_server(args):
     """
     args.options = serverFunctions.clean_options(args.options)
     args.O = serverFunctions.clean_options(args.O)
+    if not args.command and args.file is None:
+        sys.stderr.write("Error: a command or a file of commands is "
+                "required.\n")
+        exit(1)
+
     serverFunctions.command_server(args.path, args.server, args.port,
-            args.options, args.command, args.O)
+            args.options, args.command, args.O, args.jobs, args.in_process,
+            args.file, args.tee)
+
 
+def parser_batch(args):
+    """ Calls run_batch() from the parser.
+
+    See serverBatch.run_batch for more details.
+    """
+    serverRate.set_limit(args.limit_rate)
+    serverTransport.set_tuning(args.transport)
+    serverBatch.run_batch(args.path, args.jobs_file, args.jobs,
+            args.per_host)
+
+
+def parser_broker(args):
+    """ Calls the broker function matching the action from the parser.
+
+    See serverBroker.start_broker, serverBroker.stop_broker and
+    serverBroker.status_broker for more details.
+    """
+    if args.action == "start":
+        if args.idle_timeout is None:
+            args.idle_timeout = serverBroker.IDLE_TIMEOUT
+
+        serverBroker.start_broker(args.idle_timeout)
+
+    elif args.action == "stop":
+        serverBroker.stop_broker()
+
+    else:
+        serverBroker.status_broker()
 
 
 ## Main program ##
@@ -91,16 +185,44 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(prog="server", description=
             "Handles remote server operations.")
+    parser.add_argument("--metrics", type=str, help="append the timings "
+            "of the operations to METRICS as JSON lines, defaults to the "
+            "SERVER_METRICS environment variable")
+    parser.add_argument("--profile", type=str, choices=serverProfile.MODES,
+            help="profile the command and print a summary on the standard "
+            "error")
+    parser.add_argument("--profile-output", type=str, help="save the raw "
+            "statistics of --profile to PROFILE_OUTPUT")
     subparsers = parser.add_subparsers(title="available commands")
     
     # List subcommand parser
     list_parser = subparsers.add_parser("list", help="List available servers")
     list_parser.add_argument("-v", "--verbose", action="store_true", help=
             "prints extra information")
+    list_parser.add_argument("-f", "--filter", type=str, help=
+            "only lists servers whose name or comment contains FILTER")
+    list_parser.add_argument("--probe", action="store_true", help=
+            "prints the connection times of the servers")
     list_parser.add_argument("--path", type=str, default=server_path, help=
             "path to a server list file")
     list_parser.set_defaults(func=parser_list_servers)
 
+    # Probe subcommand parser
+    probe_parser = subparsers.add_parser("probe", help=
+            "Measure the connection times of the servers")
+    probe_parser.add_argument("server", type=str, nargs='?', default="all",
+            help="server number(s), range(s) (1-4) or server name(s) "
+            "(user@host) separated by commas, tag=TAG or all")
+    probe_parser.add_argument("-t", "--timeout", type=float, help=
+            "seconds allowed for each server")
+    probe_parser.add_argument("-j", "--jobs", type=int, help=
+            "number of servers probed concurrently")
+    probe_parser.add_argument("--refresh", action='store_true', help=
+            "probe the servers again, ignoring the cached results")
+    probe_parser.add_argument("-P", "--path", type=str, default=server_path,
+            help="path to a server list file")
+    probe_parser.set_defaults(func=parser_probe_servers)
+
     # Add subcommand parser
     add_parser = subparsers.add_parser("add", help=
             "Add a server to the list of available servers")
@@ -152,6 +274,33 @@ if __name__ == "__main__":
             help="path to a server list file")
     upload_parser.add_argument("-q", "--quiet", action='store_true', help=
             "removes verbosity.")
+    upload_parser.add_argument("--progress", type=str, default="text",
+            choices=serverProgress.FORMATS, help="progress output format")
+    upload_parser.add_argument("-j", "--jobs", type=int, default=1, help=
+            "number of concurrent transfers")
+    upload_parser.add_argument("--delta", action='store_true', help=
+            "send only the changed blocks of the file(s)")
+    upload_parser.add_argument("--refresh", action='store_true', help=
+            "check every file on the server with --delta, ignoring the "
+            "cached remote state")
+    upload_parser.add_argument("--compress", type=str, default="none",
+            choices=serverCompress.CODECS, help="compress the file(s) "
+            "during the upload")
+    upload_parser.add_argument("--bundle", action='store_true', help=
+            "send the file(s) as a single tar stream")
+    upload_parser.add_argument("--backend", type=str, default="scp",
+            choices=serverSftp.BACKENDS, help="transfer protocol")
+    upload_parser.add_argument("--limit-rate", type=serverRate.parse_rate,
+            help="maximum bandwidth in bytes per second, K, M and G "
+            "suffixes are accepted")
+    upload_parser.add_argument("--window", type=int, help="bytes in flight "
+            "with the sftp backend")
+    upload_parser.add_argument("--verify", action='store_true', help=
+            "compare the checksums of the file(s) with the server")
+    upload_parser.add_argument("--transport",
+            type=serverTransport.parse_tuning, help="transport settings "
+            "overriding the settings of the server, e.g. "
+            "window=16M,ciphers=aes128-gcm@openssh.com")
     upload_parser.set_defaults(func=parser_upload_server) 
 
     # Download subcommand parser
@@ -173,15 +322,94 @@ if __name__ == "__main__":
             help="path to a server list file")
     download_parser.add_argument("-q", "--quiet", action='store_true', help=
             "removes verbosity.")
+    download_parser.add_argument("--progress", type=str, default="text",
+            choices=serverProgress.FORMATS, help="progress output format")
+    download_parser.add_argument("-j", "--jobs", type=int, default=1, help=
+            "number of concurrent channels fetching ranges of the file(s)")
+    download_parser.add_argument("--resume", action='store_true', help=
+            "resume interrupted downloads")
+    download_parser.add_argument("--compress", type=str, default="none",
+            choices=serverCompress.CODECS, help="compress the file(s) "
+            "during the download")
+    download_parser.add_argument("--bundle", action='store_true', help=
+            "receive the file(s) as a single tar stream")
+    download_parser.add_argument("--backend", type=str, default="scp",
+            choices=serverSftp.BACKENDS, help="transfer protocol")
+    download_parser.add_argument("--limit-rate", type=serverRate.parse_rate,
+            help="maximum bandwidth in bytes per second, K, M and G "
+            "suffixes are accepted")
+    download_parser.add_argument("--window", type=int, help="bytes "
+            "requested ahead with the sftp backend")
+    download_parser.add_argument("--verify", action='store_true', help=
+            "compare the checksums of the file(s) with the server")
+    download_parser.add_argument("--transport",
+            type=serverTransport.parse_tuning, help="transport settings "
+            "overriding the settings of the server, e.g. "
+            "window=16M,ciphers=aes128-gcm@openssh.com")
     download_parser.set_defaults(func=parser_download_server) 
     
+    # Copy subcommand parser
+    copy_parser = subparsers.add_parser("copy", help=
+            "Copy file(s) from a remote server to another")
+    copy_parser.add_argument("source", type=str, nargs='+', help=
+            "server:path of the file(s) to copy, on the same server")
+    copy_parser.add_argument("target", type=str, help=
+            "server:path of the destination directory")
+    copy_parser.add_argument("-P", "--path", type=str, default=server_path,
+            help="path to a server list file")
+    copy_parser.add_argument("-q", "--quiet", action='store_true', help=
+            "removes verbosity.")
+    copy_parser.add_argument("--progress", type=str, default="text",
+            choices=serverProgress.FORMATS, help="progress output format")
+    copy_parser.add_argument("--compress", type=str, default="none",
+            choices=list(serverCompress.REMOTE_COMPRESS), help=
+            "compress the stream on the servers")
+    copy_parser.add_argument("--direct", action='store_true', help=
+            "the source server sends the file(s) to the destination "
+            "server itself")
+    copy_parser.add_argument("--limit-rate", type=serverRate.parse_rate,
+            help="maximum bandwidth in bytes per second, K, M and G "
+            "suffixes are accepted")
+    copy_parser.add_argument("--transport", type=serverTransport.parse_tuning,
+            help="transport settings overriding the settings of the "
+            "server, e.g. window=16M,ciphers=aes128-gcm@openssh.com")
+    copy_parser.set_defaults(func=parser_copy_server)
+
+    # Watch subcommand parser
+    watch_parser = subparsers.add_parser("watch", help=
+            "Sync the changes of a local directory to a remote server")
+    watch_parser.add_argument("server", type=str, help=
+            "server number or server name (user@host)")
+    watch_parser.add_argument("local_dir", type=str, help=
+            "path to the local directory to watch")
+    watch_parser.add_argument("-t", "--target", type=str, default='.', help=
+            "path to the directory on the server")
+    watch_parser.add_argument("-p", "--port", type=str, help="port number")
+    watch_parser.add_argument("-o", "--options", type=str, default='', help=
+            "additional arguments for connection", nargs='*')
+    watch_parser.add_argument("-P", "--path", type=str, default=server_path,
+            help="path to a server list file")
+    watch_parser.add_argument("--exclude", type=str, action='append',
+            default=[], help="shell pattern of the paths to ignore, can be "
+            "repeated")
+    watch_parser.add_argument("--interval", type=float, help="scan the "
+            "directory every INTERVAL seconds instead of using inotify")
+    watch_parser.add_argument("--limit-rate", type=serverRate.parse_rate,
+            help="maximum bandwidth in bytes per second, K, M and G "
+            "suffixes are accepted")
+    watch_parser.add_argument("--transport", type=serverTransport.parse_tuning,
+            help="transport settings overriding the settings of the "
+            "server, e.g. window=16M,ciphers=aes128-gcm@openssh.com")
+    watch_parser.set_defaults(func=parser_watch_server)
+
     # Command subcommand paers
     command_parser = subparsers.add_parser("command", help=
             "Executes a command on the remote server")
     command_parser.add_argument("server", type=str, help=
-            "server number or server name (user@host)")
+            "server number(s), range(s) (1-4) or server name(s) "
+            "(user@host) separated by commas, or all")
     command_parser.add_argument("command", type=str, help=
-            "command to execute", nargs='+')
+            "command to execute", nargs='*')
     command_parser.set_defaults(func=parser_command_server)
     command_parser.add_argument("-p", "--port", type=str, help="port number")
     command_parser.add_argument("-o", "--options", type=str, default='', help=
@@ -190,11 +418,74 @@ if __name__ == "__main__":
             "additional arguments for the command")
     command_parser.add_argument("-P", "--path", type=str, default=server_path, 
             help="path to a server list file")
-
-    args = parser.parse_args() 
+    command_parser.add_argument("-j", "--jobs", type=int, default=10, help=
+            "number of servers the command runs on concurrently")
+    command_parser.add_argument("--in-process", action="store_true", help=
+            "run the command over a paramiko channel instead of ssh")
+    command_parser.add_argument("-f", "--file", type=str, help=
+            "file of commands run in order over one connection, one per "
+            "line, implies --in-process")
+    command_parser.add_argument("--tee", type=str, metavar="DIR", help=
+            "also write the output of each server to DIR/user@host.out "
+            "and .err, implies --in-process")
+
+    # Batch subcommand parser
+    batch_parser = subparsers.add_parser("batch", help=
+            "Run the upload, download and command jobs of a file")
+    batch_parser.add_argument("jobs_file", type=str, help=
+            "path to a YAML or JSON lines file of jobs")
+    batch_parser.add_argument("-P", "--path", type=str, default=server_path,
+            help="path to a server list file")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=8, help=
+            "number of jobs running concurrently")
+    batch_parser.add_argument("--per-host", type=int, default=2, help=
+            "number of jobs running concurrently on the same host")
+    batch_parser.add_argument("--limit-rate", type=serverRate.parse_rate,
+            help="maximum bandwidth of all the transfers in bytes per "
+            "second, K, M and G suffixes are accepted")
+    batch_parser.add_argument("--transport", type=serverTransport.parse_tuning,
+            help="transport settings overriding the settings of the "
+            "server, e.g. window=16M,ciphers=aes128-gcm@openssh.com")
+    batch_parser.set_defaults(func=parser_batch)
+
+    # Broker subcommand parser
+    broker_parser = subparsers.add_parser("broker", help=
+            "Manage the connection broker")
+    broker_parser.add_argument("action", type=str, choices=["start", "stop",
+        "status"], help="broker action")
+    broker_parser.add_argument("--idle-timeout", type=int, help=
+            "seconds before an unused connection is closed (default: 600)")
+    broker_parser.set_defaults(func=parser_broker)
+
+    args, extra = parser.parse_known_args()
+
+    # The command words given after the options of the command
+    # subcommand are left over since its command can be empty.
+    if getattr(args, "func", None) == parser_command_server and \
+            not any(word.startswith('-') for word in extra):
+        args.command += extra
+
+    elif extra:
+        parser.error("unrecognized arguments: {}".format(' '.join(extra)))
+
+    if getattr(args, "func", None) in (parser_upload_server,
+            parser_download_server):
+        upload = args.func == parser_upload_server
+        conflict = serverFunctions.transfer_conflict(upload, args.jobs,
+                getattr(args, "delta", False), getattr(args, "resume", False),
+                getattr(args, "refresh", False), args.compress, args.bundle,
+                args.backend, args.window)
+
+        if conflict:
+            (upload_parser if upload else download_parser).error(conflict)
+    serverMetrics.set_output(args.metrics)
+
+    profile = serverProfile.profiled(args.profile, args.profile_output) \
+            if args.profile else contextlib.nullcontext()
 
     try:
-        args.func(args)
+        with profile:
+            args.func(args)
 
     except AttributeError:
         sys.stderr.write("Invalid usage\n")
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Batches of upload, download and command jobs run across the servers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import sys
+import json
+import time
+import threading
+import collections
+import concurrent.futures
+import serverLazy
+import serverSftp
+import serverCompress
+import serverMetrics
+import serverExec
+import serverFunctions
+
+try:
+    yaml = serverLazy.lazy_import("yaml")
+
+except ImportError:
+    yaml = None
+
+
+# Loaded on first use, see serverLazy.
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+WORKERS = 8
+PER_HOST = 2
+
+# Fields of the jobs and their types, the transfer fields are the
+# arguments of Server.upload and Server.download.
+COMMON_FIELDS = {"id": str, "type": str, "server": str, "port": str,
+        "after": list}
+TYPES = {
+        "upload": {"source": list, "target": str, "recursive": bool,
+            "jobs": int, "delta": bool, "refresh": bool, "compress": str,
+            "bundle": bool, "backend": str, "window": int, "verify": bool},
+        "download": {"source": list, "target": str, "recursive": bool,
+            "jobs": int, "resume": bool, "compress": str, "bundle": bool,
+            "backend": str, "window": int, "verify": bool},
+        "command": {"command": str}}
+REQUIRED = {"upload": ["source"], "download": ["source"],
+        "command": ["command"]}
+CHOICES = {"compress": serverCompress.CODECS,
+        "backend": serverSftp.BACKENDS}
+
+
+def load_jobs(jobs_path):
+    """ Loads the jobs of a batch file.
+
+    YAML files (.yaml or .yml) contain a list of jobs or a mapping with
+    a jobs list, the other files contain one JSON job per line. Empty
+    lines and lines starting with # are ignored in JSON files.
+    Arguments:
+    jobs_path -- str, path to the batch file.
+
+    Returns:
+    jobs -- list[dict], jobs of the batch.
+
+    """
+    with open(jobs_path, 'r') as f_handle:
+        if jobs_path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("the PyYAML package is required for YAML "
+                        "batch files")
+
+            try:
+                jobs = yaml.safe_load(f_handle) or []
+
+            except yaml.YAMLError as err:
+                raise ValueError(str(err))
+
+            if isinstance(jobs, dict):
+                jobs = jobs.get("jobs", [])
+
+            if not isinstance(jobs, list):
+                raise ValueError("expected a list of jobs")
+
+            return jobs
+
+        jobs = []
+
+        for line_number, line in enumerate(f_handle, 1):
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+
+            try:
+                jobs.append(json.loads(line))
+
+            except ValueError as err:
+                raise ValueError("line {}: {}".format(line_number, err))
+
+        return jobs
+
+
+def check_job(index, job):
+    """ Checks the fields of a job and normalises them.
+
+    Arguments:
+    index -- int, position of the job in the batch.
+    job -- dict, job to check.
+
+    Returns:
+    job -- dict, job with an id, lists of sources and dependencies and
+        str server and port.
+
+    """
+    if not isinstance(job, dict):
+        raise ValueError("job {}: expected a mapping".format(index+1))
+
+    job = dict(job)
+    job["id"] = str(job.get("id", index+1))
+    job["after"] = job.get("after", [])
+
+    for key in ["server", "port"]:
+        if isinstance(job.get(key), int):
+            job[key] = str(job[key])
+
+    for key in ["source", "after"]:
+        if isinstance(job.get(key), (str, int)):
+            job[key] = [job[key]]
+
+    job["after"] = [str(name) for name in job["after"]] \
+            if isinstance(job["after"], list) else job["after"]
+
+    if job.get("type") not in TYPES:
+        raise ValueError("job {}: type must be one of {}".format(job["id"],
+            ', '.join(TYPES)))
+
+    fields = dict(COMMON_FIELDS, **TYPES[job["type"]])
+
+    for key in ["server"] + REQUIRED[job["type"]]:
+        if key not in job:
+            raise ValueError("job {}: {} is missing".format(job["id"], key))
+
+    for key, value in job.items():
+        if key not in fields:
+            raise ValueError("job {}: unknown field {}".format(job["id"],
+                key))
+
+        if not isinstance(value, fields[key]):
+            raise ValueError("job {}: {} must be of type {}".format(
+                job["id"], key, fields[key].__name__))
+
+        if key in CHOICES and value not in CHOICES[key]:
+            raise ValueError("job {}: {} must be one of {}".format(
+                job["id"], key, ', '.join(CHOICES[key])))
+
+    if job["type"] != "command":
+        conflict = serverFunctions.transfer_conflict(job["type"] ==
+                "upload", **{key: job[key] for key in ["jobs", "delta",
+                    "resume", "refresh", "compress", "bundle", "backend",
+                    "window"] if key in job})
+
+        if conflict:
+            raise ValueError("job {}: {}".format(job["id"], conflict
+                .replace("--backend sftp", "backend sftp")
+                .replace("--", "")))
+
+    return job
+
+
+def check_jobs(jobs):
+    """ Checks the jobs of a batch and their dependencies.
+
+    Arguments:
+    jobs -- list[dict], jobs of the batch.
+
+    Returns:
+    jobs -- list[dict], normalised jobs, see check_job.
+
+    """
+    jobs = [check_job(index, job) for index, job in enumerate(jobs)]
+    names = set()
+
+    for job in jobs:
+        if job["id"] in names:
+            raise ValueError("job {}: duplicate id".format(job["id"]))
+
+        names.add(job["id"])
+
+    for job in jobs:
+        for name in job["after"]:
+            if name not in names:
+                raise ValueError("job {}: unknown dependency {}".format(
+                    job["id"], name))
+
+    # Removes the jobs whose dependencies are all removed, the jobs left
+    # depend on each other.
+    done = set()
+    remaining = jobs
+
+    while remaining:
+        ready = [job["id"] for job in remaining if done.issuperset(
+            job["after"])]
+
+        if not ready:
+            raise ValueError("circular dependencies between jobs {}".format(
+                ', '.join(job["id"] for job in remaining)))
+
+        done.update(ready)
+        remaining = [job for job in remaining if job["id"] not in done]
+
+    return jobs
+
+
+def run_command(server_object, command, prefix, output_lock):
+    """ Executes a command over the transport of a server.
+
+    Arguments:
+    server_object -- serverFunctions.Server, server to run on.
+    command -- str, command to execute.
+    prefix -- str, prefix of the output lines.
+    output_lock -- threading.Lock, lock shared by the outputs of
+        concurrent jobs.
+
+    Returns:
+    exit_status -- int, exit status of the command.
+
+    """
+    with server_object.open_transport() as transport:
+        return serverExec.run(transport, command, prefix,
+                output_lock)["exit_status"]
+
+
+class Batch:
+    """ Scheduler of the jobs of a batch.
+
+    A job starts once the jobs it comes after have succeeded, it is
+    skipped if one of them failed. At most workers jobs run at the same
+    time and at most per_host of them on the same host, the ready jobs
+    start in the order of the batch file. The jobs on the same server
+    share a single connection.
+    """
+
+    def __init__(self, file_path, jobs, workers=WORKERS, per_host=PER_HOST):
+        """ Initialise batch object.
+
+        Arguments:
+        file_path -- str, path to file containing the servers.
+        jobs -- list[dict], checked jobs, see check_jobs.
+        workers -- int, maximum number of running jobs,
+            default value WORKERS.
+        per_host -- int, maximum number of running jobs on a host,
+            default value PER_HOST.
+
+        Returns:
+        batch -- Batch, batch object.
+
+        """
+        self.jobs = jobs
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.output_lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+        registry = serverFunctions.get_servers(file_path)
+        selected = {}
+        servers = {}
+        self.targets = {}
+
+        for job in jobs:
+            key = (job["server"], job.get("port"))
+
+            if key not in selected:
+                server_object = serverFunctions.setup_server(file_path,
+                        job["server"], job.get("port"), '', registry)
+
+                # A server selected by number and by name is the same
+                # connection. Parsed now, the servers are then used by
+                # several threads.
+                selected[key] = servers.setdefault("{}:{}".format(
+                    server_object.get_server_name(),
+                    server_object.get_port()), server_object)
+
+            self.targets[job["id"]] = selected[key]
+
+        self.servers = list(servers.values())
+
+
+    def run_job(self, job):
+        """ Runs a job.
+
+        Arguments:
+        job -- dict, job to run.
+
+        Returns:
+        exit_status -- int, exit status of the job, 0 on success.
+        elapsed -- float, duration of the job in seconds.
+
+        """
+        server_object = self.targets[job["id"]]
+        start = time.monotonic()
+
+        try:
+            with serverMetrics.operation(job["type"],
+                    server_object.get_server_name(),
+                    server_object.get_port()) as record:
+                if record is not None:
+                    record["job"] = job["id"]
+
+                # The connections are opened one at a time so that the
+                # password prompts do not overlap.
+                with self.connect_lock:
+                    server_object.share_transport()
+
+                if job["type"] == "command":
+                    exit_status = run_command(server_object, job["command"],
+                            job["id"], self.output_lock)
+
+                else:
+                    options = {key: value for key, value in job.items()
+                            if key in TYPES[job["type"]]}
+                    options["src_path"] = options.pop("source")
+                    options["dest_path"] = options.pop("target", '.')
+                    getattr(server_object, job["type"])(quiet=True,
+                            **options)
+                    exit_status = 0
+
+                if record is not None:
+                    record["status"] = exit_status
+
+        except SystemExit as err:
+            exit_status = err.code if isinstance(err.code, int) else \
+                    int(err.code is not None)
+
+        except (OSError, paramiko.SSHException) as err:
+            with self.output_lock:
+                sys.stderr.write("[{}] {}\n".format(job["id"], err))
+
+            exit_status = 255
+
+        return exit_status, time.monotonic() - start
+
+
+    def run(self):
+        """ Runs the jobs.
+
+        Arguments:
+
+        Returns:
+        results -- dict{str: tuple(int, float)}, exit status, None if
+            skipped, and duration of each job by id.
+
+        """
+        order = {job["id"]: index for index, job in enumerate(self.jobs)}
+        waiting = {job["id"]: len(set(job["after"])) for job in self.jobs}
+        dependents = {job["id"]: [] for job in self.jobs}
+        queues = collections.defaultdict(collections.deque)
+        active = collections.Counter()
+        results = {}
+        running = {}
+
+        for job in self.jobs:
+            for name in set(job["after"]):
+                dependents[name].append(job)
+
+            if not job["after"]:
+                queues[self.targets[job["id"]].get_host()].append(job)
+
+        def skip_dependents(job):
+            stack = list(dependents[job["id"]])
+
+            while stack:
+                dependent = stack.pop()
+
+                if dependent["id"] not in results:
+                    results[dependent["id"]] = (None, 0.)
+                    stack.extend(dependents[dependent["id"]])
+
+        executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+
+        try:
+            while len(results) < len(self.jobs):
+                while len(running) < self.workers:
+                    hosts = [host for host, queue in queues.items()
+                            if queue and active[host] < self.per_host]
+
+                    if not hosts:
+                        break
+
+                    host = min(hosts, key=lambda host: order[
+                        queues[host][0]["id"]])
+                    job = queues[host].popleft()
+                    active[host] += 1
+                    running[executor.submit(self.run_job, job)] = job
+
+                done, _ = concurrent.futures.wait(running,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    job = running.pop(future)
+                    host = self.targets[job["id"]].get_host()
+                    active[host] -= 1
+                    exit_status, elapsed = future.result()
+                    results[job["id"]] = (exit_status, elapsed)
+
+                    with self.output_lock:
+                        print("[{}] {} in {:.2f}s.".format(job["id"],
+                            "done" if exit_status == 0 else
+                            "failed with exit {}".format(exit_status),
+                            elapsed))
+
+                    if exit_status != 0:
+                        skip_dependents(job)
+                        continue
+
+                    for dependent in dependents[job["id"]]:
+                        waiting[dependent["id"]] -= 1
+
+                        if waiting[dependent["id"]] == 0 and \
+                                dependent["id"] not in results:
+                            queues[self.targets[dependent["id"]
+                                ].get_host()].append(dependent)
+
+        except KeyboardInterrupt:
+            for future in running:
+                future.cancel()
+
+            sys.stderr.write("\nBatch canceled.\n")
+            exit(1)
+
+        finally:
+            executor.shutdown(wait=False)
+
+            for server_object in self.servers:
+                server_object.close_transport()
+
+        return results
+
+
+    def report(self, results):
+        """ Prints the status and duration of each job.
+
+        Arguments:
+        results -- dict{str: tuple(int, float)}, results of the jobs,
+            see run.
+
+        Returns:
+        failed -- int, number of jobs that failed or were skipped.
+
+        """
+        counts = collections.Counter()
+        print("Summary:")
+
+        for job in self.jobs:
+            exit_status, elapsed = results[job["id"]]
+            server_name = self.targets[job["id"]].get_server_name()
+
+            if exit_status is None:
+                status = "skipped"
+
+            else:
+                status = "exit {}, {:.2f}s".format(exit_status, elapsed)
+
+            counts["skipped" if exit_status is None else "succeeded"
+                    if exit_status == 0 else "failed"] += 1
+            print(" {} ({} on {}): {}".format(job["id"], job["type"],
+                server_name, status))
+
+        print("{} succeeded, {} failed, {} skipped.".format(
+            counts["succeeded"], counts["failed"], counts["skipped"]))
+
+        return counts["failed"] + counts["skipped"]
+
+
+def run_batch(file_path, jobs_path, workers=WORKERS, per_host=PER_HOST):
+    """ Runs the jobs of a batch file.
+
+    See Batch for the scheduling of the jobs and load_jobs for the
+    format of the batch file.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    jobs_path -- str, path to the batch file.
+    workers -- int, maximum number of running jobs,
+        default value WORKERS.
+    per_host -- int, maximum number of running jobs on a host,
+        default value PER_HOST.
+
+    Returns:
+
+    """
+    try:
+        jobs = check_jobs(load_jobs(jobs_path))
+
+    except OSError as err:
+        sys.stderr.write("Error: {}\n".format(err))
+        exit(2)
+
+    except ValueError as err:
+        sys.stderr.write("Error in {}: {}\n".format(jobs_path, err))
+        exit(1)
+
+    batch = Batch(file_path, jobs, workers, per_host)
+
+    if batch.report(batch.run()):
+        exit(1)
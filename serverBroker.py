@@ -0,0 +1,1065 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Connection broker keeping authenticated transports open.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import getpass
+import threading
+import collections
+import socketserver
+import serverLazy
+import serverTransport
+
+
+# Loaded on first use, see serverLazy.
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+SOCKET_PATH = os.path.join(os.path.expanduser('~'), ".local/var/broker.sock")
+IDLE_TIMEOUT = 600
+KEEPALIVE = 30
+BUFF_SIZE = 32768
+
+# Output bytes a client channel holds for each of stdout and stderr
+# before it stops reading the broker socket, the broker then stops
+# reading the channel and the window of the SSH channel throttles the
+# server as without the broker. A stream keeps being read past its
+# limit while the consumer waits for the other one.
+MAX_BUFFERED = 2097152
+
+# Frame types exchanged once a channel is attached.
+STDIN = b'i'
+STDIN_EOF = b'e'
+STDOUT = b'o'
+STDERR = b'r'
+EXIT = b'x'
+
+
+###################
+## Frame helpers ##
+###################
+
+
+def send_frame(sock, kind, payload=b''):
+    """ Sends a frame on the broker socket.
+
+    Arguments:
+    sock -- socket.socket, broker socket.
+    kind -- bytes, frame type.
+    payload -- bytes, frame content, default value b''.
+
+    Returns:
+
+    """
+    sock.sendall(kind + struct.pack("!I", len(payload)) + payload)
+
+
+def recv_frame(sock_file):
+    """ Receives a frame from the broker socket.
+
+    Arguments:
+    sock_file -- file, binary file object of the broker socket.
+
+    Returns:
+    kind -- bytes, frame type, b'' if the socket was closed.
+    payload -- bytes, frame content.
+
+    """
+    header = sock_file.read(5)
+
+    if len(header) < 5:
+        return b'', b''
+
+    length = struct.unpack("!I", header[1:])[0]
+
+    return header[0:1], sock_file.read(length)
+
+
+def send_request(sock, sock_file, request):
+    """ Sends a request to the broker and reads the reply.
+
+    Arguments:
+    sock -- socket.socket, broker socket.
+    sock_file -- file, binary file object of the broker socket.
+    request -- dict, request to send.
+
+    Returns:
+    reply -- dict, broker reply.
+
+    """
+    sock.sendall(json.dumps(request).encode() + b'\n')
+    line = sock_file.readline()
+
+    if not line:
+        return {"status": "error", "message": "No reply from broker"}
+
+    return json.loads(line.decode())
+
+
+##################
+## Broker class ##
+##################
+
+
+class Broker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Unix socket server holding one transport per remote server. """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=SOCKET_PATH, idle_timeout=IDLE_TIMEOUT):
+        """ Initialise broker object.
+
+        Arguments:
+        socket_path -- str, path to the unix socket,
+            default value SOCKET_PATH.
+        idle_timeout -- int, seconds before an unused transport is
+            closed, default value IDLE_TIMEOUT.
+
+        Returns:
+        broker -- Broker, broker object.
+
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        old_umask = os.umask(0o077)
+        super().__init__(socket_path, BrokerHandler)
+        os.umask(old_umask)
+
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+
+
+    def get_transport(self, key):
+        """ Gets the active transport of a server.
+
+        Arguments:
+        key -- str, server key (user@host:port).
+
+        Returns:
+        transport -- paramiko.transport.Transport, active transport or
+            None if the server is not connected.
+
+        """
+        with self.lock:
+            entry = self.connections.get(key)
+
+            if entry is None:
+                return None
+
+            if not entry["ssh"].get_transport() or \
+                    not entry["ssh"].get_transport().is_active():
+                entry["ssh"].close()
+                del self.connections[key]
+                return None
+
+            entry["last_used"] = time.monotonic()
+
+            return entry["ssh"].get_transport()
+
+
+    def add_connection(self, key, user, host, port, password, tuning=None):
+        """ Connects to a server and keeps the transport.
+
+        Agent authentication is tried before password authentication.
+        Arguments:
+        key -- str, server key (user@host:port).
+        user -- str, server user.
+        host -- str, server host.
+        port -- str, server port number.
+        password -- str, password of the user.
+        tuning -- dict, transport settings, see serverTransport,
+            default value None.
+
+        Returns:
+
+        """
+        tuning = tuning or {}
+        factory = serverTransport.transport_factory(tuning)
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+
+        try:
+            ssh.connect(host, port=int(port), username=user,
+                    password=password, allow_agent=True,
+                    transport_factory=factory)
+
+        except paramiko.AuthenticationException:
+            ssh.connect(host, port=int(port), username=user,
+                    password=password, allow_agent=False,
+                    transport_factory=factory)
+
+        serverTransport.apply_keepalive(ssh.get_transport(), tuning,
+                KEEPALIVE)
+
+        with self.lock:
+            if key in self.connections:
+                self.connections[key]["ssh"].close()
+
+            self.connections[key] = {"ssh": ssh, "channels": 0,
+                    "last_used": time.monotonic()}
+
+
+    def use_channel(self, key, delta):
+        """ Updates the number of open channels of a server.
+
+        Arguments:
+        key -- str, server key (user@host:port).
+        delta -- int, change in the number of channels.
+
+        Returns:
+
+        """
+        with self.lock:
+            if key in self.connections:
+                self.connections[key]["channels"] += delta
+                self.connections[key]["last_used"] = time.monotonic()
+
+
+    def status(self):
+        """ Gets the status of the kept connections.
+
+        Arguments:
+
+        Returns:
+        status -- list[dict], server key, idle time and number of open
+            channels of each connection.
+
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            return [{"server": key, "idle": int(now - entry["last_used"]),
+                "channels": entry["channels"]}
+                for key, entry in self.connections.items()]
+
+
+    def reap(self):
+        """ Closes the transports that have been idle for too long.
+
+        Arguments:
+
+        Returns:
+
+        """
+        while True:
+            time.sleep(min(30, self.idle_timeout))
+            now = time.monotonic()
+
+            with self.lock:
+                for key in list(self.connections):
+                    entry = self.connections[key]
+
+                    if entry["channels"] == 0 and \
+                            now - entry["last_used"] > self.idle_timeout:
+                        entry["ssh"].close()
+                        del self.connections[key]
+
+
+    def stop(self):
+        """ Closes all the transports and stops the broker.
+
+        Arguments:
+
+        Returns:
+
+        """
+        with self.lock:
+            for entry in self.connections.values():
+                entry["ssh"].close()
+
+            self.connections.clear()
+
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    """ Handles one request made to the broker. """
+
+    def handle(self):
+        """ Reads the request and dispatches it.
+
+        Arguments:
+
+        Returns:
+
+        """
+        line = self.rfile.readline()
+
+        if not line:
+            return None
+
+        request = json.loads(line.decode())
+        op = request.get("op")
+
+        if op == "attach":
+            self.attach(request)
+
+        elif op == "exec":
+            self.exec(request)
+
+        elif op == "status":
+            self.reply(status="ok", connections=self.server.status())
+
+        elif op == "stop":
+            self.reply(status="ok")
+            self.server.stop()
+
+        else:
+            self.reply(status="error", message="Unknown request")
+
+
+    def reply(self, **reply):
+        """ Sends a reply to the client.
+
+        Arguments:
+        reply -- dict, reply content.
+
+        Returns:
+
+        """
+        self.request.sendall(json.dumps(reply).encode() + b'\n')
+
+
+    def attach(self, request):
+        """ Checks that a server is connected, connects it if a password
+        is provided.
+
+        Arguments:
+        request -- dict, attach request.
+
+        Returns:
+
+        """
+        key = request["key"]
+
+        if self.server.get_transport(key) is not None:
+            self.reply(status="ok")
+            return None
+
+        if request.get("password") is None:
+            self.reply(status="auth")
+            return None
+
+        try:
+            self.server.add_connection(key, request["user"],
+                    request["host"], request["port"], request["password"],
+                    request.get("tuning"))
+            self.reply(status="ok")
+
+        except (OSError, paramiko.SSHException) as err:
+            self.reply(status="error", message=str(err))
+
+
+    def exec(self, request):
+        """ Runs a command on a new channel and relays its streams.
+
+        The request starts a subsystem instead if it has a subsystem
+        field.
+
+        Arguments:
+        request -- dict, exec request.
+
+        Returns:
+
+        """
+        key = request["key"]
+        transport = self.server.get_transport(key)
+
+        if transport is None:
+            self.reply(status="auth")
+            return None
+
+        try:
+            channel = transport.open_session()
+
+            if "subsystem" in request:
+                channel.invoke_subsystem(request["subsystem"])
+
+            else:
+                channel.exec_command(request["command"])
+
+        except paramiko.SSHException as err:
+            self.reply(status="error", message=str(err))
+            return None
+
+        self.reply(status="ok")
+        self.server.use_channel(key, 1)
+        send_lock = threading.Lock()
+
+        def relay_stdin():
+            try:
+                while True:
+                    kind, payload = recv_frame(self.rfile)
+
+                    if kind == STDIN:
+                        channel.sendall(payload)
+
+                    elif kind == STDIN_EOF:
+                        channel.shutdown_write()
+
+                    else:
+                        break
+
+            except (OSError, paramiko.SSHException):
+                pass
+
+            channel.close()
+
+        def relay_stderr():
+            for data in iter(lambda: channel.recv_stderr(BUFF_SIZE), b''):
+                with send_lock:
+                    send_frame(self.request, STDERR, data)
+
+        threads = [threading.Thread(target=relay_stdin, daemon=True),
+                threading.Thread(target=relay_stderr, daemon=True)]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for data in iter(lambda: channel.recv(BUFF_SIZE), b''):
+                with send_lock:
+                    send_frame(self.request, STDOUT, data)
+
+            threads[1].join()
+
+            with send_lock:
+                send_frame(self.request, EXIT,
+                        struct.pack("!i", channel.recv_exit_status()))
+
+        except OSError:
+            # The client went away.
+            channel.close()
+
+        # Unblock the stdin relay before the handler closes its files.
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            pass
+
+        threads[0].join()
+        self.server.use_channel(key, -1)
+
+
+##########################
+## Client side objects ##
+##########################
+
+
+class BrokerTransport:
+    """ Transport-like object opening channels through the broker. """
+
+    def __init__(self, server_object, socket_path=SOCKET_PATH):
+        """ Initialise broker transport object.
+
+        The password is prompted for if the broker is not yet
+        connected to the server.
+        Arguments:
+        server_object -- Server, server to attach to.
+        socket_path -- str, path to the unix socket,
+            default value SOCKET_PATH.
+
+        Returns:
+        transport -- BrokerTransport, broker transport object.
+
+        """
+        self.socket_path = socket_path
+        self.host = server_object.get_host()
+        self.port = int(server_object.get_port())
+        self.key = "{}:{}".format(server_object.get_server_name(),
+                server_object.get_port())
+
+        request = {"op": "attach", "key": self.key,
+                "user": server_object.get_user(), "host": self.host,
+                "port": server_object.get_port(),
+                "tuning": server_object.get_tuning()}
+        reply = self._request(request)
+
+        if reply["status"] == "auth":
+            request["password"] = server_object.password
+
+            if request["password"] is None:
+                request["password"] = getpass.getpass("{}'s password: "
+                        .format(server_object.get_server_name()))
+
+            reply = self._request(request)
+
+        if reply["status"] != "ok":
+            raise paramiko.SSHException(reply.get("message"))
+
+
+    def _request(self, request):
+        """ Sends a single request to the broker.
+
+        Arguments:
+        request -- dict, request to send.
+
+        Returns:
+        reply -- dict, broker reply.
+
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+
+            with sock.makefile('rb') as sock_file:
+                return send_request(sock, sock_file, request)
+
+
+    def getpeername(self):
+        """ Gets the address of the remote server.
+
+        Arguments:
+
+        Returns:
+        peername -- tuple(str, int), host and port of the server.
+
+        """
+        return (self.host, self.port)
+
+
+    def open_session(self):
+        """ Opens a new channel through the broker.
+
+        Arguments:
+
+        Returns:
+        channel -- BrokerChannel, channel object.
+
+        """
+        return BrokerChannel(self)
+
+
+    def is_active(self):
+        """ Checks if the broker can be reached.
+
+        Arguments:
+
+        Returns:
+        active -- boolean, True if the broker socket exists.
+
+        """
+        return os.path.exists(self.socket_path)
+
+
+    def close(self):
+        """ Detaches from the broker, the transport stays open.
+
+        Arguments:
+
+        Returns:
+
+        """
+        return None
+
+
+class BrokerChannel:
+    """ Channel-like object relaying a remote command through the broker.
+
+    Only the subset of paramiko.channel.Channel used by scp, by the
+    SFTP client and by Server.exec_command is provided.
+    """
+
+    def __init__(self, transport):
+        """ Initialise broker channel object.
+
+        Arguments:
+        transport -- BrokerTransport, transport the channel belongs to.
+
+        Returns:
+        channel -- BrokerChannel, broker channel object.
+
+        """
+        self.transport = transport
+        self.timeout = None
+        self.closed = False
+        self.sock = None
+        self.sock_file = None
+        self.stdout = collections.deque()
+        self.stderr = collections.deque()
+        self.buffered = {STDOUT: 0, STDERR: 0}
+        self.waiting = {STDOUT: 0, STDERR: 0}
+        self.exit_status = None
+        self.eof = False
+        self.cond = threading.Condition()
+
+
+    def settimeout(self, timeout):
+        """ Sets the timeout of the blocking reads.
+
+        Arguments:
+        timeout -- float, timeout in seconds, None to block.
+
+        Returns:
+
+        """
+        self.timeout = timeout
+
+
+    def get_name(self):
+        """ Gets the name of the channel for the logs.
+
+        Arguments:
+
+        Returns:
+        name -- str, name of the channel.
+
+        """
+        return "broker"
+
+
+    def exec_command(self, command):
+        """ Runs a command on the server.
+
+        Arguments:
+        command -- str or bytes, command to run.
+
+        Returns:
+
+        """
+        if isinstance(command, bytes):
+            command = command.decode()
+
+        self._start({"command": command})
+
+
+    def invoke_subsystem(self, subsystem):
+        """ Starts a subsystem on the server.
+
+        Arguments:
+        subsystem -- str, name of the subsystem, e.g. sftp.
+
+        Returns:
+
+        """
+        self._start({"subsystem": subsystem})
+
+
+    def _start(self, request):
+        """ Sends an exec request to the broker and starts reading.
+
+        Arguments:
+        request -- dict, command or subsystem field of the request.
+
+        Returns:
+
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.transport.socket_path)
+        self.sock_file = self.sock.makefile('rb')
+        reply = send_request(self.sock, self.sock_file, dict(request,
+            op="exec", key=self.transport.key))
+
+        if reply["status"] != "ok":
+            self.close()
+            raise paramiko.SSHException(reply.get("message",
+                "Broker is not connected to the server"))
+
+        threading.Thread(target=self._read, daemon=True).start()
+
+
+    def _read(self):
+        """ Reads the frames sent by the broker.
+
+        Arguments:
+
+        Returns:
+
+        """
+        try:
+            while True:
+                kind, payload = recv_frame(self.sock_file)
+
+                with self.cond:
+                    if kind in (STDOUT, STDERR):
+                        # Waits for the consumer before the next frame.
+                        other = STDERR if kind == STDOUT else STDOUT
+                        self.cond.wait_for(lambda: self.closed or
+                                self.buffered[kind] < MAX_BUFFERED or
+                                self.waiting[other])
+                        self.buffered[kind] += len(payload)
+
+                    if kind == STDOUT:
+                        self.stdout.append(payload)
+
+                    elif kind == STDERR:
+                        self.stderr.append(payload)
+
+                    elif kind == EXIT:
+                        self.exit_status = struct.unpack("!i", payload)[0]
+
+                    else:
+                        break
+
+                    self.cond.notify_all()
+
+        except (OSError, ValueError):
+            pass
+
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+
+    def _wait(self, kind):
+        """ Waits for data on a stream or the end of the channel.
+
+        The reader is woken up so that it reads past the limit of the
+        other stream, the condition must be held.
+        Arguments:
+        kind -- int, STDOUT or STDERR.
+
+        Returns:
+        ready -- boolean, False if the timeout expired.
+
+        """
+        buffer = self.stdout if kind == STDOUT else self.stderr
+        self.waiting[kind] += 1
+        self.cond.notify_all()
+
+        try:
+            return self.cond.wait_for(lambda: buffer or self.eof,
+                    self.timeout)
+
+        finally:
+            self.waiting[kind] -= 1
+
+
+    def _pop(self, kind, nbytes):
+        """ Pops at most nbytes from the first chunk of a stream.
+
+        The reader is woken up if it waits for room in the buffers,
+        the condition must be held.
+        Arguments:
+        kind -- int, STDOUT or STDERR.
+        nbytes -- int, maximum number of bytes.
+
+        Returns:
+        data -- bytes, popped data.
+
+        """
+        buffer = self.stdout if kind == STDOUT else self.stderr
+        data = buffer.popleft()
+
+        if len(data) > nbytes:
+            buffer.appendleft(data[nbytes:])
+            data = data[:nbytes]
+
+        self.buffered[kind] -= len(data)
+        self.cond.notify_all()
+
+        return data
+
+
+    def recv(self, nbytes):
+        """ Receives data from the command standard output.
+
+        Arguments:
+        nbytes -- int, maximum number of bytes.
+
+        Returns:
+        data -- bytes, received data, b'' once the stream is closed.
+
+        """
+        with self.cond:
+            if not self._wait(STDOUT):
+                raise socket.timeout()
+
+            if self.stdout:
+                return self._pop(STDOUT, nbytes)
+
+            return b''
+
+
+    def recv_ready(self):
+        """ Checks if standard output data is available.
+
+        Arguments:
+
+        Returns:
+        ready -- boolean, True if data is available.
+
+        """
+        with self.cond:
+            return len(self.stdout) > 0
+
+
+    def recv_stderr_ready(self):
+        """ Checks if standard error data is available.
+
+        Arguments:
+
+        Returns:
+        ready -- boolean, True if data is available.
+
+        """
+        with self.cond:
+            return len(self.stderr) > 0
+
+
+    def recv_stderr(self, nbytes):
+        """ Receives data from the command standard error.
+
+        Arguments:
+        nbytes -- int, maximum number of bytes.
+
+        Returns:
+        data -- bytes, received data, b'' once the stream is closed.
+
+        """
+        with self.cond:
+            if not self._wait(STDERR):
+                raise socket.timeout()
+
+            if self.stderr:
+                return self._pop(STDERR, nbytes)
+
+            return b''
+
+
+    def send(self, data):
+        """ Sends data to the command standard input.
+
+        Arguments:
+        data -- str or bytes, data to send.
+
+        Returns:
+        nbytes -- int, number of bytes sent.
+
+        """
+        if isinstance(data, str):
+            data = data.encode()
+
+        send_frame(self.sock, STDIN, data)
+
+        return len(data)
+
+
+    def sendall(self, data):
+        """ Sends all the data to the command standard input.
+
+        Arguments:
+        data -- str or bytes, data to send.
+
+        Returns:
+
+        """
+        self.send(data)
+
+
+    def shutdown_write(self):
+        """ Closes the command standard input.
+
+        Arguments:
+
+        Returns:
+
+        """
+        send_frame(self.sock, STDIN_EOF)
+
+
+    def exit_status_ready(self):
+        """ Checks if the command has exited.
+
+        Arguments:
+
+        Returns:
+        ready -- boolean, True if the exit status was received.
+
+        """
+        return self.exit_status is not None
+
+
+    def recv_exit_status(self):
+        """ Waits for the command to exit.
+
+        Arguments:
+
+        Returns:
+        exit_status -- int, exit status, -1 if the broker did not
+            send one.
+
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.eof)
+
+        return -1 if self.exit_status is None else self.exit_status
+
+
+    def close(self):
+        """ Closes the channel.
+
+        Arguments:
+
+        Returns:
+
+        """
+        if self.closed:
+            return None
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+
+            except OSError:
+                pass
+
+            self.sock.close()
+
+
+######################
+## Broker functions ##
+######################
+
+
+def is_running(socket_path=SOCKET_PATH):
+    """ Checks if a broker is listening on the socket.
+
+    Arguments:
+    socket_path -- str, path to the unix socket,
+        default value SOCKET_PATH.
+
+    Returns:
+    running -- boolean, True if a broker answers on the socket.
+
+    """
+    if not os.path.exists(socket_path):
+        return False
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+
+        except OSError:
+            return False
+
+
+def request_broker(request, socket_path=SOCKET_PATH):
+    """ Sends a single request to a running broker.
+
+    Arguments:
+    request -- dict, request to send.
+    socket_path -- str, path to the unix socket,
+        default value SOCKET_PATH.
+
+    Returns:
+    reply -- dict, broker reply.
+
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+
+        with sock.makefile('rb') as sock_file:
+            return send_request(sock, sock_file, request)
+
+
+def start_broker(idle_timeout=IDLE_TIMEOUT, socket_path=SOCKET_PATH):
+    """ Starts the broker in the background.
+
+    Arguments:
+    idle_timeout -- int, seconds before an unused transport is
+        closed, default value IDLE_TIMEOUT.
+    socket_path -- str, path to the unix socket,
+        default value SOCKET_PATH.
+
+    Returns:
+
+    """
+    if is_running(socket_path):
+        print("Broker already running.")
+        return None
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    if os.fork() != 0:
+        # Wait for the broker to listen.
+        for _ in range(50):
+            if is_running(socket_path):
+                print("Broker started.")
+                return None
+
+            time.sleep(0.1)
+
+        sys.stderr.write("Error: broker could not be started.\n")
+        exit(1)
+
+    os.setsid()
+
+    with open(os.devnull, 'r+') as null:
+        for stream in (sys.stdin, sys.stdout, sys.stderr):
+            os.dup2(null.fileno(), stream.fileno())
+
+    # paramiko is loaded before the requests are handled by concurrent
+    # threads.
+    serverLazy.preload(paramiko)
+    broker = Broker(socket_path, idle_timeout)
+    threading.Thread(target=broker.reap, daemon=True).start()
+
+    try:
+        broker.serve_forever()
+
+    finally:
+        broker.server_close()
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        os._exit(0)
+
+
+def stop_broker(socket_path=SOCKET_PATH):
+    """ Stops a running broker.
+
+    Arguments:
+    socket_path -- str, path to the unix socket,
+        default value SOCKET_PATH.
+
+    Returns:
+
+    """
+    if not is_running(socket_path):
+        print("Broker not running.")
+        return None
+
+    request_broker({"op": "stop"}, socket_path)
+    print("Broker stopped.")
+
+
+def status_broker(socket_path=SOCKET_PATH):
+    """ Prints the connections kept by a running broker.
+
+    Arguments:
+    socket_path -- str, path to the unix socket,
+        default value SOCKET_PATH.
+
+    Returns:
+
+    """
+    if not is_running(socket_path):
+        print("Broker not running.")
+        return None
+
+    connections = request_broker({"op": "status"},
+            socket_path)["connections"]
+
+    print("Broker connections:")
+
+    for connection in connections:
+        print(" {}: idle {}s, {} channel(s)".format(connection["server"],
+            connection["idle"], connection["channels"]))
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Bundled transfers streaming many files as a single tar archive.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import queue
+import tarfile
+import threading
+import posixpath
+from shlex import quote
+import serverLazy
+import serverVerify
+import serverCompress
+
+
+# Loaded on first use, see serverLazy.
+scp = serverLazy.lazy_import("scp")
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+CHUNK_SIZE = 262144
+
+# Bytes of a server to server copy held in memory between the two
+# channels.
+RELAY_BUFFER = 16777216
+
+
+class ChannelWriter:
+    """ Write-only file object compressing data into a channel. """
+
+    def __init__(self, channel, codec):
+        """ Initialise channel writer object.
+
+        Arguments:
+        channel -- paramiko.channel.Channel, channel to write to.
+        codec -- str, codec name, none, zlib or zstd.
+
+        Returns:
+        writer -- ChannelWriter, channel writer object.
+
+        """
+        self.channel = channel
+        self.compress = serverCompress.compressor(codec)
+        self.sent = 0
+
+
+    def write(self, data):
+        """ Compresses and sends data.
+
+        Arguments:
+        data -- bytes, data to send.
+
+        Returns:
+        nbytes -- int, number of bytes written.
+
+        """
+        if data:
+            chunk = self.compress(bytes(data))
+            self.channel.sendall(chunk)
+            self.sent += len(chunk)
+
+        return len(data)
+
+
+    def close(self):
+        """ Flushes the compressor and closes the channel input.
+
+        Arguments:
+
+        Returns:
+
+        """
+        chunk = self.compress(b'')
+        self.channel.sendall(chunk)
+        self.sent += len(chunk)
+        self.channel.shutdown_write()
+
+
+class ChannelReader:
+    """ Read-only file object decompressing data from a channel. """
+
+    def __init__(self, channel, codec):
+        """ Initialise channel reader object.
+
+        Arguments:
+        channel -- paramiko.channel.Channel, channel to read from.
+        codec -- str, codec name, none, zlib or zstd.
+
+        Returns:
+        reader -- ChannelReader, channel reader object.
+
+        """
+        self.channel = channel
+        self.decompress = serverCompress.decompressor(codec)
+        self.buffer = bytearray()
+        self.received = 0
+        self.eof = False
+
+
+    def read(self, nbytes=-1):
+        """ Reads decompressed data.
+
+        Arguments:
+        nbytes -- int, maximum number of bytes, -1 to read everything,
+            default value -1.
+
+        Returns:
+        data -- bytes, read data, b'' at the end of the stream.
+
+        """
+        while not self.eof and (nbytes < 0 or len(self.buffer) < nbytes):
+            chunk = self.channel.recv(CHUNK_SIZE)
+
+            if not chunk:
+                self.eof = True
+                break
+
+            self.received += len(chunk)
+            self.buffer.extend(self.decompress(chunk))
+
+        if nbytes < 0:
+            nbytes = len(self.buffer)
+
+        data = bytes(self.buffer[:nbytes])
+        del self.buffer[:nbytes]
+
+        return data
+
+
+class ProgressReader:
+    """ File object reporting the progress of the reads of a file. """
+
+    def __init__(self, f_handle, name, size, update):
+        """ Initialise progress reader object.
+
+        Arguments:
+        f_handle -- file, opened file.
+        name -- str, name of the file.
+        size -- int, size of the file.
+        update -- function, progress callback, None for no progress.
+
+        Returns:
+        reader -- ProgressReader, progress reader object.
+
+        """
+        self.f_handle = f_handle
+        self.name = name
+        self.size = size
+        self.update = update
+        self.position = 0
+
+
+    def read(self, nbytes=-1):
+        """ Reads data from the file.
+
+        Arguments:
+        nbytes -- int, maximum number of bytes, default value -1.
+
+        Returns:
+        data -- bytes, read data.
+
+        """
+        data = self.f_handle.read(nbytes)
+        self.position += len(data)
+
+        if self.update:
+            self.update(self.name, self.size, self.position)
+
+        return data
+
+
+class HashingTarFile(tarfile.TarFile):
+    """ Tar archive hashing the regular files while extracting them. """
+
+    # Function returning the hash of a member, None for no hash.
+    member_hash = None
+
+
+    def makefile(self, tarinfo, targetpath):
+        """ Extracts the content of a regular file.
+
+        Arguments:
+        tarinfo -- tarfile.TarInfo, member of the archive.
+        targetpath -- str, path to the extracted file.
+
+        Returns:
+
+        """
+        if self.member_hash is None:
+            return super().makefile(tarinfo, targetpath)
+
+        source = self.fileobj
+        self.fileobj = serverVerify.HashingReader(source,
+                self.member_hash(tarinfo))
+
+        try:
+            super().makefile(tarinfo, targetpath)
+
+        finally:
+            self.fileobj = source
+
+
+def bundle_sources(src_path, recursive):
+    """ Lists the paths to put in the archive.
+
+    Arguments:
+    src_path -- list[str], paths of files to upload.
+    recursive -- boolean, lists directories recursively if True.
+
+    Returns:
+    members -- list[tuple(str, str)], local path and archive name of
+        each file or directory.
+    failures -- list[tuple(str, str)], path and reason of the sources
+        that cannot be transferred.
+
+    """
+    members = []
+    failures = []
+
+    for src in src_path:
+        arcname = os.path.basename(os.path.normpath(src))
+
+        if os.path.isdir(src) and recursive:
+            parent = os.path.dirname(os.path.abspath(src))
+
+            for root, dirs, files in os.walk(src):
+                relative = os.path.relpath(os.path.abspath(root), parent)
+                members.append((root, relative))
+
+                for name in sorted(dirs + files):
+                    path = os.path.join(root, name)
+
+                    if not os.path.isdir(path) or os.path.islink(path):
+                        members.append((path, os.path.join(relative, name)))
+
+        elif os.path.isdir(src):
+            failures.append((src, "Is a directory, use --recursive"))
+
+        elif os.path.lexists(src):
+            members.append((src, arcname))
+
+        else:
+            failures.append((src, "No such file or directory"))
+
+    return members, failures
+
+
+def put_bundle(transport, members, dest_path, codec, progress=None,
+        digests=None):
+    """ Uploads files as a single tar stream unpacked on the server.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    members -- list[tuple(str, str)], local path and archive name of
+        each file or directory, see bundle_sources.
+    dest_path -- str, path to the destination directory.
+    codec -- str, requested codec, see serverCompress.CODECS.
+    progress -- serverProgress.Progress, progress of the transfer,
+        default value None.
+    digests -- serverVerify.Digests, checksums of the files sent,
+        default value None.
+
+    Returns:
+    sent -- int, number of bytes sent.
+
+    """
+    sample = b''
+
+    for path, _ in members:
+        if os.path.isfile(path) and not os.path.islink(path):
+            with open(path, 'rb') as f_handle:
+                sample = f_handle.read(serverCompress.SAMPLE_SIZE)
+
+            break
+
+    codec = serverCompress.resolve_codec(codec, "bundle", sample)
+    channel = transport.open_session()
+    channel.exec_command(extract_command(dest_path, codec))
+    writer = ChannelWriter(channel, codec)
+
+    with tarfile.open(fileobj=writer, mode='w|',
+            format=tarfile.PAX_FORMAT) as tar:
+        for path, arcname in members:
+            tarinfo = tar.gettarinfo(path, arcname)
+
+            if not tarinfo.isreg():
+                tar.addfile(tarinfo)
+                continue
+
+            update = progress.callback(path, tarinfo.size) \
+                    if progress else None
+
+            with open(path, 'rb') as f_handle:
+                if digests is not None:
+                    f_handle = serverVerify.HashingReader(f_handle,
+                            digests.new(posixpath.join(dest_path, arcname)))
+
+                tar.addfile(tarinfo, ProgressReader(f_handle, path,
+                    tarinfo.size, update))
+
+            if update:
+                update(path, tarinfo.size, tarinfo.size)
+
+    writer.close()
+    serverCompress.close_channel(channel, dest_path)
+
+    return writer.sent
+
+
+def extract_command(dest_path, codec):
+    """ Builds the command unpacking a tar stream into a directory.
+
+    Arguments:
+    dest_path -- str, path to the remote destination directory.
+    codec -- str, codec of the stream, none, zlib or zstd.
+
+    Returns:
+    command -- str, shell command reading the standard input.
+
+    """
+    extract = "tar -xf -"
+
+    if codec != "none":
+        extract = "{} | {}".format(serverCompress.REMOTE_DECOMPRESS[codec],
+                extract)
+
+    if dest_path == '~' or dest_path.startswith('~/'):
+        directory = '"$HOME"' + quote(dest_path[1:] or '/')
+
+    else:
+        directory = quote(dest_path)
+
+    return "mkdir -p {0} && cd {0} && {1}".format(directory, extract)
+
+
+def archive_command(src_path, codec):
+    """ Builds the command packing remote files as a tar stream.
+
+    The command fails before writing anything if a file is missing.
+    Arguments:
+    src_path -- list[str], paths of the remote files or directories.
+    codec -- str, codec of the stream, none, zlib or zstd.
+
+    Returns:
+    command -- str, shell command writing to the standard output.
+
+    """
+    check = ""
+    create = "tar -cf -"
+
+    for src in src_path:
+        directory = remote_dir_expression(src)
+        name = quote(posixpath.basename(posixpath.normpath(src)))
+        check += "test -e {0}/{1} || {{ echo {2}: No such file or " \
+                "directory >&2; exit 2; }}; ".format(directory, name,
+                        quote(src))
+        create += " -C {} {}".format(directory, name)
+
+    if codec != "none":
+        create = "{} | {}".format(create,
+                serverCompress.REMOTE_COMPRESS[codec])
+
+    return check + create
+
+
+def remote_dir_expression(path):
+    """ Builds a shell expression of the directory of a remote path.
+
+    Relative paths are anchored to the working directory since the
+    -C options of tar are relative to each other.
+    Arguments:
+    path -- str, remote path.
+
+    Returns:
+    expression -- str, shell expression of the absolute directory.
+
+    """
+    directory = posixpath.dirname(posixpath.normpath(path)) or '.'
+
+    if directory.startswith('/'):
+        return quote(directory)
+
+    if directory == '~' or directory.startswith('~/'):
+        return '"$HOME"' + quote(directory[1:] or '/')
+
+    return '"$PWD"/' + quote(directory)
+
+
+def get_bundle(transport, src_path, dest_path, codec, progress=None,
+        digests=None):
+    """ Downloads files packed as a single tar stream on the server.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    src_path -- list[str], paths of the remote files or directories.
+    dest_path -- str, path to the local destination directory.
+    codec -- str, requested codec, see serverCompress.CODECS.
+    progress -- serverProgress.Progress, progress of the transfer,
+        default value None.
+    digests -- serverVerify.Digests, checksums of the files received,
+        default value None.
+
+    Returns:
+    received -- int, number of bytes received.
+
+    """
+    if codec == "auto":
+        codec = "zstd" if serverCompress.zstandard is not None else "zlib"
+
+    parents = {posixpath.basename(posixpath.normpath(src)):
+            posixpath.dirname(posixpath.normpath(src)) for src in src_path}
+    channel = transport.open_session()
+    channel.exec_command(archive_command(src_path, codec))
+    reader = ChannelReader(channel, codec)
+    extract_options = {"filter": "data"} if hasattr(tarfile, "data_filter") \
+            else {}
+    os.makedirs(dest_path, exist_ok=True)
+
+    try:
+        with HashingTarFile.open(fileobj=reader, mode='r|') as tar:
+            if digests is not None:
+                # The members are named after the sources, the remote
+                # path is found from the first part of their name.
+                tar.member_hash = lambda tarinfo: digests.new(
+                        posixpath.join(parents.get(
+                            tarinfo.name.split('/')[0], ''), tarinfo.name))
+
+            for tarinfo in tar:
+                tar.extract(tarinfo, dest_path, **extract_options)
+
+                if progress and tarinfo.isreg():
+                    progress.callback(tarinfo.name, tarinfo.size)(
+                            tarinfo.name, tarinfo.size, tarinfo.size)
+
+    except tarfile.TarError:
+        # Report the error of the server first if there is one.
+        serverCompress.close_channel(channel, "tar")
+        raise
+
+    # Drain the end of the archive, the errors of tar are only seen on
+    # its standard error when the stream is compressed.
+    reader.read()
+
+    if serverCompress.close_channel(channel, "tar"):
+        raise scp.SCPException("Error while archiving {}".format(
+            ' '.join(src_path)))
+
+    return reader.received
+
+
+def relay_bundle(src_transport, dest_transport, src_path, dest_path, codec,
+        progress=None, buffer_size=RELAY_BUFFER):
+    """ Copies files between two servers as a single tar stream.
+
+    The stream is received from the source server and sent to the
+    destination server by separate threads through a bounded buffer,
+    nothing is written locally.
+    Arguments:
+    src_transport -- paramiko.transport.Transport, transport to the
+        source server.
+    dest_transport -- paramiko.transport.Transport, transport to the
+        destination server.
+    src_path -- list[str], paths of the files or directories on the
+        source server.
+    dest_path -- str, path to the destination directory.
+    codec -- str, codec of the stream, none, zlib or zstd, the stream
+        is compressed and decompressed by the servers.
+    progress -- serverProgress.Progress, progress of the transfer,
+        default value None.
+    buffer_size -- int, maximum number of bytes buffered,
+        default value RELAY_BUFFER.
+
+    Returns:
+    relayed -- int, number of bytes relayed.
+
+    """
+    src_channel = src_transport.open_session()
+    src_channel.exec_command(archive_command(src_path, codec))
+    dest_channel = dest_transport.open_session()
+    dest_channel.exec_command(extract_command(dest_path, codec))
+    chunks = queue.Queue(max(1, buffer_size // CHUNK_SIZE))
+
+    def receive():
+        try:
+            for data in iter(lambda: src_channel.recv(CHUNK_SIZE), b''):
+                chunks.put(data)
+
+        finally:
+            chunks.put(b'')
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    relayed = 0
+
+    for data in iter(chunks.get, b''):
+        dest_channel.sendall(data)
+        relayed += len(data)
+
+        if progress:
+            progress.update("relay", None, relayed)
+
+    dest_channel.shutdown_write()
+    receiver.join()
+
+    # The errors of tar are only seen on its standard error when the
+    # stream is compressed.
+    if serverCompress.close_channel(src_channel, "tar"):
+        raise scp.SCPException("Error while archiving {}".format(
+            ' '.join(src_path)))
+
+    serverCompress.close_channel(dest_channel, dest_path)
+
+    return relayed
+
+
+def push_bundle(transport, src_path, dest_server, dest_port, dest_path,
+        codec):
+    """ Copies files from a server directly to another server.
+
+    The source server connects to the destination with ssh and sends
+    the tar stream itself, it must be able to log in without a
+    password. The local ssh agent is forwarded to the source server
+    when the connection allows it.
+    Arguments:
+    transport -- paramiko.transport.Transport, transport to the source
+        server.
+    src_path -- list[str], paths of the files or directories on the
+        source server.
+    dest_server -- str, destination server name (user@host).
+    dest_port -- str, port number of the destination server.
+    dest_path -- str, path to the destination directory.
+    codec -- str, codec of the stream, none, zlib or zstd.
+
+    Returns:
+
+    """
+    channel = transport.open_session()
+
+    if isinstance(channel, paramiko.Channel):
+        paramiko.agent.AgentRequestHandler(channel)
+
+    channel.exec_command("{} | ssh -o BatchMode=yes -o LogLevel=ERROR "
+            "-p {} {} {}".format(
+        archive_command(src_path, codec), quote(dest_port),
+        quote(dest_server), quote(extract_command(dest_path, codec))))
+    channel.shutdown_write()
+
+    # Nothing is written on the standard output, only the errors of the
+    # remote programs are kept.
+    for _ in iter(lambda: channel.recv(CHUNK_SIZE), b''):
+        pass
+
+    if serverCompress.close_channel(channel, "ssh"):
+        raise scp.SCPException("Error while copying {}".format(
+            ' '.join(src_path)))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Compressed file transfers over exec channels.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import zlib
+from shlex import quote
+import serverLazy
+
+try:
+    zstandard = serverLazy.lazy_import("zstandard")
+
+except ImportError:
+    zstandard = None
+
+
+# Loaded on first use, see serverLazy.
+scp = serverLazy.lazy_import("scp")
+
+
+CODECS = ["none", "zlib", "zstd", "auto"]
+CHUNK_SIZE = 262144
+SAMPLE_SIZE = 65536
+
+# Ratio above which a sample is considered already compressed.
+SAMPLE_RATIO = 0.9
+
+COMPRESSED_SUFFIXES = (".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".zip",
+        ".7z", ".rar", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3",
+        ".mp4", ".mkv", ".avi", ".mov", ".pdf", ".parquet")
+
+# Remote commands decompressing the standard input into a file and
+# compressing a file to the standard output.
+REMOTE_DECOMPRESS = {"none": "cat", "zlib": "gzip -dc", "zstd": "zstd -dcq"}
+REMOTE_COMPRESS = {"none": "cat", "zlib": "gzip -c -1", "zstd": "zstd -cq -3"}
+
+
+def quote_path(path):
+    """ Quotes a remote path for a shell command.
+
+    A leading ~ is expanded to the home directory as scp does, it is
+    literal once quoted.
+    Arguments:
+    path -- str, remote path.
+
+    Returns:
+    path -- str, quoted path.
+
+    """
+    if path == '~' or path.startswith('~/'):
+        return '"$HOME"' + quote(path[1:] or '/')
+
+    return quote(path)
+
+
+def check_codec(codec):
+    """ Checks that a codec can be used locally.
+
+    Arguments:
+    codec -- str, codec name, see CODECS.
+
+    Returns:
+    available -- boolean, True if the codec can be used.
+
+    """
+    return codec != "zstd" or zstandard is not None
+
+
+def is_compressible(name, sample):
+    """ Checks if data is worth compressing.
+
+    Arguments:
+    name -- str, name of the file the data comes from.
+    sample -- bytes, first bytes of the file.
+
+    Returns:
+    compressible -- boolean, True if the sample shrinks enough.
+
+    """
+    if name.lower().endswith(COMPRESSED_SUFFIXES) or len(sample) == 0:
+        return False
+
+    return len(zlib.compress(sample, 1)) < SAMPLE_RATIO*len(sample)
+
+
+def resolve_codec(codec, name, sample):
+    """ Resolves the codec used for a file.
+
+    Arguments:
+    codec -- str, requested codec, see CODECS.
+    name -- str, name of the file.
+    sample -- bytes, first bytes of the file, only used if codec
+        is auto.
+
+    Returns:
+    codec -- str, codec used for the file.
+
+    """
+    if codec != "auto":
+        return codec
+
+    if not is_compressible(name, sample):
+        return "none"
+
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compressor(codec):
+    """ Creates a streaming compressor.
+
+    Arguments:
+    codec -- str, codec name, none, zlib or zstd.
+
+    Returns:
+    compress -- function, compresses a chunk, an empty chunk
+        flushes the stream.
+
+    """
+    if codec == "zlib":
+        # gzip framing so that the server only needs the gzip program.
+        compress_obj = zlib.compressobj(1, zlib.DEFLATED, 31)
+
+        return lambda chunk: compress_obj.compress(chunk) if chunk \
+                else compress_obj.flush()
+
+    if codec == "zstd":
+        compress_obj = zstandard.ZstdCompressor(level=3).compressobj()
+
+        return lambda chunk: compress_obj.compress(chunk) if chunk \
+                else compress_obj.flush()
+
+    return lambda chunk: chunk
+
+
+def decompressor(codec):
+    """ Creates a streaming decompressor.
+
+    Arguments:
+    codec -- str, codec name, none, zlib or zstd.
+
+    Returns:
+    decompress -- function, decompresses a chunk.
+
+    """
+    if codec == "zlib":
+        return zlib.decompressobj(31).decompress
+
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress
+
+    return lambda chunk: chunk
+
+
+def close_channel(channel, path):
+    """ Waits for the remote command and closes the channel.
+
+    Arguments:
+    channel -- paramiko.channel.Channel, channel running the command.
+    path -- str, remote path, used in the error message.
+
+    Returns:
+    error -- str, standard error of the command.
+
+    """
+    error = b''.join(iter(lambda: channel.recv_stderr(32768), b''))
+    error = error.decode(errors="replace").strip()
+    exit_status = channel.recv_exit_status()
+    channel.close()
+
+    if exit_status != 0:
+        raise scp.SCPException("{}: {}".format(path, error))
+
+    return error
+
+
+def put_file(transport, local_path, remote_path, codec, update=None,
+        file_hash=None):
+    """ Uploads a file compressed with a codec.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    local_path -- str, path to the local file.
+    remote_path -- str, path to the remote file.
+    codec -- str, requested codec, see CODECS.
+    update -- function, progress callback, default value None.
+    file_hash -- hashlib hash, updated with the content of the file,
+        default value None.
+
+    Returns:
+    sent -- int, number of compressed bytes sent.
+
+    """
+    size = os.path.getsize(local_path)
+    mode = os.stat(local_path).st_mode & 0o7777
+    sent = 0
+
+    with open(local_path, 'rb') as f_handle:
+        chunk = f_handle.read(CHUNK_SIZE)
+        codec = resolve_codec(codec, local_path, chunk[:SAMPLE_SIZE])
+        compress = compressor(codec)
+
+        channel = transport.open_session()
+        channel.exec_command("{} > {} && chmod {:o} {}".format(
+            REMOTE_DECOMPRESS[codec], quote_path(remote_path), mode,
+            quote_path(remote_path)))
+
+        position = 0
+
+        while chunk:
+            if file_hash:
+                file_hash.update(chunk)
+
+            data = compress(chunk)
+            channel.sendall(data)
+            sent += len(data)
+            position += len(chunk)
+
+            if update:
+                update(local_path, size, position)
+
+            chunk = f_handle.read(CHUNK_SIZE)
+
+        data = compress(b'')
+        channel.sendall(data)
+        sent += len(data)
+
+    if update:
+        update(local_path, size, size)
+
+    channel.shutdown_write()
+    close_channel(channel, remote_path)
+
+    return sent
+
+
+def get_file(transport, remote_path, local_path, size, codec, update=None,
+        file_hash=None):
+    """ Downloads a file compressed with a codec.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    remote_path -- str, path to the remote file.
+    local_path -- str, path to the local file.
+    size -- int, size of the remote file.
+    codec -- str, requested codec, see CODECS.
+    update -- function, progress callback, default value None.
+    file_hash -- hashlib hash, updated with the content of the file,
+        default value None.
+
+    Returns:
+    received -- int, number of compressed bytes received.
+
+    """
+    if codec == "auto":
+        channel = transport.open_session()
+        channel.exec_command("head -c {} {}".format(SAMPLE_SIZE,
+            quote_path(remote_path)))
+        sample = b''.join(iter(lambda: channel.recv(SAMPLE_SIZE), b''))
+        close_channel(channel, remote_path)
+        codec = resolve_codec(codec, remote_path, sample)
+
+    decompress = decompressor(codec)
+    channel = transport.open_session()
+    # Read through a redirection, zstd skips symbolic links given as
+    # arguments.
+    channel.exec_command("{} < {}".format(REMOTE_COMPRESS[codec],
+        quote_path(remote_path)))
+    received = 0
+    position = 0
+
+    with open(local_path, 'wb') as f_handle:
+        for data in iter(lambda: channel.recv(CHUNK_SIZE), b''):
+            received += len(data)
+            chunk = decompress(data)
+            f_handle.write(chunk)
+
+            if file_hash:
+                file_hash.update(chunk)
+
+            position += len(chunk)
+
+            if update:
+                update(local_path, size, position)
+
+    if update:
+        update(local_path, size, size)
+
+    close_channel(channel, remote_path)
+
+    return received
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Commands executed over paramiko channels with streamed output.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import sys
+import time
+import codecs
+import threading
+
+
+BUFF_SIZE = 32768
+
+# Longest part of a line kept before it is written without its end,
+# the output of a command is never held in memory.
+MAX_LINE = 65536
+
+
+def copy_output(recv, output, prefix=None, output_lock=None, tee=None,
+        max_line=MAX_LINE):
+    """ Copies the output of a channel as it arrives.
+
+    Arguments:
+    recv -- function, reads data from the channel, returns b'' at the
+        end of the output.
+    output -- file, text output to write to.
+    prefix -- str, prefix of the lines, default value None to copy
+        the output as it is.
+    output_lock -- threading.Lock, lock shared by the outputs of
+        concurrent commands, default value None.
+    tee -- file, binary file also receiving the output,
+        default value None.
+    max_line -- int, longest part of a line kept, default value
+        MAX_LINE.
+
+    Returns:
+    nbytes -- int, number of bytes of output.
+
+    """
+    output_lock = output_lock or threading.Lock()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = b''
+    nbytes = 0
+
+    for data in iter(lambda: recv(BUFF_SIZE), b''):
+        nbytes += len(data)
+
+        if tee is not None:
+            tee.write(data)
+
+        if prefix is None:
+            with output_lock:
+                output.write(decoder.decode(data))
+                output.flush()
+
+            continue
+
+        *lines, buffer = (buffer + data).split(b'\n')
+
+        if len(buffer) > max_line:
+            lines.append(buffer)
+            buffer = b''
+
+        with output_lock:
+            for line in lines:
+                output.write("[{}] {}\n".format(prefix,
+                    line.decode(errors="replace")))
+
+            output.flush()
+
+    with output_lock:
+        if buffer:
+            output.write("[{}] {}\n".format(prefix,
+                buffer.decode(errors="replace")))
+
+        elif prefix is None:
+            output.write(decoder.decode(b'', final=True))
+
+        output.flush()
+
+    return nbytes
+
+
+def run(transport, command, prefix=None, output_lock=None, tee=None):
+    """ Executes a command over a transport.
+
+    The standard output and error are copied to those of the program
+    while the command runs, see copy_output.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    command -- str, command to execute.
+    prefix -- str, prefix of the output lines, default value None.
+    output_lock -- threading.Lock, lock shared by the outputs of
+        concurrent commands, default value None.
+    tee -- tuple(file, file), binary files also receiving the standard
+        output and error, default value None.
+
+    Returns:
+    result -- dict, command, exit status, -1 if the server sent none,
+        duration in seconds and bytes of standard output and error.
+
+    """
+    output_lock = output_lock or threading.Lock()
+    tee = tee or (None, None)
+    start = time.monotonic()
+    channel = transport.open_session()
+
+    try:
+        channel.exec_command(command)
+        channel.shutdown_write()
+        sizes = {}
+
+        def copy_stderr():
+            sizes["stderr"] = copy_output(channel.recv_stderr, sys.stderr,
+                    prefix, output_lock, tee[1])
+
+        stderr_thread = threading.Thread(target=copy_stderr, daemon=True)
+        stderr_thread.start()
+        sizes["stdout"] = copy_output(channel.recv, sys.stdout, prefix,
+                output_lock, tee[0])
+        stderr_thread.join()
+        exit_status = channel.recv_exit_status()
+
+    finally:
+        channel.close()
+
+    return {"command": command, "exit_status": exit_status,
+            "elapsed": time.monotonic() - start,
+            "stdout": sizes["stdout"], "stderr": sizes.get("stderr", 0)}
@@ -7,11 +7,36 @@
 
 
 import os
+import re
 import sys
+import time
 import getpass
 import subprocess
-from scp import SCPClient, SCPException
-from paramiko import SSHClient, ssh_exception
+import threading
+import contextlib
+import concurrent.futures
+import serverRegistry
+import serverProgress
+import serverRate
+import serverLazy
+import serverTransport
+import serverMetrics
+
+
+# The transfer modules, paramiko and scp are only loaded when a
+# connection is opened, see serverLazy.
+scp = serverLazy.lazy_import("scp")
+paramiko = serverLazy.lazy_import("paramiko")
+serverSync = serverLazy.lazy_import("serverSync")
+serverBundle = serverLazy.lazy_import("serverBundle")
+serverBroker = serverLazy.lazy_import("serverBroker")
+serverSftp = serverLazy.lazy_import("serverSftp")
+serverState = serverLazy.lazy_import("serverState")
+serverCompress = serverLazy.lazy_import("serverCompress")
+serverVerify = serverLazy.lazy_import("serverVerify")
+serverWatch = serverLazy.lazy_import("serverWatch")
+serverProbe = serverLazy.lazy_import("serverProbe")
+serverExec = serverLazy.lazy_import("serverExec")
 
 
 ##################
@@ -20,6 +45,11 @@ from paramiko import SSHClient, ssh_exception
 
 
 class Server:
+    # The fields are parsed from the line of the server list the first
+    # time one of them is used.
+    __slots__ = ("line", "user", "host", "server_name", "port", "options",
+            "settings", "comment", "transport", "password")
+
     ## Init method ##
     def __init__(self, server_elems):
         """ Initialise server object.
@@ -29,25 +59,57 @@ class Server:
             0: user@host
             1: port number
             2: options
-            3: comment
+            3: settings
+            4: comment
 
         Returns:
         server -- Server, server object.
         
         """
-        # Split comment from other args.
-        tmp_parsed_server_elems = server_elems.split('#') 
-        self.comment = tmp_parsed_server_elems[1]
+        self.line = server_elems
+
+        # Connected transport shared by the operations on the server,
+        # see open_transport.
+        self.transport = None
+
+        # Password asked once for several servers, see set_password.
+        self.password = None
+
+
+    def __getattr__(self, name):
+        """ Parses the server line when a field is first used.
+
+        Only called for the fields that are not set yet.
+        Arguments:
+        name -- str, name of the field.
+
+        Returns:
+        value -- str, value of the field.
+
+        """
+        if name == "line" or self.line is None:
+            raise AttributeError(name)
+
+        self._parse()
+
+        return getattr(self, name)
+
+
+    def _parse(self):
+        """ Parses the server line into the fields.
+
+        Arguments:
+
+        Returns:
 
-        # Split server, port and options.
-        tmp_parsed_server_elems = tmp_parsed_server_elems[0].split(' ') 
-        self.port = tmp_parsed_server_elems[1]
-        self.options = tmp_parsed_server_elems[2] # '' if no options.
+        """
+        if self.line is None:
+            return None
 
-        # Split user and host.
-        tmp_parsed_server_elems = tmp_parsed_server_elems[0].split('@')
-        self.user = tmp_parsed_server_elems[0]
-        self.host = tmp_parsed_server_elems[1]
+        line = self.line
+        self.line = None
+        self.user, self.host, self.port, self.options, self.settings, \
+                self.comment = serverRegistry.parse_line(line)
         self.server_name = '@'.join([self.user, self.host])
 
 
@@ -63,7 +125,7 @@ class Server:
         server_args = ' '.join([self.server_name,
                 self.port, 
                 self.options,
-                '']) 
+                self.settings]) 
 
         return '#'.join([server_args, self.comment])
 
@@ -129,6 +191,62 @@ class Server:
         return self.options
 
 
+    def get_settings(self):
+        """ Gets the server settings.
+
+        Arguments:
+
+        Returns:
+        settings -- str, server settings, comma separated key=value
+            pairs, see serverRegistry.SETTINGS.
+
+        """
+        return self.settings
+
+
+    def get_limit(self):
+        """ Gets the bandwidth limit of the server.
+
+        Arguments:
+
+        Returns:
+        limit -- int, limit in bytes per second, None if the server
+            has no limit.
+
+        """
+        limit = serverRegistry.parse_settings(self.settings).get("limit")
+
+        if not limit:
+            return None
+
+        try:
+            return serverRate.parse_rate(limit)
+
+        except ValueError:
+            sys.stderr.write("Error: invalid limit {} for {}.\n".format(
+                limit, self.server_name))
+            exit(1)
+
+
+    def get_tuning(self):
+        """ Gets the transport settings of the server.
+
+        Arguments:
+
+        Returns:
+        tuning -- dict, transport settings, see
+            serverTransport.server_tuning.
+
+        """
+        try:
+            return serverTransport.server_tuning(self.settings)
+
+        except ValueError as err:
+            sys.stderr.write("Error: invalid settings for {}: {}.\n".format(
+                self.server_name, err))
+            exit(1)
+
+
     def get_comment(self):
         """ Gets the server comment.
 
@@ -152,6 +270,7 @@ class Server:
         Returns:
 
         """
+        self._parse()
         self.user = new_user
         self.server_name = '@'.join([self.user, self.host])
 
@@ -166,6 +285,7 @@ class Server:
         Returns:
 
         """
+        self._parse()
         self.host = new_host
         self.server_name = '@'.join([self.user, self.host])
 
@@ -179,6 +299,7 @@ class Server:
         Returns:
 
         """
+        self._parse()
         self.port = new_port
 
 
@@ -191,9 +312,36 @@ class Server:
         Returns:
 
         """
+        self._parse()
         self.options = new_options
 
 
+    def set_settings(self, new_settings):
+        """ Sets the server settings.
+
+        Arguments:
+        new_settings -- str, new server settings.
+
+        Returns:
+
+        """
+        self._parse()
+        self.settings = new_settings
+
+
+    def set_password(self, password):
+        """ Sets the password used instead of asking for it.
+
+        Arguments:
+        password -- str, password of the server, None to ask for it
+            when connecting.
+
+        Returns:
+
+        """
+        self.password = password
+
+
     def set_comment(self, new_comment):
         """ Sets the server comment.
 
@@ -203,6 +351,7 @@ class Server:
         Returns:
 
         """
+        self._parse()
         self.comment = new_comment
 
 
@@ -211,86 +360,367 @@ class Server:
         """ Executes a command on a remote server via ssh.
         If not command is given an interactive shell is opened.
 
+        The command goes through the connection broker when it is running
+        and the server has no ssh options, which the broker cannot apply.
         Arguments:
         command -- str, command to execute, default value "".
         command_options -- str, options for the command, default value "".
 
         Returns:
+        exit_status -- int, exit status of the command or the shell.
 
         """
         port = "-p"+ self.port
 
+        if command != "" and not self.options and serverBroker.is_running():
+            remote_command = ' '.join(filter(None, [command,
+                command_options]))
+            return self._broker_command(remote_command)
+
         try:
             if command == "":
-                subprocess.run(["ssh", self.server_name, port, self.options])
+                process = subprocess.run(["ssh", self.server_name, port,
+                    self.options])
 
             else:
-                subprocess.run(["ssh", self.server_name, port, self.options,
-                    command, command_options])
+                process = subprocess.run(["ssh", self.server_name, port,
+                    self.options, command, command_options])
 
         except KeyboardInterrupt:
             sys.stderr.write("Connection to {} canceled.\n".format(
                 self.server_name))
             exit(1)
 
+        return process.returncode
+
+
+    def _broker_command(self, command):
+        """ Executes a command through the connection broker.
+
+        The standard input is forwarded if it is not a terminal.
+        Arguments:
+        command -- str, command to execute.
+
+        Returns:
+        exit_status -- int, exit status of the command.
+
+        """
+        with self.open_transport() as transport:
+            channel = transport.open_session()
+            channel.exec_command(command)
+
+            def forward_stdin():
+                if not sys.stdin.isatty():
+                    for data in iter(lambda: sys.stdin.buffer.read1(
+                            serverBroker.BUFF_SIZE), b''):
+                        channel.sendall(data)
+
+                channel.shutdown_write()
+
+            def forward_stderr():
+                for data in iter(lambda: channel.recv_stderr(
+                        serverBroker.BUFF_SIZE), b''):
+                    sys.stderr.buffer.write(data)
+                    sys.stderr.buffer.flush()
+
+            threading.Thread(target=forward_stdin, daemon=True).start()
+            stderr_thread = threading.Thread(target=forward_stderr)
+            stderr_thread.start()
+
+            try:
+                for data in iter(lambda: channel.recv(
+                        serverBroker.BUFF_SIZE), b''):
+                    sys.stdout.buffer.write(data)
+                    sys.stdout.buffer.flush()
+
+            except KeyboardInterrupt:
+                channel.close()
+                sys.stderr.write("Connection to {} canceled.\n".format(
+                    self.server_name))
+                exit(1)
+
+            stderr_thread.join()
+            channel.close()
+
+            return channel.recv_exit_status()
+
+
+    @serverMetrics.measured("command")
+    def stream_command(self, command, output_lock):
+        """ Executes a non-interactive command on a remote server via ssh
+        and prefixes each line of output with the server name.
+
+        Password authentication is disabled since several commands
+        can run at the same time.
+        Arguments:
+        command -- str, command to execute.
+        output_lock -- threading.Lock, lock shared by the outputs of
+            concurrent commands.
+
+        Returns:
+        exit_status -- int, exit status of the command, 255 if ssh
+            failed.
+
+        """
+        ssh_command = ["ssh", "-o", "BatchMode=yes", "-p", self.port]
+        ssh_command.extend(self.options.split())
+        ssh_command.extend([self.server_name, command])
+
+        process = subprocess.Popen(ssh_command, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def prefix_lines(stream, output):
+            for line in iter(stream.readline, b''):
+                with output_lock:
+                    output.write("[{}] {}".format(self.server_name,
+                        line.decode(errors="replace")))
+                    output.flush()
+
+        stderr_thread = threading.Thread(target=prefix_lines,
+                args=(process.stderr, sys.stderr))
+        stderr_thread.start()
+
+        try:
+            prefix_lines(process.stdout, sys.stdout)
+            stderr_thread.join()
+
+            return process.wait()
+
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+
+    @serverMetrics.measured("command")
+    def run_commands(self, commands, prefix=None, output_lock=None,
+            tee_dir=None):
+        """ Executes non-interactive commands over a single connection.
+
+        The commands run one after the other in the program, without
+        the ssh program, and their output is streamed as it arrives,
+        see serverExec. The connection is the shared transport or the
+        broker connection if there is one.
+        Arguments:
+        commands -- list[str], commands to execute.
+        prefix -- str, prefix of the output lines, default value: None
+            for the output as it is.
+        output_lock -- threading.Lock, lock shared by the outputs of
+            concurrent commands, default value: None.
+        tee_dir -- str, directory where the standard output and error
+            are also written to server_name.out and server_name.err,
+            default value: None.
+
+        Returns:
+        results -- list[dict], result of each command, see
+            serverExec.run, the commands after a connection error are
+            missing.
+
+        """
+        results = []
+
+        with contextlib.ExitStack() as stack:
+            tee = None
+
+            if tee_dir is not None:
+                os.makedirs(tee_dir, exist_ok=True)
+                tee = tuple(stack.enter_context(open(os.path.join(tee_dir,
+                    "{}.{}".format(self.server_name, kind)), 'ab'))
+                    for kind in ("out", "err"))
+
+            with self.open_transport() as transport:
+                for command in commands:
+                    try:
+                        results.append(serverExec.run(transport, command,
+                            prefix, output_lock, tee))
+                        serverMetrics.add_bytes(results[-1]["stdout"] +
+                                results[-1]["stderr"])
+
+                    except (OSError, paramiko.SSHException) as err:
+                        sys.stderr.write("Error running {} on {}: {}\n"
+                                .format(command, self.server_name, err))
+                        break
+
+                    except KeyboardInterrupt:
+                        sys.stderr.write("\nCommand on {} canceled.\n"
+                                .format(self.server_name))
+                        exit(1)
+
+        return results
+
+
+    @contextlib.contextmanager
+    def open_transport(self):
+        """ Opens a transport to the server.
+
+        The shared transport of the server is used if it is set, for
+        instance by a batch, and left open on exit. Otherwise the
+        connection broker is used if it is running, or a new connection
+        is established and closed on exit.
+        Arguments:
+
+        Returns:
+        transport -- paramiko.transport.Transport or
+            serverBroker.BrokerTransport, transport to the server.
+
+        """
+        if self.transport is not None:
+            with serverMetrics.phase("data"):
+                yield self.transport
+
+            return
+
+        if serverBroker.is_running():
+            try:
+                with serverMetrics.phase("broker"):
+                    transport = serverBroker.BrokerTransport(self)
+
+            except (OSError, paramiko.SSHException) as err:
+                sys.stderr.write("Broker connection to {} failed: {}\n".format(
+                    self.server_name, err))
+                exit(2)
+
+            except KeyboardInterrupt:
+                sys.stderr.write("\nConnection to {} canceled.\n".format(
+                    self.server_name))
+                exit(1)
+
+            with serverMetrics.phase("data"):
+                yield transport
+
+            return
+
+        with paramiko.SSHClient() as ssh:
+            self._establish_connection(ssh)
+
+            with serverMetrics.phase("data"):
+                yield ssh.get_transport()
+
+
+    @serverMetrics.measured("connect")
+    def share_transport(self):
+        """ Connects to the server for the next operations.
+
+        The transport is kept open and used by open_transport until
+        close_transport is called. Nothing is done if the transport is
+        already open or if the connection broker is running, the broker
+        already keeps the connection.
+        Arguments:
+
+        Returns:
+
+        """
+        if self.transport is not None or serverBroker.is_running():
+            return None
+
+        ssh = paramiko.SSHClient()
+        self._establish_connection(ssh)
+        self.transport = ssh.get_transport()
+
+
+    def close_transport(self):
+        """ Closes the transport opened by share_transport.
+
+        Arguments:
+
+        Returns:
+
+        """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
 
     def _establish_connection(self, ssh_obj):
         """ Establish a connection for scp.
 
+        The transport settings of the server are applied to the
+        connection, see serverTransport.
         Arguments:
         ssh_obj -- paramiko.client.SSHClient, ssh connection object.
 
         Return:
 		
         """
-        ssh_obj.load_system_host_keys()
+        with serverMetrics.phase("host_keys"):
+            ssh_obj.load_system_host_keys()
+
+        tuning = self.get_tuning()
+        factory = serverTransport.transport_factory(tuning)
         password_prompt = "{}'s password: ".format(
                 self.server_name)
+        password = self.password
 
-        password = getpass.getpass(password_prompt)
-
-        try:
-            ssh_obj.connect(self.get_host(), 
-                    port=int(self.get_port()), 
-                    username=self.get_user(), 
-                    password=password,
-                    allow_agent=True)
-
-            return None
-
-        except KeyboardInterrupt:
-            sys.stderr.write("\nConnection to {} canceled.\n".format(
-                self.server_name))
-            exit(1)
+        if password is None:
+            with serverMetrics.phase("prompt"):
+                password = getpass.getpass(password_prompt)
 
-        except ssh_obj_exception.AuthenticationException:
-            sys.stderr.write("Agent authentication to {} failed.\n".format(
-                self.server_name))
-            sys.stderr.write("Trying password authentication...\n")
+        for allow_agent in (True, False):
+            try:
+                sock = serverTransport.open_socket(self.get_host(),
+                        int(self.get_port()))
+
+                with serverMetrics.phase("auth_agent" if allow_agent
+                        else "auth_password"):
+                    ssh_obj.connect(self.get_host(), 
+                            port=int(self.get_port()), 
+                            username=self.get_user(), 
+                            password=password,
+                            allow_agent=allow_agent,
+                            sock=sock,
+                            transport_factory=factory)
+
+                serverTransport.apply_keepalive(ssh_obj.get_transport(),
+                        tuning)
+
+                return None
+
+            except KeyboardInterrupt:
+                sys.stderr.write("\nConnection to {} canceled.\n".format(
+                    self.server_name))
+                exit(1)
 
-        try:
-            ssh_obj.connect(self.get_host(), 
-                    port=int(self.get_port()), 
-                    username=self.get_user(), 
-                    password=password,
-                    allow_agent=False)
+            except paramiko.AuthenticationException:
+                # The retry opens a new socket and transport.
+                ssh_obj.close()
+                sock.close()
 
-            return None
+                if allow_agent:
+                    sys.stderr.write("Agent authentication to {} failed.\n"
+                            .format(self.server_name))
+                    sys.stderr.write("Trying password authentication...\n")
 
-        except KeyboardInterrupt:
-            sys.stderr.write("\nConnection to {} canceled.\n".format(
-                self.server_name))
-            exit(1)
+                else:
+                    sys.stderr.write("Password authentication to {} failed."
+                            "\n".format(self.server_name))
+                    exit(2)
 
-        except ssh_obj_exception.AuthenticationException:
-            sys.stderr.write("Password authentication to {} failed.\n".format(
-                self.server_name))
-            exit(2)
+            except (OSError, paramiko.SSHException) as err:
+                sys.stderr.write("Connection to {} failed: {}\n".format(
+                    self.server_name, err))
+                exit(2)
 
 
-    def upload(self, src_path, dest_path='.', recursive=False, quiet=False):
+    @serverMetrics.measured("upload")
+    def upload(self, src_path, dest_path='.', recursive=False, quiet=False,
+            jobs=1, delta=False, compress="none", bundle=False,
+            backend="scp", window=None, refresh=False, verify=False):
         """ Uploads the file(s) to the server.
 
+        If more than one job is requested, the files are spread across
+        concurrent channels of the same connection and dest_path is
+        treated as a directory. In delta mode only the changed blocks
+        are sent, see serverSync for more details, and the files that
+        match the remote state recorded by the previous transfers are
+        skipped without asking the server, see serverState. Compressed
+        and bundled files are also sent to dest_path as a directory, see
+        serverCompress and serverBundle for more details. The sftp
+        backend sends to dest_path as a directory as well, see
+        serverSftp for more details. The bandwidth is limited by the
+        limit setting of the server and the limit set with
+        serverRate.set_limit. With verify, the checksums of the files
+        are computed as they are sent and compared with the server at
+        the end, see serverVerify, and dest_path is treated as a
+        directory in all the modes.
         Arguments:
         src_path -- str or list[str], path file or list of paths
             of files to upload.
@@ -300,387 +730,1823 @@ class Server:
             default value: False.
         quiet -- boolean, prints progress if False,
             default value: False.
+        jobs -- int, number of concurrent transfers, default value: 1.
+        delta -- boolean, sends only the changed blocks if True,
+            default value: False.
+        compress -- str, compression codec, see serverCompress.CODECS,
+            default value: "none".
+        bundle -- boolean, sends the file(s) as a single tar stream if
+            True, default value: False.
+        backend -- str, scp or sftp, default value: "scp".
+        window -- int, bytes in flight with the sftp backend,
+            default value: None for serverSftp.WINDOW.
+        refresh -- boolean, checks every file on the server in delta
+            mode instead of trusting the recorded remote state if True,
+            default value: False.
+        verify -- boolean, checks the checksums of the files sent if
+            True, default value: False.
 
         Returns:
 
         """
-        with SSHClient() as ssh:
-            self._establish_connection(ssh)
-
-            if quiet:
-                scp = SCPClient(ssh.get_transport(), sanitize=lambda x: x)
-
-            else:
-                scp = SCPClient(ssh.get_transport(), sanitize=lambda x: x, 
-                        progress=progress)
+        serverRate.use_host(self.server_name, self.get_limit())
+        digests = serverVerify.Digests() if verify else None
+
+        with self.open_transport() as transport:
+            if delta:
+                self._delta_upload(transport, src_path, dest_path,
+                        recursive, quiet, refresh, digests)
+                return None
+
+            if bundle:
+                self._bundle_upload(transport, src_path, dest_path,
+                        recursive, quiet, compress, digests)
+                return None
+
+            if compress != "none":
+                self._compressed_upload(transport, src_path, dest_path,
+                        recursive, quiet, compress, digests)
+                return None
+
+            if backend == "sftp":
+                self._sftp_upload(transport, src_path, dest_path,
+                        recursive, quiet, jobs, window, digests)
+                return None
+
+            # The files are hashed as they are read, one at a time.
+            if jobs > 1 or verify:
+                self._parallel_upload(transport, src_path,
+                        dest_path, recursive, quiet, jobs, digests)
+                return None
+
+            file_count, total_size = local_totals(src_path, recursive)
+            progress = serverProgress.Progress(file_count, total_size, quiet)
+
+            # The progress is followed even when quiet for the bandwidth
+            # limits, see serverRate.
+            scp_client = scp.SCPClient(transport, sanitize=lambda x: x,
+                    progress=progress)
 
             try:
                 if recursive:
-                    scp.put(src_path, remote_path=dest_path, 
+                    scp_client.put(src_path, remote_path=dest_path, 
                             recursive=recursive)
 
                 else:
-                    scp.put(src_path, remote_path=dest_path)
+                    scp_client.put(src_path, remote_path=dest_path)
 
             except FileNotFoundError:
                 sys.stderr.write("{}: No such file or directory.\n".format(
                     src_path))
                 exit(2)
 
-            except SCPException:
+            except scp.SCPException:
                 sys.stderr.write("Error with destination {}.\n".format(
                         dest_path))
                 exit(3)
 
-            print("\nUpload successful.")
-                    
+            progress.finish()
+            print("Upload successful.")
 
-    def download(self, src_path, dest_path='.', recursive=False, quiet=False):
-        """ Downloads the file(s) to the server.
+
+    def _parallel_upload(self, transport, src_path, dest_path, recursive,
+            quiet, jobs, digests=None):
+        """ Uploads the file(s) over several concurrent scp channels.
 
         Arguments:
-        src_path -- str or list[str], path file or list of paths
-            of files to download.
-        dest_path -- str, path to file(s) destination,
-            default value: '.'.
-        recursive -- boolean, downloads files recursively if True,
-            default value: False.
-        quiet -- boolean, prints progress if False,
-            default value: False.
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to upload.
+        dest_path -- str, path to the destination directory.
+        recursive -- boolean, uploads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        jobs -- int, number of concurrent transfers.
+        digests -- serverVerify.Digests, checksums of the files sent,
+            default value None.
 
         Returns:
 
         """
-        with SSHClient() as ssh:
-            self._establish_connection(ssh)
+        remote_dirs, transfers, failures = expand_sources(src_path,
+                dest_path, recursive)
 
-            if quiet:
-                scp = SCPClient(ssh.get_transport(), sanitize=lambda x: x)
+        try:
+            remote_mkdir(transport, remote_dirs)
 
-            else:
-                scp = SCPClient(ssh.get_transport(), sanitize=lambda x: x,
-                        progress=progress)
+        except scp.SCPException as err:
+            sys.stderr.write("Error with destination {}: {}\n".format(
+                dest_path, err))
+            exit(3)
 
-            try:
-                if recursive:
-                    scp.get(src_path, local_path=dest_path, 
-                            recursive=recursive)
+        total_size = sum(size for _, _, size in transfers)
+        progress = serverProgress.Progress(len(transfers), total_size, quiet)
 
-                else:
-                    scp.get(src_path, local_path=dest_path)
+        def send(transfer):
+            local_path, remote_dir, size = transfer
+            scp_client = scp.SCPClient(transport, sanitize=lambda x: x,
+                    progress=progress.callback(local_path, size))
 
-            except FileNotFoundError:
-                sys.stderr.write("{}: No such file or directory.\n".format(
-                    dest_path))
-                exit(2)
+            if digests is None:
+                scp_client.put(local_path, remote_path=remote_dir)
+                return None
 
-            except SCPException:
-                sys.stderr.write("Error with source {}\n".format(
-                    src_path))
-                exit(3)
+            remote_path = '/'.join([remote_dir,
+                os.path.basename(local_path)])
+            mode = os.stat(local_path).st_mode & 0o7777
 
-            print("\nDownload successful.")
+            with open(local_path, 'rb') as f_handle:
+                scp_client.putfo(serverVerify.HashingReader(f_handle,
+                    digests.new(remote_path)), remote_path,
+                    mode="0{:o}".format(mode), size=size)
 
+        try:
+            with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                futures = {executor.submit(send, transfer): transfer[0]
+                        for transfer in transfers}
 
-######################
-## Server functions ##
-######################
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
 
-def get_servers(file_path):
-    """ Gets the servers from the file.
+                    except (OSError, scp.SCPException, paramiko.SSHException
+                            ) as err:
+                        failures.append((futures[future], str(err)))
 
-    Arguments:
-    file_path -- str, path to file containing the servers.
+        except KeyboardInterrupt:
+            sys.stderr.write("\nUpload to {} canceled.\n".format(
+                self.server_name))
+            exit(1)
 
-    Returns:
-    server_list -- list[str], list of servers from the file.
+        progress.finish()
 
-    """
-    if not os.path.exists(file_path):
-        sys.stderr.write("Error: {} does not exist.\n".format(file_path))
-        sys.stderr.write("Exiting.\n")
-        exit(1)
+        if failures:
+            sys.stderr.write("{} of {} file(s) failed:\n".format(
+                len(failures), len(transfers) + len(failures)))
 
-    elif not os.path.isfile(file_path):
-        sys.stderr.write("Error: {} is not a file.\n".format(file_path))
-        sys.stderr.write("Exiting.\n")
-        exit(2)
+            for path, reason in sorted(failures):
+                sys.stderr.write(" {}: {}\n".format(path, reason))
 
-    with open(file_path, 'r') as f_handle:
-        server_list = f_handle.readlines()
-    
-    return server_list
+            exit(3)
 
+        self._check_digests(transport, digests)
+        print("Upload successful.")
+                    
 
-def list_servers(file_path, verbose=False):
-    """ Lists all the server from the server list.
+    def _sftp_upload(self, transport, src_path, dest_path, recursive, quiet,
+            jobs, window, digests=None):
+        """ Uploads the file(s) over SFTP with pipelined writes.
 
-    Arguments:
-    file_path -- str, path to file containing the servers.
+        The files are spread across one SFTP session per job.
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to upload.
+        dest_path -- str, path to the destination directory.
+        recursive -- boolean, uploads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        jobs -- int, number of concurrent transfers.
+        window -- int, bytes written ahead of the acknowledgements and
+            receive window of the sessions, None for serverSftp.WINDOW.
+        digests -- serverVerify.Digests, checksums of the files sent,
+            default value None.
 
-    Returns:
+        Returns:
 
-    """
-    server_list = get_servers(file_path)
+        """
+        window = window or serverSftp.WINDOW
+        remote_dirs, transfers, failures = expand_sources(src_path,
+                dest_path, recursive)
+        total_size = sum(size for _, _, size in transfers)
+        progress = serverProgress.Progress(len(transfers), total_size, quiet)
+        sessions = []
+        local = threading.local()
+
+        def send(transfer):
+            local_path, remote_dir, size = transfer
+
+            if not hasattr(local, "sftp"):
+                local.sftp = serverSftp.open_sftp(transport, window)
+                sessions.append(local.sftp)
+
+            remote_path = '/'.join([remote_dir,
+                os.path.basename(local_path)])
+            serverSftp.put_file(local.sftp, local_path, remote_path,
+                    window, progress.callback(local_path, size),
+                    digests.new(remote_path) if digests is not None else None)
 
-    print("Currently available servers:")
+        try:
+            sessions.append(serverSftp.open_sftp(transport, window))
+            serverSftp.make_dirs(sessions[0], remote_dirs)
 
-    for i in range(len(server_list)):
-        server_object = Server(server_list[i])
-        print(" {}: {}".format(str(i+1), server_object.get_server_name()))
+            with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) \
+                    as executor:
+                futures = {executor.submit(send, transfer): transfer[0]
+                        for transfer in transfers}
 
-        if verbose:
-            print("    Port: {}".format(server_object.get_port()))
-            print("    Options: {}".format(server_object.get_options()))
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
 
-        print("    Comment: {}".format(server_object.get_comment()))
-     
+                    except (OSError, paramiko.SSHException) as err:
+                        failures.append((futures[future], str(err)))
 
-def add_server(file_path):
-    """ Adds a server to the list of servers.
+        except (OSError, paramiko.SSHException) as err:
+            sys.stderr.write("Error with destination {}: {}\n".format(
+                dest_path, err))
+            exit(3)
 
-    Arguments:
-    file_path -- str, path to file containing the servers.
+        except KeyboardInterrupt:
+            sys.stderr.write("\nUpload to {} canceled.\n".format(
+                self.server_name))
+            exit(1)
 
-    Returns:
+        finally:
+            for sftp in sessions:
+                sftp.close()
 
-    """
-    list_servers(file_path, True)
+        progress.finish()
 
-    print("Instructions:")
-    print(" Provide the user, host, port, options and comment.")
-    print(" A user and host must be provided.")
-    print(" Press q to quit.")
-    print(" Press enter to provide default values.")
-    print(" Default port: 22 | Default options: '' | Default comment: ''\n")
-    
-    user = ask_input("User")
-    host = ask_input("Host")
-    port = ask_input("Port")
-    options = ask_input("Options")
-    comment = ask_input("Comment")
+        if failures:
+            sys.stderr.write("{} of {} file(s) failed:\n".format(
+                len(failures), len(transfers) + len(failures)))
 
-    if port == '':
-        port = "22"
+            for path, reason in sorted(failures):
+                sys.stderr.write(" {}: {}\n".format(path, reason))
 
-    with open(file_path, 'a') as f_handle:
-        server_name = '@'.join([user, host])
-        server_args = ' '.join([server_name,
+            exit(3)
+
+        self._check_digests(transport, digests)
+        print("Upload successful.")
+
+
+    def _delta_upload(self, transport, src_path, dest_path, recursive,
+            quiet, refresh=False, digests=None):
+        """ Uploads the new and changed blocks of the file(s).
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to upload.
+        dest_path -- str, path to the destination directory.
+        recursive -- boolean, uploads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        refresh -- boolean, ignores the recorded remote state if True,
+            default value False.
+        digests -- serverVerify.Digests, checksums of the files sent,
+            default value None, the checksums are still recorded in the
+            remote state.
+
+        Returns:
+
+        """
+        remote_dirs, transfers, failures = expand_sources(src_path,
+                dest_path, recursive)
+        transfers = [(local_path, '/'.join([remote_dir,
+            os.path.basename(local_path)]))
+            for local_path, remote_dir, _ in transfers]
+        state = serverState.RemoteState(self.server_name, self.port)
+        verify = digests is not None
+        digests = digests if verify else serverVerify.Digests()
+
+        # Only the files that differ from the recorded state are
+        # checked on the server.
+        pending = transfers if refresh else [(local_path, remote_path)
+                for local_path, remote_path in transfers
+                if not state.unchanged(local_path, remote_path)]
+
+        try:
+            remote_mkdir(transport, remote_dirs)
+            changed, remote_sums = serverSync.plan_delta(transport,
+                    pending) if pending else ([], {})
+
+            total_size = sum(os.path.getsize(local_path)
+                    for local_path, _ in changed)
+            progress = serverProgress.Progress(len(changed), total_size, quiet)
+            sent = serverSync.send_delta(transport, changed, remote_sums,
+                    progress, digests=digests)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error with destination {}: {}\n".format(
+                dest_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nUpload to {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+        hexdigests = digests.hexdigests()
+
+        for local_path, remote_path in pending:
+            local_stat = os.stat(local_path)
+            state.record(remote_path, local_stat.st_size,
+                    int(local_stat.st_mtime), hexdigests.get(remote_path))
+
+        state.save()
+
+        if failures:
+            sys.stderr.write("{} of {} file(s) failed:\n".format(
+                len(failures), len(transfers) + len(failures)))
+
+            for path, reason in sorted(failures):
+                sys.stderr.write(" {}: {}\n".format(path, reason))
+
+            exit(3)
+
+        print("{} file(s) changed, {} unchanged ({} from the cache), "
+                "{} of {} sent.".format(len(changed),
+                    len(transfers) - len(changed),
+                    len(transfers) - len(pending),
+                    serverProgress.humansize(sent),
+                    serverProgress.humansize(total_size)))
+
+        if verify:
+            self._check_digests(transport, digests)
+
+        print("Upload successful.")
+
+
+    def _compressed_upload(self, transport, src_path, dest_path, recursive,
+            quiet, compress, digests=None):
+        """ Uploads the file(s) compressed in streaming chunks.
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to upload.
+        dest_path -- str, path to the destination directory.
+        recursive -- boolean, uploads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        compress -- str, compression codec, see serverCompress.CODECS.
+        digests -- serverVerify.Digests, checksums of the files sent,
+            default value None.
+
+        Returns:
+
+        """
+        if not serverCompress.check_codec(compress):
+            sys.stderr.write("Error: the zstandard package is required "
+                    "for {} compression.\n".format(compress))
+            exit(1)
+
+        remote_dirs, transfers, failures = expand_sources(src_path,
+                dest_path, recursive)
+        total_size = sum(size for _, _, size in transfers)
+        progress = serverProgress.Progress(len(transfers), total_size, quiet)
+        sent = 0
+
+        try:
+            remote_mkdir(transport, remote_dirs)
+
+            for local_path, remote_dir, size in transfers:
+                remote_path = '/'.join([remote_dir,
+                    os.path.basename(local_path)])
+                sent += serverCompress.put_file(transport, local_path,
+                        remote_path, compress,
+                        progress.callback(local_path, size),
+                        digests.new(remote_path) if digests is not None
+                        else None)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error with destination {}: {}\n".format(
+                dest_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nUpload to {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+
+        if failures:
+            sys.stderr.write("{} of {} file(s) failed:\n".format(
+                len(failures), len(transfers) + len(failures)))
+
+            for path, reason in sorted(failures):
+                sys.stderr.write(" {}: {}\n".format(path, reason))
+
+            exit(3)
+
+        print("{} sent for {} of data.".format(serverProgress.humansize(sent),
+            serverProgress.humansize(total_size)))
+        self._check_digests(transport, digests)
+        print("Upload successful.")
+
+
+    def _bundle_upload(self, transport, src_path, dest_path, recursive,
+            quiet, compress, digests=None):
+        """ Uploads the file(s) as a single tar stream.
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to upload.
+        dest_path -- str, path to the destination directory.
+        recursive -- boolean, uploads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        compress -- str, compression codec, see serverCompress.CODECS.
+        digests -- serverVerify.Digests, checksums of the files sent,
+            default value None.
+
+        Returns:
+
+        """
+        if not serverCompress.check_codec(compress):
+            sys.stderr.write("Error: the zstandard package is required "
+                    "for {} compression.\n".format(compress))
+            exit(1)
+
+        members, failures = serverBundle.bundle_sources(src_path, recursive)
+        # The symbolic links are archived as links, not as files.
+        files = [path for path, _ in members if os.path.isfile(path) and
+                not os.path.islink(path)]
+        total_size = sum(os.path.getsize(path) for path in files)
+        progress = serverProgress.Progress(len(files), total_size, quiet)
+
+        try:
+            sent = serverBundle.put_bundle(transport, members, dest_path,
+                    compress, progress, digests)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error with destination {}: {}\n".format(
+                dest_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nUpload to {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+
+        if failures:
+            sys.stderr.write("{} of {} source(s) failed:\n".format(
+                len(failures), len(src_path)))
+
+            for path, reason in sorted(failures):
+                sys.stderr.write(" {}: {}\n".format(path, reason))
+
+            exit(3)
+
+        print("{} sent for {} of data.".format(serverProgress.humansize(sent),
+            serverProgress.humansize(total_size)))
+        self._check_digests(transport, digests)
+        print("Upload successful.")
+
+
+    @serverMetrics.measured("download")
+    def download(self, src_path, dest_path='.', recursive=False, quiet=False,
+            resume=False, compress="none", bundle=False, backend="scp",
+            window=None, jobs=1, verify=False):
+        """ Downloads the file(s) to the server.
+
+        In resume mode the downloaded ranges are recorded in a manifest
+        next to each file and an interrupted download continues where
+        it stopped, see serverSync for more details. If more than one
+        job is requested, the files are downloaded by ranges as in
+        resume mode and the ranges, including the ones of a single
+        large file, are fetched over concurrent channels. See
+        serverCompress and serverBundle for more details on compressed
+        and bundled downloads, bundled files are placed in dest_path as
+        a directory. The bandwidth is limited as for upload. With
+        verify, the files are checked as for upload, the ranges of
+        resume mode and of concurrent downloads are always checked
+        against the server as they are received.
+
+        Arguments:
+        src_path -- str or list[str], path file or list of paths
+            of files to download.
+        dest_path -- str, path to file(s) destination,
+            default value: '.'.
+        recursive -- boolean, downloads files recursively if True,
+            default value: False.
+        quiet -- boolean, prints progress if False,
+            default value: False.
+        resume -- boolean, downloads the missing ranges only if True,
+            default value: False.
+        compress -- str, compression codec, see serverCompress.CODECS,
+            default value: "none".
+        bundle -- boolean, receives the file(s) as a single tar stream
+            if True, default value: False.
+        backend -- str, scp or sftp, default value: "scp".
+        window -- int, bytes requested ahead with the sftp backend,
+            default value: None for serverSftp.WINDOW.
+        jobs -- int, number of concurrent channels, default value: 1.
+        verify -- boolean, checks the checksums of the files received
+            if True, default value: False.
+
+        Returns:
+
+        """
+        serverRate.use_host(self.server_name, self.get_limit())
+        digests = serverVerify.Digests() if verify else None
+
+        with self.open_transport() as transport:
+            if resume:
+                self._resume_download(transport, src_path, dest_path,
+                        recursive, quiet, jobs)
+                return None
+
+            if bundle:
+                self._bundle_download(transport, src_path, dest_path,
+                        quiet, compress, digests)
+                return None
+
+            if compress != "none":
+                self._compressed_download(transport, src_path, dest_path,
+                        recursive, quiet, compress, digests)
+                return None
+
+            if backend == "sftp":
+                self._sftp_download(transport, src_path, dest_path,
+                        recursive, quiet, window, digests)
+                return None
+
+            if jobs > 1:
+                self._resume_download(transport, src_path, dest_path,
+                        recursive, quiet, jobs)
+                return None
+
+            # The files are hashed as they are written, one at a time.
+            if verify:
+                self._compressed_download(transport, src_path, dest_path,
+                        recursive, quiet, compress, digests)
+                return None
+
+            progress = serverProgress.Progress(quiet=quiet)
+
+            # The progress is followed even when quiet for the bandwidth
+            # limits, see serverRate.
+            scp_client = scp.SCPClient(transport, sanitize=lambda x: x,
+                    progress=progress)
+
+            try:
+                if recursive:
+                    scp_client.get(src_path, local_path=dest_path, 
+                            recursive=recursive)
+
+                else:
+                    scp_client.get(src_path, local_path=dest_path)
+
+            except FileNotFoundError:
+                sys.stderr.write("{}: No such file or directory.\n".format(
+                    dest_path))
+                exit(2)
+
+            except scp.SCPException:
+                sys.stderr.write("Error with source {}\n".format(
+                    src_path))
+                exit(3)
+
+            progress.finish()
+            print("Download successful.")
+
+
+    def _resume_download(self, transport, src_path, dest_path, recursive,
+            quiet, jobs=1):
+        """ Downloads the missing ranges of the file(s).
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to download.
+        dest_path -- str, path to the destination.
+        recursive -- boolean, downloads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        jobs -- int, number of concurrent channels, default value 1.
+
+        Returns:
+
+        """
+        try:
+            downloads, skipped, missing = serverSync.plan_resume(transport,
+                    src_path, dest_path, recursive)
+            total_size = sum(download["manifest"]["size"]
+                    for download in downloads)
+            progress = serverProgress.Progress(len(downloads), total_size,
+                    quiet)
+            received = serverSync.fetch_ranges(transport, downloads,
+                    progress, jobs=jobs)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error with source {}: {}\n".format(
+                src_path, err))
+            sys.stderr.write("Run the download again to resume it.\n")
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nDownload from {} canceled.\n".format(
+                self.server_name))
+            sys.stderr.write("Run the download again to resume it.\n")
+            exit(1)
+
+        progress.finish()
+
+        # The downloaded files now match the server, a later delta
+        # upload of them skips the unchanged ones without asking.
+        state = serverState.RemoteState(self.server_name, self.port)
+
+        for download in downloads:
+            state.record(download["remote"], download["manifest"]["size"],
+                    download["manifest"]["mtime"])
+
+        for path in missing:
+            state.forget(path)
+            sys.stderr.write("{}: No such file or directory.\n".format(path))
+
+        state.save()
+        print("{} file(s) downloaded, {} already complete, {} "
+                "received.".format(len(downloads), skipped,
+                    serverProgress.humansize(received)))
+
+        if missing:
+            exit(2)
+
+        print("Download successful.")
+
+
+    def _compressed_download(self, transport, src_path, dest_path,
+            recursive, quiet, compress, digests=None):
+        """ Downloads the file(s) compressed in streaming chunks.
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to download.
+        dest_path -- str, path to the destination.
+        recursive -- boolean, downloads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        compress -- str, compression codec, see serverCompress.CODECS.
+        digests -- serverVerify.Digests, checksums of the files
+            received, default value None.
+
+        Returns:
+
+        """
+        if not serverCompress.check_codec(compress):
+            sys.stderr.write("Error: the zstandard package is required "
+                    "for {} compression.\n".format(compress))
+            exit(1)
+
+        try:
+            files, missing = serverSync.list_remote(transport, src_path,
+                    dest_path, recursive)
+            total_size = sum(size for _, _, size, _ in files)
+            progress = serverProgress.Progress(len(files), total_size, quiet)
+            received = 0
+
+            for remote_path, local_path, size, _ in files:
+                received += serverCompress.get_file(transport, remote_path,
+                        local_path, size, compress,
+                        progress.callback(local_path, size),
+                        digests.new(remote_path) if digests is not None
+                        else None)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error with source {}: {}\n".format(
+                src_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nDownload from {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+
+        for path in missing:
+            sys.stderr.write("{}: No such file or directory.\n".format(path))
+
+        print("{} received for {} of data.".format(
+            serverProgress.humansize(received),
+            serverProgress.humansize(total_size)))
+        self._check_digests(transport, digests)
+
+        if missing:
+            exit(2)
+
+        print("Download successful.")
+
+
+    def _sftp_download(self, transport, src_path, dest_path, recursive,
+            quiet, window, digests=None):
+        """ Downloads the file(s) over SFTP with prefetched reads.
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to download.
+        dest_path -- str, path to the destination.
+        recursive -- boolean, downloads directories recursively if True.
+        quiet -- boolean, prints progress if False.
+        window -- int, bytes requested ahead of the reads, None for
+            serverSftp.WINDOW.
+        digests -- serverVerify.Digests, checksums of the files
+            received, default value None.
+
+        Returns:
+
+        """
+        window = window or serverSftp.WINDOW
+
+        try:
+            with serverSftp.open_sftp(transport, window) as sftp:
+                files, missing = serverSftp.list_remote(sftp, src_path,
+                        dest_path, recursive)
+                total_size = sum(size for _, _, size, _ in files)
+                progress = serverProgress.Progress(len(files), total_size,
+                        quiet)
+
+                for remote_path, local_path, size, _ in files:
+                    serverSftp.get_file(sftp, remote_path, local_path, size,
+                            window, progress.callback(local_path, size),
+                            digests.new(remote_path) if digests is not None
+                            else None)
+
+        except (OSError, paramiko.SSHException) as err:
+            sys.stderr.write("Error with source {}: {}\n".format(
+                src_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nDownload from {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+
+        for path in missing:
+            sys.stderr.write("{}: No such file or directory.\n".format(path))
+
+        self._check_digests(transport, digests)
+
+        if missing:
+            exit(2)
+
+        print("Download successful.")
+
+
+    def _bundle_download(self, transport, src_path, dest_path, quiet,
+            compress, digests=None):
+        """ Downloads the file(s) as a single tar stream.
+
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        src_path -- list[str], paths of files to download.
+        dest_path -- str, path to the destination directory.
+        quiet -- boolean, prints progress if False.
+        compress -- str, compression codec, see serverCompress.CODECS.
+        digests -- serverVerify.Digests, checksums of the files
+            received, default value None.
+
+        Returns:
+
+        """
+        if not serverCompress.check_codec(compress):
+            sys.stderr.write("Error: the zstandard package is required "
+                    "for {} compression.\n".format(compress))
+            exit(1)
+
+        progress = serverProgress.Progress(None, None, quiet)
+
+        try:
+            received = serverBundle.get_bundle(transport, src_path,
+                    dest_path, compress, progress, digests)
+
+        except (OSError, scp.SCPException, paramiko.SSHException,
+                serverBundle.tarfile.TarError) as err:
+            sys.stderr.write("Error with source {}: {}\n".format(
+                src_path, err))
+            exit(3)
+
+        except KeyboardInterrupt:
+            sys.stderr.write("\nDownload from {} canceled.\n".format(
+                self.server_name))
+            exit(1)
+
+        progress.finish()
+        print("{} received.".format(serverProgress.humansize(received)))
+        self._check_digests(transport, digests)
+        print("Download successful.")
+
+
+    @serverMetrics.measured("copy")
+    def copy(self, dest_server, src_path, dest_path='.', quiet=False,
+            compress="none", direct=False):
+        """ Copies the file(s) from the server to another server.
+
+        The file(s) are streamed as a tar archive, see serverBundle, and
+        are placed in dest_path as a directory on dest_server. By
+        default the stream is relayed from one connection to the other
+        through memory, nothing is written locally. In direct mode the
+        server sends the stream to dest_server itself over ssh, it must
+        be able to log in to dest_server without a password. The
+        bandwidth of a relayed copy is limited by the limit setting of
+        the source server and the limit set with serverRate.set_limit.
+        Arguments:
+        dest_server -- Server, destination server.
+        src_path -- list[str], paths of the files or directories to
+            copy.
+        dest_path -- str, path to the destination directory,
+            default value: '.'.
+        quiet -- boolean, prints progress if False,
+            default value: False.
+        compress -- str, codec compressing the stream on the servers,
+            none, zlib or zstd, default value: "none".
+        direct -- boolean, the server sends the stream to dest_server
+            itself if True, default value: False.
+
+        Returns:
+
+        """
+        serverRate.use_host(self.server_name, self.get_limit())
+
+        with self.open_transport() as src_transport:
+            try:
+                if direct:
+                    serverBundle.push_bundle(src_transport, src_path,
+                            dest_server.get_server_name(),
+                            dest_server.get_port(), dest_path, compress)
+                    print("Copy successful.")
+                    return None
+
+                with dest_server.open_transport() as dest_transport:
+                    progress = serverProgress.Progress(None, None, quiet)
+                    relayed = serverBundle.relay_bundle(src_transport,
+                            dest_transport, src_path, dest_path, compress,
+                            progress)
+
+            except (OSError, scp.SCPException, paramiko.SSHException) as err:
+                sys.stderr.write("Error copying {} to {}: {}\n".format(
+                    ' '.join(src_path), dest_server.get_server_name(), err))
+                exit(3)
+
+            except KeyboardInterrupt:
+                sys.stderr.write("\nCopy from {} canceled.\n".format(
+                    self.server_name))
+                exit(1)
+
+        progress.finish()
+        print("{} relayed.".format(serverProgress.humansize(relayed)))
+        print("Copy successful.")
+
+
+    @serverMetrics.measured("watch")
+    def watch(self, local_dir, dest_path='.', excludes=None, interval=None):
+        """ Keeps a remote directory in sync with a local one.
+
+        The directory is first synced with the delta transfer, then its
+        changes are collected with inotify, see serverWatch, and sent
+        in batches once the tree is quiet. Removals and renames are
+        applied on the server, the changed files are sent with the
+        delta transfer. Everything goes over a single connection until
+        the watch is stopped with Ctrl-C.
+        Arguments:
+        local_dir -- str, path to the local directory.
+        dest_path -- str, path to the remote directory,
+            default value: '.'.
+        excludes -- list[str], shell patterns of the paths to ignore,
+            default value: None.
+        interval -- float, seconds between two scans of the directory
+            instead of inotify, default value: None.
+
+        Returns:
+
+        """
+        serverRate.use_host(self.server_name, self.get_limit())
+        excludes = excludes or []
+
+        if not os.path.isdir(local_dir):
+            sys.stderr.write("Error: {} is not a directory.\n".format(
+                local_dir))
+            exit(2)
+
+        # The helper and the quoted paths are not expanded by a shell.
+        remote_root = serverVerify.hash_path(dest_path)
+        watcher = serverWatch.open_watcher(local_dir, excludes, interval)
+        state = serverState.RemoteState(self.server_name, self.port)
+
+        with self.open_transport() as transport:
+            try:
+                self._push_changes(transport, local_dir, remote_root, [],
+                        list(serverWatch.list_tree(local_dir, excludes)),
+                        state)
+                print("Watching {} for changes, press Ctrl-C to stop."
+                        .format(local_dir))
+
+                while True:
+                    operations, changed, rescan = serverWatch.plan_changes(
+                            serverWatch.collect(watcher))
+
+                    if rescan:
+                        changed = list(serverWatch.list_tree(local_dir,
+                            excludes))
+
+                    self._push_changes(transport, local_dir, remote_root,
+                            operations, changed, state)
+
+            except (OSError, scp.SCPException, paramiko.SSHException) as err:
+                sys.stderr.write("Error with destination {}: {}\n".format(
+                    dest_path, err))
+                exit(3)
+
+            except KeyboardInterrupt:
+                print("\nWatch of {} stopped.".format(local_dir))
+
+            finally:
+                watcher.close()
+                state.save()
+
+
+    def _push_changes(self, transport, local_dir, remote_root, operations,
+            changed, state):
+        """ Applies a batch of changes of a watched directory.
+
+        The files removed or changed again before they are sent are
+        left for the next batch.
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        local_dir -- str, path to the local directory.
+        remote_root -- str, path to the remote directory.
+        operations -- list[tuple], removals and renames, see
+            serverWatch.plan_changes.
+        changed -- list[str], relative paths of the changed files and
+            directories.
+        state -- serverState.RemoteState, remote state updated with the
+            files sent.
+
+        Returns:
+
+        """
+        for command in serverWatch.remote_commands(remote_root, operations):
+            channel = transport.open_session()
+            channel.exec_command(command)
+
+            if channel.recv_exit_status() != 0:
+                raise scp.SCPException(channel.recv_stderr(1024).decode()
+                        .strip())
+
+            channel.close()
+
+        for operation in operations:
+            removed = '/'.join([remote_root, operation[1]])
+
+            for remote_path in list(state.entries):
+                if serverWatch.is_under(remote_path, removed):
+                    state.forget(remote_path)
+
+        remote_dirs = {remote_root}
+        transfers = []
+
+        for path in changed:
+            local_path = os.path.join(local_dir, *path.split('/'))
+            remote_path = '/'.join([remote_root, path])
+
+            if os.path.isdir(local_path):
+                remote_dirs.add(remote_path)
+
+            elif os.path.isfile(local_path):
+                remote_dirs.add(remote_path.rpartition('/')[0])
+                transfers.append((local_path, remote_path))
+
+        remote_mkdir(transport, sorted(remote_dirs))
+        changed, remote_sums = serverSync.plan_delta(transport,
+                transfers) if transfers else ([], {})
+        changed = [(local_path, remote_path)
+                for local_path, remote_path in changed
+                if os.path.isfile(local_path)]
+        total_size = sum(os.path.getsize(local_path)
+                for local_path, _ in changed)
+        progress = serverProgress.Progress(len(changed), total_size, True)
+        digests = serverVerify.Digests()
+        sent = serverSync.send_delta(transport, changed, remote_sums,
+                progress, digests=digests) if changed else 0
+        progress.finish()
+        hexdigests = digests.hexdigests()
+
+        for local_path, remote_path in changed:
+            local_stat = os.stat(local_path)
+            state.record(remote_path, local_stat.st_size,
+                    int(local_stat.st_mtime), hexdigests.get(remote_path))
+
+        print("{} {} file(s) changed, {} removed or renamed, {} sent.".format(
+            time.strftime("%H:%M:%S"), len(changed), len(operations),
+            serverProgress.humansize(sent)))
+
+
+    def _check_digests(self, transport, digests):
+        """ Compares the checksums of a transfer with the server.
+
+        Exits if a file differs from the server.
+        Arguments:
+        transport -- paramiko.transport.Transport, connected transport.
+        digests -- serverVerify.Digests, checksums computed during the
+            transfer, None if the transfer is not verified.
+
+        Returns:
+
+        """
+        if digests is None:
+            return None
+
+        try:
+            mismatches = serverVerify.check_digests(transport, digests)
+
+        except (OSError, scp.SCPException, paramiko.SSHException) as err:
+            sys.stderr.write("Error while verifying the transfer: {}\n"
+                    .format(err))
+            exit(3)
+
+        if mismatches:
+            sys.stderr.write("{} of {} file(s) failed verification:\n"
+                    .format(len(mismatches), len(digests)))
+
+            for path, reason in mismatches:
+                sys.stderr.write(" {}: {}\n".format(path, reason))
+
+            exit(3)
+
+        print("{} file(s) verified.".format(len(digests)))
+
+
+######################
+## Server functions ##
+######################
+
+def get_servers(file_path):
+    """ Gets the servers from the file.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+
+    Returns:
+    server_list -- serverRegistry.Registry, indexed servers from the file.
+
+    """
+    if not os.path.exists(file_path):
+        sys.stderr.write("Error: {} does not exist.\n".format(file_path))
+        sys.stderr.write("Exiting.\n")
+        exit(1)
+
+    elif not os.path.isfile(file_path):
+        sys.stderr.write("Error: {} is not a file.\n".format(file_path))
+        sys.stderr.write("Exiting.\n")
+        exit(2)
+
+    return serverRegistry.Registry(file_path)
+
+
+def list_servers(file_path, verbose=False, pattern=None, probe=False):
+    """ Lists all the server from the server list.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    verbose -- boolean, prints the port and options if True,
+        default value False.
+    pattern -- str, only lists the servers whose name or comment
+        contains the pattern, default value None.
+    probe -- boolean, prints the connection times of the servers if
+        True, see serverProbe, default value False.
+
+    Returns:
+
+    """
+    server_list = get_servers(file_path)
+    indices = None
+    probes = None
+
+    if pattern is not None:
+        indices = server_list.select(pattern)
+
+    if probe:
+        probes = serverProbe.probe_hosts([server_list.get_fields(i)[1:3]
+            for i in (range(len(server_list)) if indices is None
+                else indices)])
+
+    print_servers(server_list, verbose, indices, probes)
+
+
+def print_servers(server_list, verbose=False, indices=None, probes=None):
+    """ Prints the servers of a server list.
+
+    The fields are read from the registry without creating Server
+    objects.
+    Arguments:
+    server_list -- serverRegistry.Registry, indexed servers.
+    verbose -- boolean, prints the port and options if True,
+        default value False.
+    indices -- list[int], indices of the servers to print, default
+        value None for all the servers.
+    probes -- dict{str: dict}, probe results by host key, see
+        serverProbe.probe_hosts, default value None.
+
+    Returns:
+
+    """
+    if indices is None:
+        indices = range(len(server_list))
+
+    lines = ["Currently available servers:"]
+
+    for i in indices:
+        user, host, port, options, settings, comment = \
+                server_list.get_fields(i)
+        lines.append(" {}: {}@{}".format(i+1, user, host))
+
+        if verbose:
+            lines.append("    Port: {}".format(port))
+            lines.append("    Options: {}".format(options))
+            lines.append("    Settings: {}".format(settings))
+
+        if probes is not None:
+            lines.append("    Probe: {}".format(serverProbe.describe(
+                probes[serverProbe.host_key(host, port)])))
+
+        lines.append("    Comment: {}".format(comment))
+
+    print('\n'.join(lines))
+     
+
+def add_server(file_path):
+    """ Adds a server to the list of servers.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+
+    Returns:
+
+    """
+    list_servers(file_path, True)
+
+    print("Instructions:")
+    print(" Provide the user, host, port, options, settings and comment.")
+    print(" A user and host must be provided.")
+    print(" Settings are comma separated key=value pairs, e.g. "
+            "limit=1M,tags=web+eu.")
+    print(" Press q to quit.")
+    print(" Press enter to provide default values.")
+    print(" Default port: 22 | Default options: '' | Default settings: '' "
+            "| Default comment: ''\n")
+    
+    user = ask_input("User")
+    host = ask_input("Host")
+    port = ask_input("Port")
+    options = ask_input("Options")
+    settings = ask_settings()
+    comment = ask_input("Comment")
+
+    if port == '':
+        port = "22"
+
+    server_name = '@'.join([user, host])
+    server_args = ' '.join([server_name,
+            port, 
+            options,
+            settings]) 
+
+    serverRegistry.update_servers(file_path, lambda server_list:
+            server_list + ['#'.join([server_args, comment + '\n'])])
+
+    print("Server added successfully.")
+
+
+def remove_server(file_path):
+    """ Removes a server from the list of servers
+    
+    Arguments:
+    file_path -- str, path to file containing the servers.
+
+    Returns:
+
+    """
+    server_list = get_servers(file_path)
+    print_servers(server_list, True)
+
+    server_ids = ''
+    
+    print("Instructions: ")
+    print(" Select server numbers only.")
+    print(" Separate servers with a comma and no space.")
+    print(" Type q to quit.\n")
+
+    try:
+        while server_ids == '':
+            server_ids = input("Select servers: ")
+
+            if server_ids == 'q':
+                exit(0)
+
+    except KeyboardInterrupt:
+        print("")
+        exit(1)
+
+    server_ids = [int(value) for value in server_ids.split(',')]
+
+    # The numbers refer to the list printed above, the removal is
+    # refused if another process changed it in the meantime.
+    new_server_list = serverRegistry.update_servers(file_path,
+            lambda lines: [lines[i] for i in range(len(lines))
+                if i+1 not in server_ids], server_list.signature)
+
+    if len(server_list) == len(new_server_list):
+        print("No servers removed.")
+
+    elif len(server_ids) > 1:
+        print("Servers removed successfully.")
+
+    else:
+        print("Server removed successfully.")
+
+
+def modify_server(file_path):
+    """ Modifies a server from the list of servers.
+
+    file_path -- str, path to file containing the servers.
+
+    Returns:
+
+    """
+    server_list = get_servers(file_path)
+    print_servers(server_list, True)
+
+    server_id = ''
+    modify_flag = False
+
+    print("Instructions: ")
+    print(" Select one server number only.")
+    print(" Press enter to leave field unchanged.")
+    print(" Type q to quit.\n")
+
+    try:
+        while server_id == '':
+            server_id = input("Select server: ")
+
+            if server_id == 'q':
+                exit(0)
+
+    except KeyboardInterrupt:
+        print("")
+        exit(1)
+
+    server_object = Server(server_list.get_line(int(server_id)-1)) 
+
+    user = ask_input("User", modify=True)
+    if user != '':
+        server_object.set_user(user)
+        modify_flag = True
+
+    host = ask_input("Host", modify=True)
+    if host != '':
+        server_object.set_host(host)
+        modify_flag = True
+
+    port = ask_input("Port", modify=True)
+    if port != '':
+        server_object.set_port(port)
+        modify_flag = True
+
+    options = ask_input("Options", modify=True)
+    if options != '':
+        server_object.set_options(options)
+        modify_flag = True
+
+    settings = ask_settings(modify=True)
+    if settings != '':
+        server_object.set_settings(settings)
+        modify_flag = True
+
+    comment = ask_input("Comment", modify=True)
+    if comment != '':
+        server_object.set_comment(comment)
+        modify_flag = True
+
+    if not modify_flag:
+        print("Server not modified.")
+
+    else:
+        def replace_server(lines):
+            lines[int(server_id)-1] = server_object.__str__()
+
+            return lines
+
+        serverRegistry.update_servers(file_path, replace_server,
+                server_list.signature)
+
+        print("Server modified successfully.")
+    
+
+def setup_server(file_path, server_id, port, options, server_list=None):
+    """ Setups up a Server object.
+
+    A server name found in the list of available servers uses its
+    port, options and comment.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_id -- str, server number in the list of available
+        servers, server name (user@host) or tag=TAG for the fastest
+        server with the tag.
+    port -- str, port number.
+    options -- str, additional options.
+    server_list -- serverRegistry.Registry, indexed servers, default
+        value None to read them from file_path.
+
+    Returns:
+    server_object -- Server, created server using the inputed arguments.
+
+    """
+    if server_list is None:
+        server_list = get_servers(file_path)
+
+    if server_id.startswith("tag="):
+        server_id = select_tagged(server_list, server_id[len("tag="):])
+
+    try:
+        # If the server_id is a server number
+        server_id = int(server_id)
+        server_object = Server(server_list.get_line(server_id-1))
+
+        if port != None:
+            server_object.set_port(port)
+
+        if options != '':
+            server_object.set_options(' '.join(options))
+
+    except IndexError:
+        # The server number is not valid
+        sys.stderr.write("Error: server number {} is not valid.\n".format(
+            server_id))
+        exit(1)
+
+    except ValueError:
+        # If the server_id is a server name
+        split_server_id = server_id.split('@')
+
+        if len(split_server_id) < 2:
+            sys.stderr.write(
+                    "Error: server {} could not be processed.\n".format(
+                        server_id))
+            exit(2)
+
+        server_name = '@'.join([split_server_id[0], split_server_id[1]])
+        index = server_list.find(server_name)
+
+        if index is not None:
+            server_object = Server(server_list.get_line(index))
+
+            if port != None:
+                server_object.set_port(port)
+
+            if options != '':
+                server_object.set_options(' '.join(options))
+
+            return server_object
+
+        if port == None:
+            port = '22'
+
+        if options != '':
+            options = ' '.join(options)
+
+        server_elems = ' '.join([server_name,
                 port, 
                 options,
-                '']) 
+                '#']) 
+
+        server_object = Server(server_elems)
+
+    return server_object
+
+
+def select_tagged(server_list, tag):
+    """ Selects the fastest reachable server with a tag.
+
+    Arguments:
+    server_list -- serverRegistry.Registry, indexed servers.
+    tag -- str, tag shared by the replicas.
+
+    Returns:
+    server_id -- str, number of the selected server.
+
+    """
+    indices = serverProbe.tagged_servers(server_list, tag)
+
+    if not indices:
+        sys.stderr.write("Error: no server has the tag {}.\n".format(tag))
+        exit(2)
+
+    index = serverProbe.fastest_server(server_list, indices)
+
+    if index is None:
+        sys.stderr.write("Error: no server with the tag {} is reachable.\n"
+                .format(tag))
+        exit(2)
+
+    sys.stderr.write("Using {} for the tag {}.\n".format(
+        server_list.get_name(index), tag))
+
+    return str(index+1)
+
+
+def probe_servers(file_path, server_id="all", timeout=None, jobs=None,
+        refresh=False):
+    """ Measures the connection times of the selected servers.
+
+    The TCP connection, SSH banner and key exchange are timed for all
+    the servers concurrently, the results are cached for a few minutes,
+    see serverProbe.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_id -- str, selection of servers, see expand_server_ids, or
+        tag=TAG for the servers with a tag, default value: "all".
+    timeout -- float, seconds allowed for each server,
+        default value: None for serverProbe.TIMEOUT.
+    jobs -- int, number of servers probed concurrently,
+        default value: None for serverProbe.WORKERS.
+    refresh -- boolean, ignores the cached results if True,
+        default value: False.
+
+    Returns:
+
+    """
+    registry = get_servers(file_path)
+
+    if server_id.startswith("tag="):
+        indices = serverProbe.tagged_servers(registry,
+                server_id[len("tag="):])
+
+    else:
+        indices = []
+
+        for item in expand_server_ids(file_path, server_id):
+            index = int(item) - 1 if item.isdigit() else registry.find(item)
+
+            if index is None or not 0 <= index < len(registry):
+                sys.stderr.write("Error: server {} is not in the list.\n"
+                        .format(item))
+                exit(2)
+
+            indices.append(index)
+
+    hosts = [registry.get_fields(i)[1:3] for i in indices]
+
+    try:
+        probes = serverProbe.probe_hosts(hosts,
+                timeout or serverProbe.TIMEOUT,
+                jobs or serverProbe.WORKERS, refresh)
+
+    except KeyboardInterrupt:
+        sys.stderr.write("\nProbe canceled.\n")
+        exit(1)
+
+    reachable = 0
+
+    for i, (host, port) in zip(indices, hosts):
+        result = probes[serverProbe.host_key(host, port)]
+        reachable += result.get("error") is None
+        print(" {}: {}  {}".format(i+1, registry.get_name(i),
+            serverProbe.describe(result)))
+
+    print("{} of {} server(s) reachable.".format(reachable, len(indices)))
+
+    if reachable < len(indices):
+        exit(2)
+
+
+def command_server(file_path, server_id, port, options, command="",
+        command_options="", jobs=10, in_process=False, commands_file=None,
+        tee_dir=None):
+    """ Sends a command to be run on the selected server.
+    If the command is not provided a shell is returned.
+
+    If several servers are selected the command is run on all of them,
+    see fan_out_command for more details. The commands run in the
+    program instead of the ssh program if in_process is True, if
+    commands are read from a file or if the output is also written to
+    files, see run_commands_server.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_id -- str, server number in the list of available
+        servers or server name (user@host), several servers
+        can be given, see expand_server_ids.
+    port -- str, port number.
+    options -- list[str], additional options for the server.
+    command -- list[str], command to send to the server, default value "".
+    command_options -- list[str], options for the command, 
+        default value "".
+    jobs -- int, number of servers the command runs on concurrently,
+        default value: 10.
+    in_process -- boolean, runs the command over a paramiko channel if
+        True, default value: False.
+    commands_file -- str, path to a file of commands run after the
+        command, one per line, default value: None.
+    tee_dir -- str, directory where the output of each server is also
+        written, default value: None.
+
+    Returns:
+
+    """
+    server_ids = expand_server_ids(file_path, server_id)
 
-        f_handle.write('#'.join([server_args, comment + '\n']))
+    if in_process or commands_file is not None or tee_dir is not None:
+        commands = [' '.join(list(command) + list(command_options))] \
+                if command else []
 
-    print("Server added successfully.")
+        if commands_file is not None:
+            commands.extend(read_commands(commands_file))
 
+        run_commands_server(file_path, server_ids, port, options, commands,
+                jobs, tee_dir)
+        return None
+
+    if command and (len(server_ids) > 1 or server_id == "all"):
+        fan_out_command(file_path, server_ids, port, options,
+                ' '.join(command + list(command_options)), jobs)
+        return None
+
+    # A selection such as 3-3 is a single server number.
+    server_object = setup_server(file_path, server_ids[0]
+            if len(server_ids) == 1 else server_id, port, options)
+    exit_status = server_object.exec_command(' '.join(command),
+            ' '.join(command_options))
+
+    if exit_status:
+        exit(exit_status)
+
+
+def read_commands(commands_file):
+    """ Reads the commands of a file.
 
-def remove_server(file_path):
-    """ Removes a server from the list of servers
-    
     Arguments:
-    file_path -- str, path to file containing the servers.
+    commands_file -- str, path to the file, one command per line, the
+        empty lines and the lines starting with # are skipped.
 
     Returns:
+    commands -- list[str], commands in order.
 
     """
-    server_list = get_servers(file_path)
-    list_servers(file_path, True)
-
-    server_ids = ''
-    new_server_list = []
-    
-    print("Instructions: ")
-    print(" Select server numbers only.")
-    print(" Separate servers with a comma and no space.")
-    print(" Type q to quit.\n")
-
     try:
-        while server_ids == '':
-            server_ids = input("Select servers: ")
+        with open(commands_file, 'r') as f_handle:
+            lines = [line.strip() for line in f_handle]
 
-            if server_ids == 'q':
-                exit(0)
+    except OSError as err:
+        sys.stderr.write("Error: {}: {}.\n".format(commands_file,
+            err.strerror))
+        exit(2)
 
-    except KeyboardInterrupt:
-        print("")
-        exit(1)
+    return [line for line in lines if line and not line.startswith('#')]
 
-    server_ids = [int(value) for value in server_ids.split(',')]
 
-    for i in range(len(server_list)):
-        if i+1 not in server_ids:
-            new_server_list.append(server_list[i])
+def run_commands_server(file_path, server_ids, port, options, commands,
+        jobs=10, tee_dir=None):
+    """ Runs commands on servers over paramiko channels.
 
-    with open(file_path, 'w') as f_handle:
-        for item in new_server_list:
-            f_handle.write(item)
+    The commands of a server run in order over a single connection,
+    the servers run concurrently. The output lines are prefixed with
+    the server name if several servers are selected, the password is
+    then asked once for all of them. A summary of the exit statuses and
+    timings is printed if several commands run.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_ids -- list[str], server numbers or names.
+    port -- str, port number.
+    options -- list[str], additional options for the servers.
+    commands -- list[str], commands to run on each server.
+    jobs -- int, number of servers the commands run on concurrently,
+        default value: 10.
+    tee_dir -- str, directory where the output of each server is also
+        written, see Server.run_commands, default value: None.
 
-    if len(server_list) == len(new_server_list):
-        print("No servers removed.")
+    Returns:
 
-    elif len(server_ids) > 1:
-        print("Servers removed successfully.")
+    """
+    if not commands:
+        sys.stderr.write("Error: no command to run.\n")
+        exit(1)
 
-    else:
-        print("Server removed successfully.")
+    registry = get_servers(file_path)
+    server_list = [setup_server(file_path, server_id, port, options,
+        registry) for server_id in server_ids]
+    output_lock = threading.Lock()
+    prefixed = len(server_list) > 1
 
+    if prefixed:
+        # The password is asked once and the servers connect
+        # concurrently.
+        try:
+            password = getpass.getpass("Password of the {} servers: "
+                    .format(len(server_list)))
 
-def modify_server(file_path):
-    """ Modifies a server from the list of servers.
+        except KeyboardInterrupt:
+            sys.stderr.write("\nCommand canceled.\n")
+            exit(1)
 
-    file_path -- str, path to file containing the servers.
+        for server_object in server_list:
+            server_object.set_password(password)
 
-    Returns:
+    def run(server_object):
+        server_object.share_transport()
 
-    """
-    server_list = get_servers(file_path)
-    list_servers(file_path, True)
+        try:
+            return server_object.run_commands(commands,
+                    server_object.get_server_name() if prefixed else None,
+                    output_lock, tee_dir)
 
-    server_id = ''
-    modify_flag = False
+        finally:
+            server_object.close_transport()
 
-    print("Instructions: ")
-    print(" Select one server number only.")
-    print(" Press enter to leave field unchanged.")
-    print(" Type q to quit.\n")
+    serverLazy.preload(paramiko, serverBroker, serverExec)
+    executor = concurrent.futures.ThreadPoolExecutor(max(1, jobs))
+    futures = [executor.submit(run, server_object)
+            for server_object in server_list]
 
     try:
-        while server_id == '':
-            server_id = input("Select server: ")
+        results = []
 
-            if server_id == 'q':
-                exit(0)
+        for future in futures:
+            try:
+                results.append(future.result())
+
+            except SystemExit:
+                results.append([])
 
     except KeyboardInterrupt:
-        print("")
+        for future in futures:
+            future.cancel()
+
+        sys.stderr.write("\nCommand canceled.\n")
         exit(1)
 
-    server_object = Server(server_list[int(server_id)-1]) 
+    finally:
+        executor.shutdown(wait=False)
 
-    user = ask_input("User", modify=True)
-    if user != '':
-        server_object.set_user(user)
-        modify_flag = True
+    if len(server_list) == 1 and len(commands) == 1:
+        exit_status = results[0][0]["exit_status"] if results[0] else 255
+        exit(exit_status if 0 <= exit_status < 256 else 255)
 
-    host = ask_input("Host", modify=True)
-    if host != '':
-        server_object.set_host(host)
-        modify_flag = True
+    failed = 0
+    print("Summary:")
 
-    port = ask_input("Port", modify=True)
-    if port != '':
-        server_object.set_port(port)
-        modify_flag = True
+    for server_object, server_results in zip(server_list, results):
+        for result in server_results:
+            print(" {}: {}: exit {}, {:.2f}s".format(
+                server_object.get_server_name(), result["command"],
+                result["exit_status"], result["elapsed"]))
 
-    options = ask_input("Options", modify=True)
-    if options != '':
-        server_object.set_options(options)
-        modify_flag = True
+            if result["exit_status"] != 0:
+                failed += 1
 
-    comment = ask_input("Comment", modify=True)
-    if comment != '':
-        server_object.set_comment(comment)
-        modify_flag = True
+        if len(server_results) < len(commands):
+            print(" {}: {} command(s) not run".format(
+                server_object.get_server_name(),
+                len(commands) - len(server_results)))
+            failed += len(commands) - len(server_results)
 
-    if not modify_flag:
-        print("Server not modified.")
+    total = len(commands) * len(server_list)
+    print("{} succeeded, {} failed.".format(total - failed, failed))
 
-    else:
-        server_list[int(server_id)-1] = server_object.__str__()
+    if failed:
+        exit(1)
 
-        with open(file_path, 'w') as f_handle:
-            for item in server_list:
-                f_handle.write(item)
 
-        print("Server modified successfully.")
-    
+def expand_server_ids(file_path, server_id):
+    """ Expands a selection of servers into single server ids.
 
-def setup_server(file_path, server_id, port, options):
-    """ Setups up a Server object.
+    The selection is a comma separated list of server numbers, ranges
+    of server numbers (1-4) and server names (user@host), or all to
+    select every server in the list.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_id -- str, selection of servers.
+
+    Returns:
+    server_ids -- list[str], selected server numbers or names.
+
+    """
+    if server_id == "all":
+        return [str(i+1) for i in range(len(get_servers(file_path)))]
+
+    server_ids = []
+
+    for item in server_id.split(','):
+        server_range = re.fullmatch(r"(\d+)-(\d+)", item)
+
+        if server_range:
+            server_ids.extend(str(i) for i in range(
+                int(server_range.group(1)), int(server_range.group(2))+1))
+
+        elif item != '':
+            server_ids.append(item)
+
+    return server_ids
 
+
+def fan_out_command(file_path, server_ids, port, options, command, jobs):
+    """ Runs a command on several servers concurrently.
+
+    The output lines are prefixed with the server name and a summary
+    of the exit statuses and timings is printed at the end.
     Arguments:
     file_path -- str, path to file containing the servers.
-    server_id -- str, server number in the list of available
-        servers or server name (user@host).
+    server_ids -- list[str], server numbers or names.
     port -- str, port number.
-    options -- str, additional options.
+    options -- list[str], additional options for the servers.
+    command -- str, command to send to the servers.
+    jobs -- int, number of servers the command runs on concurrently.
 
     Returns:
-    server_object -- Server, created server using the inputed arguments.
 
     """
-    server_list = get_servers(file_path)
+    registry = get_servers(file_path)
+    server_list = [setup_server(file_path, server_id, port, options,
+        registry) for server_id in server_ids]
+    output_lock = threading.Lock()
 
-    try:
-        # If the server_id is a server number
-        server_id = int(server_id)
-        server_object = Server(server_list[server_id-1])
+    def run(server_object):
+        start = time.monotonic()
+        exit_status = server_object.stream_command(command, output_lock)
 
-        if port != None:
-            server_object.set_port(port)
+        return exit_status, time.monotonic() - start
 
-        if options != '':
-            server_object.set_options(' '.join(options))
+    executor = concurrent.futures.ThreadPoolExecutor(max(1, jobs))
+    futures = [executor.submit(run, server_object)
+            for server_object in server_list]
 
-    except IndexError:
-        # The server number is not valid
-        sys.stderr.write("Error: server number {} is not valid.\n".format(
-            server_id))
-        exit(1)
+    try:
+        results = [future.result() for future in futures]
 
-    except ValueError:
-        # If the server_id is a server name
-        split_server_id = server_id.split('@')
+    except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
 
-        if len(split_server_id) < 2:
-            sys.stderr.write(
-                    "Error: server {} could not be processed.\n".format(
-                        server_id))
-            exit(2)
+        sys.stderr.write("\nCommand canceled.\n")
+        exit(1)
 
-        server_name = '@'.join([split_server_id[0], split_server_id[1]])
+    finally:
+        executor.shutdown(wait=False)
 
-        if port == None:
-            port = '22'
+    failed = 0
+    print("Summary:")
 
-        if options != '':
-            options = ' '.join(options)
+    for server_object, (exit_status, elapsed) in zip(server_list, results):
+        print(" {}: exit {}, {:.2f}s".format(server_object.get_server_name(),
+            exit_status, elapsed))
 
-        server_elems = ' '.join([server_name,
-                port, 
-                options,
-                '#']) 
+        if exit_status != 0:
+            failed += 1
 
-        server_object = Server(server_elems)
+    print("{} succeeded, {} failed.".format(len(results) - failed, failed))
 
-    return server_object
+    if failed:
+        exit(1)
 
 
-def command_server(file_path, server_id, port, options, command="",
-        command_options=""):
-    """ Sends a command to be run on the selected server.
-    If the command is not provided a shell is returned.
+def transfer_conflict(upload, jobs=1, delta=False, resume=False,
+        refresh=False, compress="none", bundle=False, backend="scp",
+        window=None):
+    """ Finds the transfer flags that cannot be used together.
 
+    A transfer runs in a single mode. Only bundles can be compressed,
+    the sftp uploads and the resumed downloads can use several jobs,
+    refresh only applies to delta uploads and window to the sftp
+    backend. The checksums of --verify are compatible with every mode.
     Arguments:
-    file_path -- str, path to file containing the servers.
-    server_id -- str, server number in the list of available
-        servers or server name (user@host).
-    port -- str, port number.
-    options -- list[str], additional options for the server.
-    command -- list[str], command to send to the server, default value "".
-    command_options -- list[str], options for the command, 
-        default value "".
+    upload -- boolean, True for an upload, False for a download.
+    jobs -- int, number of concurrent transfers, default value: 1.
+    delta -- boolean, delta upload, default value: False.
+    resume -- boolean, resumed download, default value: False.
+    refresh -- boolean, ignores the remote state of a delta upload,
+        default value: False.
+    compress -- str, compression codec, default value: "none".
+    bundle -- boolean, tar stream transfer, default value: False.
+    backend -- str, scp or sftp, default value: "scp".
+    window -- int, window of the sftp backend, default value: None.
 
     Returns:
+    message -- str, reason the flags cannot be used together, None if
+        they can.
 
     """
-    server_object = setup_server(file_path, server_id, port, options)
-    server_object.exec_command(' '.join(command), ' '.join(command_options))
+    modes = [("--delta", upload and delta), ("--resume", not upload and
+        resume), ("--bundle", bundle), ("--compress", compress != "none"),
+        ("--backend sftp", backend == "sftp"), ("--jobs", jobs > 1)]
+    given = [flag for flag, used in modes if used]
+    combined = [("--bundle", "--compress"), ("--resume", "--jobs")]
+
+    if upload:
+        combined.append(("--backend sftp", "--jobs"))
+
+    for i, first in enumerate(given):
+        for second in given[i+1:]:
+            if (first, second) not in combined:
+                return "{} cannot be used with {}".format(first, second)
+
+    if upload and refresh and not delta:
+        return "--refresh requires --delta"
+
+    if window is not None and backend != "sftp":
+        return "--window requires --backend sftp"
+
+    return None
 
 
 def upload_server(file_path, server_id, port, options, src_path, dest_path, 
-        recursive, quiet):
+        recursive, quiet, jobs=1, delta=False, compress="none",
+        bundle=False, backend="scp", window=None, refresh=False,
+        verify=False):
     """ Uploads files to the selected server.
 
     Arguments:
@@ -693,16 +2559,32 @@ def upload_server(file_path, server_id, port, options, src_path, dest_path,
     dest_path -- str, path to file(s) destination,
     recursive -- boolean, uploads file(s) recursively if True,
     quiet -- boolean, prints progress if False,
+    jobs -- int, number of concurrent transfers, default value: 1.
+    delta -- boolean, sends only the changed blocks if True,
+        default value: False.
+    compress -- str, compression codec, see serverCompress.CODECS,
+        default value: "none".
+    bundle -- boolean, sends the file(s) as a single tar stream if True,
+        default value: False.
+    backend -- str, scp or sftp, default value: "scp".
+    window -- int, bytes in flight with the sftp backend,
+        default value: None for serverSftp.WINDOW.
+    refresh -- boolean, checks every file on the server in delta mode
+        if True, default value: False.
+    verify -- boolean, checks the checksums of the files sent if True,
+        default value: False.
 
     Returns:
 
     """
     server_object = setup_server(file_path, server_id, port, options)
-    server_object.upload(src_path, dest_path, recursive, quiet)
+    server_object.upload(src_path, dest_path, recursive, quiet, jobs, delta,
+            compress, bundle, backend, window, refresh, verify)
 
 
 def download_server(file_path, server_id, port, options, src_path, dest_path, 
-        recursive, quiet):
+        recursive, quiet, resume=False, compress="none", bundle=False,
+        backend="scp", window=None, jobs=1, verify=False):
     """ Downloads files from the selected server.
 
     Arguments:
@@ -715,12 +2597,216 @@ def download_server(file_path, server_id, port, options, src_path, dest_path,
     dest_path -- str, path to file(s) destination,
     recursive -- boolean, downloads file(s) recursively if True.
     quiet -- boolean, prints progress if False.
+    resume -- boolean, downloads the missing ranges only if True,
+        default value: False.
+    compress -- str, compression codec, see serverCompress.CODECS,
+        default value: "none".
+    bundle -- boolean, receives the file(s) as a single tar stream if
+        True, default value: False.
+    backend -- str, scp or sftp, default value: "scp".
+    window -- int, bytes requested ahead with the sftp backend,
+        default value: None for serverSftp.WINDOW.
+    jobs -- int, number of concurrent channels, default value: 1.
+    verify -- boolean, checks the checksums of the files received if
+        True, default value: False.
+
+    Returns:
+
+    """
+    server_object = setup_server(file_path, server_id, port, options)
+    server_object.download(src_path, dest_path, recursive, quiet, resume,
+            compress, bundle, backend, window, jobs, verify)
+
+
+def split_location(location):
+    """ Splits a server:path location.
+
+    Arguments:
+    location -- str, server number or server name (user@host) and
+        path separated by a colon.
+
+    Returns:
+    server_id -- str, server number or server name.
+    path -- str, path on the server, '.' if empty.
+
+    """
+    server_id, separator, path = location.partition(':')
+
+    if not separator or not server_id:
+        sys.stderr.write("Error: {} is not of the form server:path.\n"
+                .format(location))
+        exit(1)
+
+    return server_id, path or '.'
+
+
+def copy_server(file_path, src_path, dest_path, quiet, compress="none",
+        direct=False):
+    """ Copies files from a server to another server.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    src_path -- list[str], server:path locations of the files to copy,
+        all on the same server.
+    dest_path -- str, server:path location of the destination
+        directory.
+    quiet -- boolean, prints progress if False.
+    compress -- str, codec compressing the stream on the servers,
+        none, zlib or zstd, default value: "none".
+    direct -- boolean, the source server sends the files to the
+        destination server itself if True, default value: False.
+
+    Returns:
+
+    """
+    registry = get_servers(file_path)
+    sources = [split_location(location) for location in src_path]
+    dest_id, dest_dir = split_location(dest_path)
+
+    if len(set(server_id for server_id, _ in sources)) > 1:
+        sys.stderr.write("Error: the sources must be on the same server.\n")
+        exit(1)
+
+    src_server = setup_server(file_path, sources[0][0], None, '', registry)
+    dest_server = setup_server(file_path, dest_id, None, '', registry)
+    src_server.copy(dest_server, [path for _, path in sources], dest_dir,
+            quiet, compress, direct)
+
+
+def watch_server(file_path, server_id, port, options, local_dir, dest_path,
+        excludes=None, interval=None):
+    """ Keeps a directory of the selected server in sync with a local one.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    server_id -- str, server number in the list of available
+        servers or server name (user@host).
+    port -- str, port number.
+    options -- str, additional options.
+    local_dir -- str, path to the local directory.
+    dest_path -- str, path to the remote directory.
+    excludes -- list[str], shell patterns of the paths to ignore,
+        default value: None.
+    interval -- float, seconds between two scans of the directory
+        instead of inotify, default value: None.
 
     Returns:
 
     """
     server_object = setup_server(file_path, server_id, port, options)
-    server_object.download(src_path, dest_path, recursive, quiet)
+    server_object.watch(local_dir, dest_path, excludes, interval)
+
+
+def expand_sources(src_path, dest_path, recursive):
+    """ Expands the sources of an upload into single file transfers.
+
+    Directories are walked if recursive is True and their structure
+    is reproduced under dest_path.
+    Arguments:
+    src_path -- list[str], paths of files to upload.
+    dest_path -- str, path to the destination directory.
+    recursive -- boolean, expands directories if True.
+
+    Returns:
+    remote_dirs -- list[str], remote directories to create.
+    transfers -- list[tuple(str, str, int)], local path, remote
+        directory and size of each file, largest first.
+    failures -- list[tuple(str, str)], path and reason of the sources
+        that cannot be transferred.
+
+    """
+    remote_dirs = [dest_path]
+    transfers = []
+    failures = []
+
+    for src in src_path:
+        if os.path.isfile(src):
+            transfers.append((src, dest_path, os.path.getsize(src)))
+
+        elif os.path.isdir(src) and recursive:
+            parent = os.path.dirname(os.path.abspath(src))
+
+            for root, _, files in os.walk(src):
+                relative = os.path.relpath(os.path.abspath(root), parent)
+                remote_dir = '/'.join([dest_path] +
+                        relative.split(os.sep))
+                remote_dirs.append(remote_dir)
+
+                for name in files:
+                    local_path = os.path.join(root, name)
+
+                    try:
+                        transfers.append((local_path, remote_dir, 
+                            os.path.getsize(local_path)))
+
+                    except OSError as err:
+                        failures.append((local_path, err.strerror))
+
+        elif os.path.isdir(src):
+            failures.append((src, "Is a directory, use --recursive"))
+
+        else:
+            failures.append((src, "No such file or directory"))
+
+    transfers.sort(key=lambda transfer: transfer[2], reverse=True)
+
+    return remote_dirs, transfers, failures
+
+
+def local_totals(src_path, recursive):
+    """ Counts the files and bytes of an upload.
+
+    Arguments:
+    src_path -- list[str], paths of files to upload.
+    recursive -- boolean, counts directories recursively if True.
+
+    Returns:
+    file_count -- int, number of files.
+    total_size -- int, number of bytes.
+
+    """
+    file_count = 0
+    total_size = 0
+
+    for src in src_path:
+        if os.path.isfile(src):
+            file_count += 1
+            total_size += os.path.getsize(src)
+
+        elif os.path.isdir(src) and recursive:
+            for root, _, files in os.walk(src):
+                for name in files:
+                    path = os.path.join(root, name)
+
+                    if os.path.isfile(path):
+                        file_count += 1
+                        total_size += os.path.getsize(path)
+
+    return file_count, total_size
+
+
+def remote_mkdir(transport, remote_dirs, batch_size=200):
+    """ Creates directories on the server.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    remote_dirs -- list[str], directories to create.
+    batch_size -- int, number of directories per command,
+        default value: 200.
+
+    Returns:
+
+    """
+    for i in range(0, len(remote_dirs), batch_size):
+        channel = transport.open_session()
+        channel.exec_command("mkdir -p " + ' '.join(
+            serverCompress.quote_path(path)
+            for path in remote_dirs[i:i+batch_size]))
+
+        if channel.recv_exit_status() != 0:
+            raise scp.SCPException(channel.recv_stderr(1024).decode().strip())
+
+        channel.close()
 
 
 def ask_input(prompt, exit_char='q', modify=False):
@@ -762,52 +2848,37 @@ def ask_input(prompt, exit_char='q', modify=False):
 
     return answer
 
-suffixes = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
-
-def humansize(nbytes):
-    i = 0
-    while nbytes >= 1024 and i < len(suffixes)-1:
-        nbytes /= 1024.
-        i += 1
-    f = ('%.2f' % nbytes).rstrip('0').rstrip('.')
-    return '%s %s' % (f, suffixes[i])
-
 
-def progress(filename, size, sent):
-    """ Prints the progress for the upload or download functions.
+def ask_settings(modify=False):
+    """ Asks for the settings of a server until they are valid.
 
     Arguments:
-    filename -- byte, name of the file being transferred. 
-    size -- byte, size of the file being transferred. 
-    sent -- byte, number of bytes already transferred.
+    modify -- boolean, True if the function is used to 
+        modify a server,
+        default value: False.
 
     Returns:
+    settings -- str, comma separated key=value pairs.
 
     """
-    i = 0
-    suffixes = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
-    print_size = size # Size that will be printed with correct unit.
+    while True:
+        settings = ask_input("Settings", modify=modify).replace(' ', '')
+        values = serverRegistry.parse_settings(settings)
 
-    while print_size >= 1024:
-        print_size /= 1024
-        i += 1
-        
-    sys.stdout.write("{}: {sent_B:.2f}/{total_B:.2f} {suffix} " \
-            "{percent:.2f}%\r".format(
-        filename.decode(), 
-        sent_B=sent/pow(10, 3*i), 
-        total_B=print_size,
-        suffix=suffixes[i],
-        percent=float(sent)/float(size)*100))
-
-    if float(sent) == float(size):
-        sys.stdout.write("{}: {sent_B:.2f}/{total_B:.2f} {suffix} " \
-                "{percent:.2f}%\n".format(
-            filename.decode(), 
-            sent_B=sent/pow(10, 3*i), 
-            total_B=print_size,
-            suffix=suffixes[i],
-            percent=float(sent)/float(size)*100))
+        try:
+            if values is not None and values.get("limit"):
+                serverRate.parse_rate(values["limit"])
+
+            if values is not None:
+                serverTransport.parse_tuning(settings)
+                return settings
+
+        except ValueError:
+            pass
+
+        print("Settings must be key=value pairs with keys in {}, "
+                "e.g. limit=1M,tags=web+eu.\n".format(
+                    ', '.join(serverRegistry.SETTINGS)))
 
 
 def clean_options(options):
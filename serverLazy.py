@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Lazy imports of the modules that are slow to load.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import sys
+import types
+import importlib
+import threading
+import importlib.util
+
+
+# Held while a lazy module is loaded, a module may load other lazy
+# modules.
+load_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """ Module imported the first time one of its attributes is used.
+
+    The attributes are read from the imported module, which is loaded
+    once under load_lock. importlib.util.LazyLoader is not safe to use
+    from several threads before Python 3.12, a thread could see a
+    module that was still empty.
+    """
+
+    def __init__(self, name):
+        """ Initialise lazy module object.
+
+        Arguments:
+        name -- str, name of a top level module.
+
+        Returns:
+        module -- LazyModule, lazy module object.
+
+        """
+        super().__init__(name)
+        self._lazy_module = None
+
+
+    def load(self):
+        """ Imports the module if it is not loaded yet.
+
+        Arguments:
+
+        Returns:
+        module -- module, imported module.
+
+        """
+        module = self._lazy_module
+
+        if module is None:
+            with load_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(
+                            self.__name__)
+
+                module = self._lazy_module
+
+        return module
+
+
+    def __getattr__(self, name):
+        """ Gets an attribute of the imported module.
+
+        Only called for the attributes that the lazy module does not
+        have itself.
+        Arguments:
+        name -- str, name of the attribute.
+
+        Returns:
+        value -- object, value of the attribute.
+
+        """
+        return getattr(self.load(), name)
+
+
+    def __dir__(self):
+        """ Lists the attributes of the imported module.
+
+        Arguments:
+
+        Returns:
+        names -- list[str], names of the attributes.
+
+        """
+        return dir(self.load())
+
+
+def lazy_import(name):
+    """ Imports a module the first time one of its attributes is used.
+
+    paramiko and scp take most of the start up time of the program,
+    the commands that do not open a connection never load them nor
+    the transfer modules.
+    Arguments:
+    name -- str, name of a top level module.
+
+    Returns:
+    module -- module, module already loaded or LazyModule.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError("No module named '{}'".format(name), name=name)
+
+    return LazyModule(name)
+
+
+def preload(*modules):
+    """ Loads lazy modules before they are used.
+
+    The lazy modules are safe to load from several threads, loading
+    them beforehand keeps the threads from waiting for each other.
+    Arguments:
+    modules -- module, modules returned by lazy_import.
+
+    Returns:
+
+    """
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module.load()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Timings of the phases of the operations written as JSON lines.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+
+
+ENV_VAR = "SERVER_METRICS"
+
+# Path to the metrics file, None if the metrics are not recorded.
+output_path = os.environ.get(ENV_VAR) or None
+output_lock = threading.Lock()
+
+# Operation recorded by the current thread, see operation.
+current = threading.local()
+
+
+def set_output(file_path):
+    """ Sets the file the metrics are appended to.
+
+    Arguments:
+    file_path -- str, path to the metrics file, None to keep the
+        path of the SERVER_METRICS environment variable.
+
+    Returns:
+
+    """
+    global output_path
+
+    if file_path is not None:
+        output_path = file_path
+
+
+def write_record(record):
+    """ Appends a record to the metrics file.
+
+    The line is written with a single call so that the processes
+    sharing the file do not mix their records.
+    Arguments:
+    record -- dict, metrics of an operation.
+
+    Returns:
+
+    """
+    line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+
+    with output_lock:
+        fd = os.open(output_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0o644)
+
+        try:
+            os.write(fd, line)
+
+        finally:
+            os.close(fd)
+
+
+@contextlib.contextmanager
+def operation(name, server_name, port):
+    """ Records the metrics of an operation of the current thread.
+
+    The operations started during another operation of the thread
+    are part of it. The record is written when the operation ends,
+    with its exit status.
+    Arguments:
+    name -- str, name of the operation, e.g. upload.
+    server_name -- str, server name (user@host).
+    port -- str, port number.
+
+    Returns:
+    record -- dict, metrics of the operation, None if the metrics are
+        not recorded.
+
+    """
+    if output_path is None or getattr(current, "record", None) is not None:
+        yield getattr(current, "record", None)
+        return
+
+    record = {"operation": name, "server": server_name, "port": port,
+            "start": round(time.time(), 3), "status": 0, "phases": {},
+            "bytes": 0, "files": 0}
+    current.record = record
+    current.stack = []
+    start = time.monotonic()
+
+    try:
+        yield record
+
+    except SystemExit as err:
+        record["status"] = err.code if isinstance(err.code, int) else 1
+        raise
+
+    except KeyboardInterrupt:
+        record["status"] = "canceled"
+        raise
+
+    except BaseException as err:
+        record["status"] = type(err).__name__
+        raise
+
+    finally:
+        current.record = None
+        record["duration"] = round(time.monotonic() - start, 6)
+        record["phases"] = {phase: round(seconds, 6)
+                for phase, seconds in record["phases"].items()}
+        data_time = record["phases"].get("data", 0)
+        record["throughput"] = round(record["bytes"] / data_time) \
+                if data_time else None
+
+        with contextlib.suppress(OSError):
+            write_record(record)
+
+
+def measured(name):
+    """ Records the calls of a Server method as operations.
+
+    Arguments:
+    name -- str, name of the operation.
+
+    Returns:
+    decorator -- function, wraps the method in operation.
+
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(server_object, *args, **kwargs):
+            with operation(name, server_object.get_server_name(),
+                    server_object.get_port()):
+                return method(server_object, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def phase(name):
+    """ Times a phase of the current operation.
+
+    The time of the phases nested in another one is only counted in
+    the inner phase, the phases add up to the time measured.
+    Arguments:
+    name -- str, name of the phase, e.g. kex.
+
+    Returns:
+
+    """
+    record = getattr(current, "record", None)
+
+    if record is None:
+        yield None
+        return
+
+    frame = [time.monotonic(), 0.0]
+    current.stack.append(frame)
+
+    try:
+        yield None
+
+    finally:
+        current.stack.pop()
+        elapsed = time.monotonic() - frame[0]
+        record["phases"][name] = record["phases"].get(name, 0.0) + \
+                elapsed - frame[1]
+
+        if current.stack:
+            current.stack[-1][1] += elapsed
+
+
+def add_bytes(nbytes, files=0):
+    """ Counts the bytes and files transferred by the current operation.
+
+    Arguments:
+    nbytes -- int, number of bytes transferred.
+    files -- int, number of files transferred, default value 0.
+
+    Returns:
+
+    """
+    record = getattr(current, "record", None)
+
+    if record is not None:
+        record["bytes"] += nbytes
+        record["files"] += files
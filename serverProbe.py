@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Concurrent latency and health probes of the servers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import json
+import time
+import select
+import socket
+import contextlib
+import concurrent.futures
+import serverLazy
+import serverRegistry
+
+
+# Loaded on first use, see serverLazy.
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), ".local/var/probe.json")
+
+# Seconds after which a probe result is measured again.
+TTL = 300
+
+TIMEOUT = 5.0
+WORKERS = 32
+
+# Phases of a probe in order, in seconds from the end of the previous
+# one.
+PHASES = ["connect", "banner", "kex"]
+
+
+def host_key(host, port):
+    """ Gets the key of a host in the probe cache.
+
+    Arguments:
+    host -- str, host name or address.
+    port -- str, port number.
+
+    Returns:
+    key -- str, host:port.
+
+    """
+    return "{}:{}".format(host, port or '22')
+
+
+def wait_banner(sock, deadline):
+    """ Waits for the SSH banner of a server without consuming it.
+
+    The banner is peeked at so that the key exchange can read it.
+    Arguments:
+    sock -- socket.socket, connected socket.
+    deadline -- float, time.monotonic() deadline.
+
+    Returns:
+
+    """
+    while True:
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0 or not select.select([sock], [], [],
+                remaining)[0]:
+            raise socket.timeout("no SSH banner")
+
+        data = sock.recv(4096, socket.MSG_PEEK)
+
+        if not data:
+            raise ConnectionError("connection closed before the banner")
+
+        if b'\n' in data:
+            return None
+
+        # Part of the banner arrived, wait for the rest.
+        time.sleep(0.01)
+
+
+def probe_host(host, port, timeout=TIMEOUT):
+    """ Measures the connection phases of a server.
+
+    The key exchange is done without authentication, the host key is
+    not checked.
+    Arguments:
+    host -- str, host name or address.
+    port -- str, port number.
+    timeout -- float, seconds allowed for the whole probe,
+        default value TIMEOUT.
+
+    Returns:
+    result -- dict, seconds spent in each of PHASES, error message or
+        None and time of the probe.
+
+    """
+    result = {"error": None, "time": int(time.time())}
+    deadline = time.monotonic() + timeout
+    start = time.monotonic()
+    transport = None
+    sock = None
+
+    try:
+        sock = socket.create_connection((host, int(port or 22)), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        result["connect"] = time.monotonic() - start
+
+        start = time.monotonic()
+        wait_banner(sock, deadline)
+        result["banner"] = time.monotonic() - start
+
+        start = time.monotonic()
+        transport = paramiko.Transport(sock)
+        transport.start_client(timeout=max(0.1, deadline -
+            time.monotonic()))
+        result["kex"] = time.monotonic() - start
+
+    except (OSError, ValueError, paramiko.SSHException) as err:
+        result["error"] = str(err) or type(err).__name__
+
+    finally:
+        if transport is not None:
+            transport.close()
+
+        elif sock is not None:
+            sock.close()
+
+    return result
+
+
+def load_cache(cache_path=CACHE_PATH):
+    """ Loads the probe results of the cache.
+
+    Arguments:
+    cache_path -- str, path to the cache file, default value CACHE_PATH.
+
+    Returns:
+    results -- dict{str: dict}, probe result by host key, empty if the
+        file is missing or invalid.
+
+    """
+    try:
+        with open(cache_path, 'r') as f_handle:
+            results = json.load(f_handle)
+
+    except (OSError, ValueError):
+        return {}
+
+    return results if isinstance(results, dict) else {}
+
+
+def save_cache(results, cache_path=CACHE_PATH):
+    """ Merges probe results into the cache.
+
+    Arguments:
+    results -- dict{str: dict}, probe result by host key.
+    cache_path -- str, path to the cache file, default value CACHE_PATH.
+
+    Returns:
+
+    """
+    if not results:
+        return None
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    with serverRegistry.locked(cache_path):
+        cached = load_cache(cache_path)
+        cached.update(results)
+        serverRegistry.write_atomic(cache_path, json.dumps(cached,
+            separators=(',', ':')).encode())
+
+
+def probe_hosts(hosts, timeout=TIMEOUT, workers=WORKERS, refresh=False,
+        ttl=TTL, cache_path=CACHE_PATH):
+    """ Probes hosts concurrently, reusing the recent cached results.
+
+    Arguments:
+    hosts -- list[tuple(str, str)], host and port of each server.
+    timeout -- float, seconds allowed for each probe,
+        default value TIMEOUT.
+    workers -- int, number of concurrent probes, default value WORKERS.
+    refresh -- boolean, probes every host again if True,
+        default value False.
+    ttl -- float, lifetime of the cached results in seconds,
+        default value TTL.
+    cache_path -- str, path to the cache file, default value CACHE_PATH.
+
+    Returns:
+    results -- dict{str: dict}, probe result by host key, see
+        probe_host.
+
+    """
+    cached = {} if refresh else load_cache(cache_path)
+    now = time.time()
+    results = {}
+    pending = {}
+
+    for host, port in hosts:
+        key = host_key(host, port)
+        result = cached.get(key)
+
+        if isinstance(result, dict) and now - result.get("time", 0) <= ttl:
+            results[key] = result
+
+        else:
+            pending[key] = (host, port)
+
+    if not pending:
+        return results
+
+    serverLazy.preload(paramiko)
+    executor = concurrent.futures.ThreadPoolExecutor(max(1, min(workers,
+        len(pending))))
+    futures = {key: executor.submit(probe_host, host, port, timeout)
+            for key, (host, port) in pending.items()}
+
+    try:
+        measured = {key: future.result() for key, future in futures.items()}
+
+    finally:
+        # cancel_futures of shutdown needs Python 3.9.
+        for future in futures.values():
+            future.cancel()
+
+        executor.shutdown(wait=False)
+
+    with contextlib.suppress(OSError):
+        save_cache(measured, cache_path)
+
+    results.update(measured)
+
+    return results
+
+
+def total_time(result):
+    """ Gets the time taken to reach a server.
+
+    Arguments:
+    result -- dict, probe result, see probe_host.
+
+    Returns:
+    seconds -- float, sum of the phases, None if the server could not
+        be reached.
+
+    """
+    if result is None or result.get("error"):
+        return None
+
+    return sum(result.get(phase, 0) for phase in PHASES)
+
+
+def describe(result):
+    """ Formats a probe result.
+
+    Arguments:
+    result -- dict, probe result, see probe_host.
+
+    Returns:
+    text -- str, phase timings or reason the server is unreachable.
+
+    """
+    if result.get("error"):
+        return "unreachable ({})".format(result["error"])
+
+    return ', '.join("{} {:.1f} ms".format(phase, result[phase]*1000)
+            for phase in PHASES) + ", total {:.1f} ms".format(
+                    total_time(result)*1000)
+
+
+def tagged_servers(server_list, tag):
+    """ Finds the servers with a tag.
+
+    Arguments:
+    server_list -- serverRegistry.Registry, indexed servers.
+    tag -- str, tag of the servers.
+
+    Returns:
+    indices -- list[int], indices of the servers with the tag.
+
+    """
+    return [i for i in range(len(server_list))
+            if tag in serverRegistry.parse_tags(
+                server_list.get_fields(i)[4])]
+
+
+def fastest_server(server_list, indices, timeout=TIMEOUT):
+    """ Selects the fastest reachable server of a group of replicas.
+
+    Arguments:
+    server_list -- serverRegistry.Registry, indexed servers.
+    indices -- list[int], indices of the replicas.
+    timeout -- float, seconds allowed for each probe,
+        default value TIMEOUT.
+
+    Returns:
+    index -- int, index of the fastest server, None if none of them
+        could be reached.
+
+    """
+    hosts = {i: server_list.get_fields(i)[1:3] for i in indices}
+    results = probe_hosts(list(hosts.values()), timeout)
+    reachable = [(total_time(results[host_key(*host)]), i)
+            for i, host in hosts.items()
+            if total_time(results[host_key(*host)]) is not None]
+
+    return min(reachable)[1] if reachable else None
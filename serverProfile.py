@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CPU and memory profiles of a command.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import sys
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+
+
+MODES = ["cpu", "memory"]
+
+# Number of functions or lines in the summaries.
+TOP = 20
+
+# Frames kept for each memory allocation.
+FRAMES = 10
+
+# Groups of the CPU summary, by parts of the path or of the name of
+# the functions, the ciphers and MACs of paramiko are C functions.
+GROUPS = [("paramiko", ["/paramiko/"]), ("crypto", ["cryptography", "hmac"]),
+        ("progress", ["serverProgress.py"])]
+
+
+class CPUProfile:
+    """ Profile of the functions run by all the threads of a command.
+
+    The transfers spend most of their time in the threads of paramiko
+    and of the concurrent channels. Before Python 3.12, each thread is
+    profiled on its own and the profiles are merged at the end. Since
+    Python 3.12, a single profile covers all the threads and only one
+    can be enabled at a time.
+    """
+
+    def __init__(self):
+        """ Initialise CPU profile object.
+
+        Arguments:
+
+        Returns:
+        profile -- CPUProfile, CPU profile object.
+
+        """
+        self.profiles = []
+        self.lock = threading.Lock()
+
+
+    def start_thread(self, *_):
+        """ Starts the profile of the current thread.
+
+        Set with threading.setprofile, it is called on the first event
+        of each new thread and replaces itself with a profiler.
+        Arguments:
+        _ -- arguments of the profile functions, unused.
+
+        Returns:
+
+        """
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+
+        with self.lock:
+            self.profiles.append(profile)
+
+        profile.enable()
+
+
+    def start(self):
+        """ Starts profiling the current and the new threads.
+
+        Arguments:
+
+        Returns:
+
+        """
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.start_thread)
+
+        self.start_thread()
+
+
+    def stop(self):
+        """ Stops profiling.
+
+        Arguments:
+
+        Returns:
+        stats -- pstats.Stats, merged statistics of the threads.
+
+        """
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+
+        self.profiles[0].disable()
+
+        with self.lock:
+            stats = pstats.Stats(*self.profiles, stream=sys.stderr)
+
+        return stats
+
+
+def group_times(stats):
+    """ Sums the time spent in the functions of each group.
+
+    Arguments:
+    stats -- pstats.Stats, profile statistics.
+
+    Returns:
+    times -- dict{str: float}, seconds spent in the functions of each
+        group, not counting the functions they call.
+
+    """
+    times = {name: 0.0 for name, _ in GROUPS}
+
+    for (file_name, _, function), (_, _, own_time, _, _) in \
+            stats.stats.items():
+        for name, parts in GROUPS:
+            if any(part in file_name or part in function for part in parts):
+                times[name] += own_time
+
+    return times
+
+
+def report_cpu(stats, output_path=None, top=TOP):
+    """ Prints the summary of a CPU profile.
+
+    Arguments:
+    stats -- pstats.Stats, profile statistics.
+    output_path -- str, path to the file the statistics are saved to,
+        default value None.
+    top -- int, number of functions printed, default value TOP.
+
+    Returns:
+
+    """
+    if output_path is not None:
+        stats.dump_stats(output_path)
+
+    sys.stderr.write("\nCPU profile, top {} functions by cumulative time:\n"
+            .format(top))
+    stats.sort_stats("cumulative").print_stats(top)
+
+    sys.stderr.write("Time in {}.\n".format(', '.join(
+        "{} {:.3f}s".format(name, seconds)
+        for name, seconds in group_times(stats).items())))
+
+    if output_path is not None:
+        sys.stderr.write("Statistics saved to {}, see pstats.\n".format(
+            output_path))
+
+
+def report_memory(snapshot, peak, output_path=None, top=TOP):
+    """ Prints the summary of a memory profile.
+
+    Arguments:
+    snapshot -- tracemalloc.Snapshot, allocations still alive.
+    peak -- int, peak size of the allocations in bytes.
+    output_path -- str, path to the file the snapshot is saved to,
+        default value None.
+    top -- int, number of lines printed, default value TOP.
+
+    Returns:
+
+    """
+    if output_path is not None:
+        snapshot.dump(output_path)
+
+    statistics = snapshot.statistics("lineno")
+    sys.stderr.write("\nMemory profile, peak {:.1f} MB, {:.1f} MB still "
+            "allocated, top {} lines:\n".format(peak / 2**20,
+                sum(stat.size for stat in statistics) / 2**20, top))
+
+    for stat in statistics[:top]:
+        sys.stderr.write(" {}\n".format(stat))
+
+    if output_path is not None:
+        sys.stderr.write("Snapshot saved to {}, see tracemalloc.\n".format(
+            output_path))
+
+
+@contextlib.contextmanager
+def profiled(mode, output_path=None, top=TOP):
+    """ Profiles the code run in the context.
+
+    The summary is printed on the standard error when the context
+    exits, also if the command exits with an error.
+    Arguments:
+    mode -- str, cpu for cProfile or memory for tracemalloc.
+    output_path -- str, path to the file the raw statistics are saved
+        to, default value None.
+    top -- int, number of entries of the summary, default value TOP.
+
+    Returns:
+
+    """
+    if mode == "memory":
+        tracemalloc.start(FRAMES)
+
+        try:
+            yield None
+
+        finally:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(False, tracemalloc.__file__)])
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            report_memory(snapshot, peak, output_path, top)
+
+        return None
+
+    profile = CPUProfile()
+    profile.start()
+
+    try:
+        yield None
+
+    finally:
+        report_cpu(profile.stop(), output_path, top)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Progress display sampled at a fixed rate for file transfers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import sys
+import json
+import time
+import threading
+import serverRate
+import serverMetrics
+
+
+SUFFIXES = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
+FORMATS = ["text", "json"]
+
+# Seconds between two displays on a terminal and in logs.
+TTY_INTERVAL = 0.2
+LOG_INTERVAL = 5.0
+
+# Weight of the last sample in the smoothed throughput.
+RATE_SMOOTHING = 0.3
+
+output_format = "text"
+
+
+def set_format(new_format):
+    """ Sets the default output format of the progress.
+
+    Arguments:
+    new_format -- str, text or json.
+
+    Returns:
+
+    """
+    global output_format
+    output_format = new_format
+
+
+def humansize(nbytes):
+    """ Formats a number of bytes with a unit.
+
+    Arguments:
+    nbytes -- int, number of bytes.
+
+    Returns:
+    size -- str, formatted size.
+
+    """
+    i = 0
+
+    while nbytes >= 1024 and i < len(SUFFIXES)-1:
+        nbytes /= 1024.
+        i += 1
+
+    f = ('%.2f' % nbytes).rstrip('0').rstrip('.')
+
+    return '%s %s' % (f, SUFFIXES[i])
+
+
+def humantime(seconds):
+    """ Formats a duration.
+
+    Arguments:
+    seconds -- float, duration in seconds.
+
+    Returns:
+    duration -- str, formatted duration, h:mm:ss or m:ss.
+
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+    return "{}:{:02d}".format(minutes, seconds)
+
+
+class Progress:
+    """ Aggregate progress of the files of a transfer.
+
+    The callbacks only update counters, the display is refreshed at a
+    fixed rate whatever the number of chunks transferred. The callbacks
+    also wait for the bandwidth limits, see serverRate.
+    """
+
+    def __init__(self, file_count=None, total_size=None, quiet=False,
+            fmt=None, stream=None):
+        """ Initialise progress object.
+
+        Arguments:
+        file_count -- int, number of files to transfer, None if
+            unknown, default value None.
+        total_size -- int, number of bytes to transfer, None if
+            unknown, default value None.
+        quiet -- boolean, displays nothing if True,
+            default value: False.
+        fmt -- str, text or json, default value None for the format
+            set with set_format.
+        stream -- file, output of the display, default value None for
+            the standard output.
+
+        Returns:
+        progress -- Progress, progress object.
+
+        """
+        self.file_count = file_count
+        self.total_size = total_size
+        self.quiet = quiet
+        self.fmt = fmt or output_format
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.interval = TTY_INTERVAL if self.tty else LOG_INTERVAL
+
+        self.sent = 0
+        self.done = 0
+        self.last = {}
+        self.lock = threading.Lock()
+        self.buckets = serverRate.active_buckets()
+
+        self.start = time.monotonic()
+        self.next_display = self.start + self.interval
+        self.sample_time = self.start
+        self.sample_sent = 0
+        self.rate = 0.0
+
+
+    def update(self, key, size, sent):
+        """ Records the progress of one file.
+
+        Arguments:
+        key -- str or bytes, name of the file.
+        size -- int, size of the file.
+        sent -- int, number of bytes of the file transferred.
+
+        Returns:
+
+        """
+        with self.lock:
+            last = self.last.get(key)
+
+            if last is None or sent < last:
+                # A new file, possibly with the name of a previous one.
+                last = None
+
+            amount = sent - (last or 0)
+            self.sent += amount
+            self.last[key] = sent
+
+            if sent == size and last != size:
+                self.done += 1
+
+            now = time.monotonic()
+
+            if now >= self.next_display:
+                self.next_display = now + self.interval
+                self.display(now)
+
+        serverRate.throttle(self.buckets, amount)
+
+
+    def callback(self, key, size=None):
+        """ Creates the progress callback of one file.
+
+        Arguments:
+        key -- str, unique name of the file being transferred.
+        size -- int, size of the file, unused, kept for the callers
+            that know it, default value None.
+
+        Returns:
+        callback -- function, progress callback taking the file name,
+            size and number of bytes transferred.
+
+        """
+        return lambda filename, file_size, sent: self.update(key, file_size,
+                sent)
+
+
+    def __call__(self, filename, size, sent):
+        """ Progress callback for SCPClient, files are named by scp.
+
+        Arguments:
+        filename -- bytes, name of the file being transferred.
+        size -- int, size of the file being transferred.
+        sent -- int, number of bytes already transferred.
+
+        Returns:
+
+        """
+        self.update(filename, size, sent)
+
+
+    def state(self, now):
+        """ Computes the current state of the transfer.
+
+        Arguments:
+        now -- float, current monotonic time.
+
+        Returns:
+        state -- dict, files and bytes transferred, totals, throughput
+            in bytes per second, elapsed time and estimated time left
+            in seconds.
+
+        """
+        if now > self.sample_time:
+            rate = (self.sent - self.sample_sent)/(now - self.sample_time)
+            self.rate = rate if self.sample_sent == 0 else \
+                    RATE_SMOOTHING*rate + (1 - RATE_SMOOTHING)*self.rate
+            self.sample_time = now
+            self.sample_sent = self.sent
+
+        eta = None
+
+        if self.total_size is not None and self.rate > 0:
+            eta = max(0, self.total_size - self.sent)/self.rate
+
+        return {"files_done": self.done, "files": self.file_count,
+                "bytes": self.sent, "total": self.total_size,
+                "rate": round(self.rate), "elapsed": round(now - self.start,
+                    3), "eta": None if eta is None else round(eta, 1)}
+
+
+    def display(self, now, final=False):
+        """ Displays the progress.
+
+        Arguments:
+        now -- float, current monotonic time.
+        final -- boolean, True for the last display, default value False.
+
+        Returns:
+
+        """
+        if self.quiet:
+            return None
+
+        state = self.state(now)
+
+        if final:
+            elapsed = now - self.start
+            state["rate"] = round(self.sent/elapsed) if elapsed > 0 else 0
+            state["eta"] = 0
+
+        if self.fmt == "json":
+            state["final"] = final
+            self.stream.write(json.dumps(state) + '\n')
+            self.stream.flush()
+            return None
+
+        line = "{} files".format(self.done) if self.file_count is None \
+                else "{}/{} files".format(self.done, self.file_count)
+
+        if self.total_size is None and self.file_count is None and \
+                self.done == 0:
+            # Streams whose files are not followed, e.g. server to
+            # server copies.
+            line = humansize(self.sent)
+
+        elif self.total_size is None:
+            line += ": {}".format(humansize(self.sent))
+
+        else:
+            percent = 100.0 if self.total_size == 0 else \
+                    float(self.sent)/float(self.total_size)*100
+            line += ": {}/{} {:.2f}%".format(humansize(self.sent),
+                    humansize(self.total_size), percent)
+
+        line += " {}/s".format(humansize(state["rate"]))
+
+        if final:
+            line += " in {}".format(humantime(now - self.start))
+
+        elif state["eta"] is not None:
+            line += " ETA {}".format(humantime(state["eta"]))
+
+        # Clear the end of a longer previous line on terminals.
+        end = '\n' if final or not self.tty else '\x1b[K\r'
+        self.stream.write(line + end)
+        self.stream.flush()
+
+
+    def finish(self):
+        """ Displays the final progress.
+
+        Arguments:
+
+        Returns:
+
+        """
+        with self.lock:
+            self.display(time.monotonic(), final=True)
+
+        serverMetrics.add_bytes(self.sent, self.done)
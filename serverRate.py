@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Token buckets limiting the bandwidth of the transfers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import time
+import threading
+
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+# Seconds of traffic a bucket lets through at once after being idle.
+BURST = 0.25
+
+global_bucket = None
+host_buckets = {}
+buckets_lock = threading.Lock()
+
+# Host of the transfers of each thread, the jobs of a batch run
+# concurrently against different hosts.
+current = threading.local()
+
+
+def parse_rate(text):
+    """ Parses a rate in bytes per second.
+
+    Arguments:
+    text -- str, rate with an optional K, M or G suffix, e.g. 500K.
+
+    Returns:
+    rate -- int, rate in bytes per second.
+
+    """
+    number = text.strip().upper().rstrip('B')
+    unit = number[-1:] if number[-1:] in UNITS else ''
+
+    try:
+        rate = int(float(number[:len(number)-len(unit)]) * UNITS[unit])
+
+    except OverflowError:
+        raise ValueError("rate is too large: {}".format(text))
+
+    if rate <= 0:
+        raise ValueError("rate must be positive: {}".format(text))
+
+    return rate
+
+
+class TokenBucket:
+    """ Token bucket shared by the concurrent transfers.
+
+    The transfers take the tokens after sending a chunk and wait until
+    the bucket is out of debt. A transfer asking while others are
+    waiting queues behind their debt, so the concurrent transfers get
+    an equal share of the rate.
+    """
+
+    def __init__(self, rate, burst=BURST):
+        """ Initialise token bucket object.
+
+        Arguments:
+        rate -- int, rate in bytes per second.
+        burst -- float, seconds of traffic let through at once,
+            default value BURST.
+
+        Returns:
+        bucket -- TokenBucket, token bucket object.
+
+        """
+        self.rate = rate
+        self.capacity = rate*burst
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def delay(self, amount):
+        """ Takes tokens and computes the wait until they are paid.
+
+        Arguments:
+        amount -- int, number of bytes transferred.
+
+        Returns:
+        delay -- float, seconds to wait.
+
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                    self.tokens + (now - self.stamp)*self.rate)
+            self.stamp = now
+            self.tokens -= amount
+
+            return max(0., -self.tokens/self.rate)
+
+
+def set_limit(rate):
+    """ Sets the limit shared by all the transfers of the program.
+
+    Arguments:
+    rate -- int, rate in bytes per second, None for no limit.
+
+    Returns:
+
+    """
+    global global_bucket
+    global_bucket = TokenBucket(rate) if rate else None
+
+
+def use_host(server_name, rate):
+    """ Selects the host of the next transfers and sets its limit.
+
+    The bucket of a host is created once and shared by all the
+    transfers to that host. The host is selected for the calling
+    thread only.
+    Arguments:
+    server_name -- str, server name (user@host).
+    rate -- int, rate in bytes per second, None for no limit.
+
+    Returns:
+
+    """
+    with buckets_lock:
+        if rate and (server_name not in host_buckets or
+                host_buckets[server_name].rate != rate):
+            host_buckets[server_name] = TokenBucket(rate)
+
+        elif not rate:
+            host_buckets.pop(server_name, None)
+
+        current.host = server_name
+
+
+def active_buckets():
+    """ Lists the buckets of the transfers to the current host.
+
+    Arguments:
+
+    Returns:
+    buckets -- list[TokenBucket], global and host buckets in use.
+
+    """
+    with buckets_lock:
+        return [bucket for bucket in [global_bucket,
+            host_buckets.get(getattr(current, "host", None))]
+            if bucket is not None]
+
+
+def throttle(buckets, amount):
+    """ Waits until the buckets allow a transferred amount.
+
+    Arguments:
+    buckets -- list[TokenBucket], buckets to take the tokens from.
+    amount -- int, number of bytes transferred.
+
+    Returns:
+
+    """
+    if amount <= 0 or not buckets:
+        return None
+
+    delay = max(bucket.delay(amount) for bucket in buckets)
+
+    if delay > 0:
+        time.sleep(delay)
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Indexed and locked access to the server list file.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import re
+import sys
+import mmap
+import zlib
+import fcntl
+import struct
+import tempfile
+import contextlib
+
+
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+
+# Magic, modification time, size and inode of the indexed server
+# list, number of lines and number of slots of the name table.
+HEADER = struct.Struct("<8sQQQQQ")
+MAGIC = b"SRVIDX1\0"
+OFFSET = struct.Struct("<Q")
+SLOT = struct.Struct("<I")
+
+# Keys of the settings field of a server, e.g. limit=1M,tags=web+eu,
+# the last ones are the transport settings, see serverTransport.
+SETTINGS = ["limit", "tags", "window", "packet", "ciphers", "macs",
+        "keepalive"]
+TAG_SEPARATOR = '+'
+
+# Field made of key=value pairs, told apart from the ssh options that
+# start with - or have capitalised keys.
+SETTINGS_FIELD = re.compile(r"[a-z]+=[^,]*(,[a-z]+=[^,]*)*")
+
+
+def file_signature(stat_result):
+    """ Gets the signature of a file used to check an index.
+
+    Arguments:
+    stat_result -- os.stat_result, status of the file.
+
+    Returns:
+    signature -- tuple(int, int, int), modification time, size and
+        inode of the file.
+
+    """
+    return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+
+def line_name(line):
+    """ Gets the server name of a line of the server list.
+
+    Arguments:
+    line -- bytes, line of the server list.
+
+    Returns:
+    server_name -- bytes, user@host part of the line.
+
+    """
+    return line.split(b'#', 1)[0].split(b' ', 1)[0].strip()
+
+
+def parse_settings(settings):
+    """ Parses the settings field of a server.
+
+    Arguments:
+    settings -- str, comma separated key=value pairs.
+
+    Returns:
+    values -- dict{str: str}, value of each key, None if the field
+        is not made of known settings.
+
+    """
+    values = {}
+
+    for item in settings.split(',') if settings else []:
+        key, sep, value = item.partition('=')
+
+        if not sep or key not in SETTINGS:
+            return None
+
+        values[key] = value
+
+    return values
+
+
+def parse_tags(settings):
+    """ Gets the tags of a server from its settings field.
+
+    Arguments:
+    settings -- str, comma separated key=value pairs.
+
+    Returns:
+    tags -- list[str], tags of the server.
+
+    """
+    tags = (parse_settings(settings) or {}).get("tags", '')
+
+    return [tag for tag in tags.split(TAG_SEPARATOR) if tag]
+
+
+def parse_line(line):
+    """ Parses a line of the server list.
+
+    Arguments:
+    line -- str, line of the server list,
+        user@host port options settings#comment.
+
+    Returns:
+    fields -- tuple(str, str, str, str, str, str), user, host, port
+        number, options, settings and comment of the server.
+
+    """
+    # Split comment from other args.
+    server_args, comment = line.split('#')[:2]
+
+    # Split server, port and options, options are '' if not given.
+    server_args = server_args.split(' ')
+    server_name, port = server_args[:2]
+    options = server_args[2:]
+
+    # The settings are the last field after the options, which may
+    # contain spaces. The lists written before they existed have
+    # nothing or an empty field there.
+    settings = ''
+
+    # A last field that is not valid settings, such as compression=yes
+    # after -o, is kept in the options.
+    if len(options) > 1 and (options[-1] == '' or
+            (SETTINGS_FIELD.fullmatch(options[-1]) and
+                parse_settings(options[-1]) is not None)):
+        settings = options.pop()
+
+    options = ' '.join(options)
+
+    # Split user and host.
+    user, host = server_name.split('@')[:2]
+
+    return user, host, port, options, settings, comment
+
+
+def split_lines(text):
+    """ Splits a server list into lines as readlines does.
+
+    Arguments:
+    text -- str, content of the server list.
+
+    Returns:
+    lines -- list[str], lines with their newline.
+
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+
+    return lines if lines[-1] else lines[:-1]
+
+
+def name_hash(server_name):
+    """ Hashes a server name, stable between invocations.
+
+    Arguments:
+    server_name -- bytes, server name.
+
+    Returns:
+    hash -- int, hash of the name.
+
+    """
+    return zlib.crc32(server_name)
+
+
+def build_index(data, signature):
+    """ Builds the index of the content of a server list.
+
+    Arguments:
+    data -- bytes, content of the server list.
+    signature -- tuple(int, int, int), signature of the server list,
+        see file_signature.
+
+    Returns:
+    index -- bytes, header, offsets of the lines and open addressing
+        table of the server names.
+
+    """
+    offsets = [0]
+    position = data.find(b'\n')
+
+    while position != -1:
+        offsets.append(position + 1)
+        position = data.find(b'\n', position + 1)
+
+    if offsets[-1] != len(data):
+        # Last line without a newline.
+        offsets.append(len(data))
+
+    count = len(offsets) - 1
+    slot_count = 1
+
+    while slot_count < 2*count:
+        slot_count *= 2
+
+    slots = [0]*slot_count
+
+    for i in range(count):
+        server_name = line_name(data[offsets[i]:offsets[i+1]])
+        slot = name_hash(server_name) & (slot_count - 1)
+
+        while slots[slot]:
+            if line_name(data[offsets[slots[slot]-1]:
+                    offsets[slots[slot]]]) == server_name:
+                # Keep the first line of duplicated names.
+                break
+
+            slot = (slot + 1) & (slot_count - 1)
+
+        else:
+            slots[slot] = i + 1
+
+    return b''.join([HEADER.pack(MAGIC, *signature, count, slot_count),
+        struct.pack("<{}Q".format(len(offsets)), *offsets),
+        struct.pack("<{}I".format(slot_count), *slots)])
+
+
+def write_atomic(file_path, data):
+    """ Writes a file through a temporary file renamed over it.
+
+    Readers see either the previous or the new content, never a
+    partially written file.
+    Arguments:
+    file_path -- str, path to the file.
+    data -- bytes, content of the file.
+
+    Returns:
+
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".servers.", dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as f_handle:
+            f_handle.write(data)
+            f_handle.flush()
+            os.fsync(f_handle.fileno())
+
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, os.stat(file_path).st_mode & 0o7777)
+
+        os.replace(tmp_path, file_path)
+
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+        raise
+
+
+class Registry:
+    """ Read-only view of a server list through its index.
+
+    The index is stored next to the server list and rebuilt when the
+    list changes, the lines are read from a memory map of the list.
+    """
+
+    def __init__(self, file_path):
+        """ Initialise registry object.
+
+        Arguments:
+        file_path -- str, path to file containing the servers.
+
+        Returns:
+        registry -- Registry, registry object.
+
+        """
+        self.file_path = file_path
+
+        with open(file_path, 'rb') as f_handle:
+            stat_result = os.fstat(f_handle.fileno())
+            self.signature = file_signature(stat_result)
+
+            if stat_result.st_size:
+                self.data = mmap.mmap(f_handle.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+
+            else:
+                self.data = b''
+
+        self.index = self._load_index()
+
+        if self.index is None:
+            index = build_index(self.data, self.signature)
+
+            with contextlib.suppress(OSError):
+                # The index is only a cache, read-only directories
+                # keep it in memory.
+                write_atomic(file_path + INDEX_SUFFIX, index)
+
+            self.index = index
+
+        _, _, _, _, self.count, self.slot_count = HEADER.unpack_from(
+                self.index)
+        self.slot_start = HEADER.size + OFFSET.size*(self.count + 1)
+
+
+    def _load_index(self):
+        """ Loads the index if it matches the server list.
+
+        Arguments:
+
+        Returns:
+        index -- mmap.mmap, index, None if missing or outdated.
+
+        """
+        try:
+            with open(self.file_path + INDEX_SUFFIX, 'rb') as f_handle:
+                index = mmap.mmap(f_handle.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+
+        except (OSError, ValueError):
+            return None
+
+        if len(index) < HEADER.size:
+            return None
+
+        header = HEADER.unpack_from(index)
+
+        if header[0] != MAGIC or header[1:4] != self.signature:
+            return None
+
+        return index
+
+
+    def __len__(self):
+        """ Overloaded __len__ function.
+
+        Arguments:
+
+        Returns:
+        count -- int, number of servers.
+
+        """
+        return self.count
+
+
+    def _raw_line(self, index):
+        """ Gets a line of the server list without decoding it.
+
+        Arguments:
+        index -- int, index of the line, starting at 0.
+
+        Returns:
+        line -- bytes, line of the server list.
+
+        """
+        if index < 0 or index >= self.count:
+            raise IndexError("server index out of range")
+
+        start, end = struct.unpack_from("<2Q", self.index, HEADER.size +
+                OFFSET.size*index)
+
+        return self.data[start:end]
+
+
+    def get_line(self, index):
+        """ Gets a line of the server list.
+
+        Arguments:
+        index -- int, index of the line, starting at 0.
+
+        Returns:
+        line -- str, line of the server list.
+
+        """
+        return self._raw_line(index).decode()
+
+
+    def get_fields(self, index):
+        """ Gets the fields of a server without creating a Server.
+
+        Arguments:
+        index -- int, index of the line, starting at 0.
+
+        Returns:
+        fields -- tuple(str, str, str, str, str, str), see parse_line.
+
+        """
+        return parse_line(self.get_line(index))
+
+
+    def get_name(self, index):
+        """ Gets the name of a server.
+
+        Arguments:
+        index -- int, index of the line, starting at 0.
+
+        Returns:
+        server_name -- str, server name (user@host).
+
+        """
+        return line_name(self._raw_line(index)).decode()
+
+
+    def select(self, pattern):
+        """ Selects the servers whose name or comment contains a pattern.
+
+        Arguments:
+        pattern -- str, text to look for.
+
+        Returns:
+        indices -- list[int], indices of the matching lines.
+
+        """
+        pattern = pattern.encode()
+        indices = []
+
+        for i in range(self.count):
+            server_args, _, comment = self._raw_line(i).partition(b'#')
+
+            if pattern in line_name(server_args) or pattern in comment:
+                indices.append(i)
+
+        return indices
+
+
+    def get_lines(self):
+        """ Gets all the lines of the server list.
+
+        Arguments:
+
+        Returns:
+        lines -- list[str], lines of the server list.
+
+        """
+        return split_lines(self.data[:].decode())
+
+
+    def find(self, server_name):
+        """ Finds the line of a server from its name.
+
+        Arguments:
+        server_name -- str, server name (user@host).
+
+        Returns:
+        index -- int, index of the first line of the server, None if
+            the server is not in the list.
+
+        """
+        server_name = server_name.encode()
+        mask = self.slot_count - 1
+        slot = name_hash(server_name) & mask
+
+        while True:
+            line_number = SLOT.unpack_from(self.index, self.slot_start +
+                    SLOT.size*slot)[0]
+
+            if line_number == 0:
+                return None
+
+            if line_name(self._raw_line(line_number - 1)) == server_name:
+                return line_number - 1
+
+            slot = (slot + 1) & mask
+
+
+    def close(self):
+        """ Closes the memory maps.
+
+        Arguments:
+
+        Returns:
+
+        """
+        for mapping in (self.data, self.index):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+
+
+@contextlib.contextmanager
+def locked(file_path):
+    """ Holds the exclusive lock of a server list.
+
+    The lock is taken on a separate file so that it survives the
+    replacement of the server list.
+    Arguments:
+    file_path -- str, path to file containing the servers.
+
+    Returns:
+    lock_handle -- file, opened lock file.
+
+    """
+    with open(file_path + LOCK_SUFFIX, 'a') as lock_handle:
+        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+
+        try:
+            yield lock_handle
+
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+
+def update_servers(file_path, update, signature=None):
+    """ Replaces the lines of a server list under its lock.
+
+    Arguments:
+    file_path -- str, path to file containing the servers.
+    update -- function, takes the list of lines and returns the new
+        list of lines.
+    signature -- tuple(int, int, int), signature of the server list
+        the update was prepared with, the update is refused if the
+        list changed since, None to skip the check, default value None.
+
+    Returns:
+    server_list -- list[str], new lines of the server list.
+
+    """
+    with locked(file_path):
+        with open(file_path, 'rb') as f_handle:
+            stat_result = os.fstat(f_handle.fileno())
+            data = f_handle.read()
+
+        if signature is not None and \
+                file_signature(stat_result) != signature:
+            sys.stderr.write("Error: {} was modified by another process, "
+                    "try again.\n".format(file_path))
+            exit(1)
+
+        server_list = update(split_lines(data.decode()))
+        data = ''.join(server_list).encode()
+        write_atomic(file_path, data)
+
+        with contextlib.suppress(OSError):
+            write_atomic(file_path + INDEX_SUFFIX, build_index(data,
+                file_signature(os.stat(file_path))))
+
+    return server_list
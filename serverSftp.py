@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SFTP transfers with pipelined writes and prefetched reads.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import stat
+import posixpath
+import serverLazy
+
+
+# Loaded on first use, see serverLazy.
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+BACKENDS = ["scp", "sftp"]
+CHUNK_SIZE = 1048576
+
+# Size of the read requests and default number of bytes requested
+# ahead of the reads of a download or written ahead of the
+# acknowledgements of an upload.
+REQUEST_SIZE = 32768
+WINDOW = 16777216
+
+
+def open_sftp(transport, window=WINDOW):
+    """ Opens an SFTP session.
+
+    Arguments:
+    transport -- paramiko.transport.Transport or
+        serverBroker.BrokerTransport, connected transport.
+    window -- int, receive window of the channel in bytes,
+        default value WINDOW.
+
+    Returns:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+
+    """
+    if isinstance(transport, paramiko.Transport):
+        return paramiko.SFTPClient.from_transport(transport,
+                window_size=window)
+
+    # The channels of the broker are relayed with the window of the
+    # broker connection.
+    channel = transport.open_session()
+    channel.invoke_subsystem("sftp")
+
+    return paramiko.SFTPClient(channel)
+
+
+def sftp_path(path):
+    """ Converts a remote path for SFTP.
+
+    SFTP servers do not expand ~, the paths are relative to the home
+    directory already.
+    Arguments:
+    path -- str, remote path.
+
+    Returns:
+    path -- str, path for SFTP.
+
+    """
+    if path == '~':
+        return '.'
+
+    if path.startswith('~/'):
+        return path[2:] or '.'
+
+    return path
+
+
+def make_dirs(sftp, remote_dirs):
+    """ Creates directories and their parents on the server.
+
+    Arguments:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+    remote_dirs -- list[str], directories to create.
+
+    Returns:
+
+    """
+    existing = set()
+
+    for remote_dir in remote_dirs:
+        path = ''
+
+        for part in sftp_path(remote_dir).split('/'):
+            path = posixpath.join(path, part) if path else part or '/'
+
+            if path in existing:
+                continue
+
+            try:
+                if not stat.S_ISDIR(sftp.stat(path).st_mode):
+                    raise NotADirectoryError(path)
+
+            except FileNotFoundError:
+                sftp.mkdir(path)
+
+            existing.add(path)
+
+
+def put_file(sftp, local_path, remote_path, window=WINDOW, update=None,
+        file_hash=None):
+    """ Uploads a file with pipelined writes.
+
+    The writes do not wait for their acknowledgement until window bytes
+    are unacknowledged, the oldest writes are then waited for. paramiko
+    only bounds the pipelined writes when replies are already waiting.
+    Arguments:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+    local_path -- str, path to the local file.
+    remote_path -- str, path to the remote file.
+    window -- int, number of bytes written ahead of the
+        acknowledgements, default value WINDOW.
+    update -- function, progress callback, default value None.
+    file_hash -- hashlib hash, updated with the content of the file,
+        default value None.
+
+    Returns:
+    sent -- int, number of bytes sent.
+
+    """
+    size = os.path.getsize(local_path)
+    mode = os.stat(local_path).st_mode & 0o7777
+    remote_path = sftp_path(remote_path)
+    chunk_size = max(REQUEST_SIZE, min(CHUNK_SIZE, window // 4))
+    position = 0
+
+    with open(local_path, 'rb') as f_handle, \
+            sftp.open(remote_path, 'wb') as remote_file:
+        remote_file.set_pipelined(True)
+        # Each write request carries at most MAX_REQUEST_SIZE bytes, the
+        # requests of the next chunk are left room for.
+        in_flight = max(1, (window - chunk_size) //
+                remote_file.MAX_REQUEST_SIZE)
+
+        for chunk in iter(lambda: f_handle.read(chunk_size), b''):
+            remote_file.write(chunk)
+            position += len(chunk)
+
+            # The pending requests of paramiko, a failed write raises
+            # its error here.
+            while len(remote_file._reqs) > in_flight:
+                sftp._read_response(remote_file._reqs.popleft())
+
+            if file_hash:
+                file_hash.update(chunk)
+
+            if update:
+                update(local_path, size, position)
+
+    sftp.chmod(remote_path, mode)
+
+    if update:
+        update(local_path, size, size)
+
+    return position
+
+
+def get_file(sftp, remote_path, local_path, size, window=WINDOW,
+        update=None, file_hash=None):
+    """ Downloads a file with prefetched reads.
+
+    The file is read in segments of window bytes, the read requests of
+    a segment are all sent before its data is read. The concurrency
+    limit of paramiko.SFTPFile.prefetch polls every 10 ms and is
+    slower than waiting for each segment.
+    Arguments:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+    remote_path -- str, path to the remote file.
+    local_path -- str, path to the local file.
+    size -- int, size of the remote file.
+    window -- int, number of bytes requested ahead of the reads,
+        default value WINDOW.
+    update -- function, progress callback, default value None.
+    file_hash -- hashlib hash, updated with the content of the file,
+        default value None.
+
+    Returns:
+    received -- int, number of bytes received.
+
+    """
+    position = 0
+    window = max(REQUEST_SIZE, window)
+
+    with sftp.open(sftp_path(remote_path), 'rb') as remote_file, \
+            open(local_path, 'wb') as f_handle:
+        for start in range(0, size, window):
+            end = min(size, start + window)
+            chunks = [(offset, min(REQUEST_SIZE, end - offset))
+                    for offset in range(start, end, REQUEST_SIZE)]
+
+            for chunk in remote_file.readv(chunks):
+                f_handle.write(chunk)
+                position += len(chunk)
+
+                if file_hash:
+                    file_hash.update(chunk)
+
+                if update:
+                    update(local_path, size, position)
+
+    if update:
+        update(local_path, size, size)
+
+    return position
+
+
+def walk(sftp, remote_dir, relative):
+    """ Lists the files of a remote directory recursively.
+
+    Arguments:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+    remote_dir -- str, path to the remote directory.
+    relative -- str, path of the directory relative to the
+        destination.
+
+    Returns:
+    dirs -- list[str], relative paths of the directories.
+    files -- list[tuple(str, str, int, int)], remote path, relative
+        path, size and modification time of each file.
+
+    """
+    dirs = [relative]
+    files = []
+
+    for attributes in sftp.listdir_attr(remote_dir):
+        remote_path = posixpath.join(remote_dir, attributes.filename)
+        local_relative = os.path.join(relative, attributes.filename)
+
+        if stat.S_ISLNK(attributes.st_mode):
+            # Links to files are followed as with scp.
+            attributes = sftp.stat(remote_path)
+
+            if stat.S_ISDIR(attributes.st_mode):
+                continue
+
+        if stat.S_ISDIR(attributes.st_mode):
+            sub_dirs, sub_files = walk(sftp, remote_path, local_relative)
+            dirs.extend(sub_dirs)
+            files.extend(sub_files)
+
+        elif stat.S_ISREG(attributes.st_mode):
+            files.append((remote_path, local_relative, attributes.st_size,
+                attributes.st_mtime))
+
+    return dirs, files
+
+
+def list_remote(sftp, src_path, dest_path, recursive):
+    """ Lists the remote files to download and their local paths.
+
+    The local directories are created. dest_path is used as the file
+    name if a single file is downloaded and dest_path is not a
+    directory, otherwise the files are placed under dest_path, see
+    serverSync.list_remote.
+    Arguments:
+    sftp -- paramiko.sftp_client.SFTPClient, SFTP session.
+    src_path -- list[str], paths of the remote files.
+    dest_path -- str, path to the local destination.
+    recursive -- boolean, lists directories recursively if True.
+
+    Returns:
+    files -- list[tuple(str, str, int, int)], remote path, local path,
+        size and modification time of each file.
+    missing -- list[str], remote paths that do not exist or are
+        directories while recursive is False.
+
+    """
+    dirs = []
+    files = []
+    missing = []
+
+    for src in src_path:
+        path = sftp_path(src)
+        name = posixpath.basename(posixpath.normpath(path))
+
+        try:
+            attributes = sftp.stat(path)
+
+        except FileNotFoundError:
+            missing.append(src)
+            continue
+
+        if stat.S_ISDIR(attributes.st_mode) and recursive:
+            sub_dirs, sub_files = walk(sftp, path, name)
+            dirs.extend(sub_dirs)
+            files.extend(sub_files)
+
+        elif stat.S_ISREG(attributes.st_mode):
+            files.append((path, name, attributes.st_size,
+                attributes.st_mtime))
+
+        else:
+            missing.append(src)
+
+    single_file = len(src_path) == 1 and len(files) == 1 and not dirs and \
+            not os.path.isdir(dest_path)
+
+    for relative in dirs:
+        os.makedirs(os.path.join(dest_path, relative), exist_ok=True)
+
+    files = [(remote_path, dest_path if single_file else
+        os.path.join(dest_path, relative), size, mtime)
+        for remote_path, relative, size, mtime in files]
+
+    return files, missing
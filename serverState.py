@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Cache of the state of the remote files seen by the transfers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import json
+import time
+import serverRegistry
+
+
+STATE_DIR = os.path.join(os.path.expanduser('~'), ".local/var/state")
+
+# Seconds after which an entry is checked on the server again.
+TTL = 7*86400
+
+
+def state_path(server_name, port, state_dir=STATE_DIR):
+    """ Gets the path to the cache of a server.
+
+    Arguments:
+    server_name -- str, server name (user@host).
+    port -- str, port number.
+    state_dir -- str, directory of the caches, default value STATE_DIR.
+
+    Returns:
+    path -- str, path to the cache file.
+
+    """
+    return os.path.join(state_dir, "{}:{}.json".format(server_name, port))
+
+
+def load_entries(file_path):
+    """ Loads the entries of a cache file.
+
+    Arguments:
+    file_path -- str, path to the cache file.
+
+    Returns:
+    entries -- dict{str: list}, size, modification time, checksum and
+        time seen of each remote path, empty if the file is missing
+        or invalid.
+
+    """
+    try:
+        with open(file_path, 'r') as f_handle:
+            entries = json.load(f_handle)
+
+    except (OSError, ValueError):
+        return {}
+
+    return entries if isinstance(entries, dict) else {}
+
+
+class RemoteState:
+    """ Size, modification time and checksum last seen of remote files.
+
+    The entries are recorded after successful transfers and let the
+    next transfers skip the unchanged files without asking the server.
+    An entry is dropped when its transfer fails and expires after TTL
+    seconds so that the files changed by others are eventually seen.
+    """
+
+    def __init__(self, server_name, port, state_dir=STATE_DIR, ttl=TTL):
+        """ Initialise remote state object.
+
+        Arguments:
+        server_name -- str, server name (user@host).
+        port -- str, port number.
+        state_dir -- str, directory of the caches,
+            default value STATE_DIR.
+        ttl -- float, lifetime of the entries in seconds,
+            default value TTL.
+
+        Returns:
+        state -- RemoteState, remote state object.
+
+        """
+        self.file_path = state_path(server_name, port, state_dir)
+        self.ttl = ttl
+        self.entries = load_entries(self.file_path)
+        self.changes = {}
+
+
+    def lookup(self, remote_path):
+        """ Gets the entry of a remote file if it has not expired.
+
+        Arguments:
+        remote_path -- str, path to the remote file.
+
+        Returns:
+        entry -- list, size, modification time, checksum and time
+            seen, None if unknown or expired.
+
+        """
+        entry = self.entries.get(remote_path)
+
+        if entry is None or time.time() - entry[3] > self.ttl:
+            return None
+
+        return entry
+
+
+    def unchanged(self, local_path, remote_path):
+        """ Checks if a local file matches the last state of a remote one.
+
+        Arguments:
+        local_path -- str, path to the local file.
+        remote_path -- str, path to the remote file.
+
+        Returns:
+        unchanged -- boolean, True if the sizes and modification times
+            are the same.
+
+        """
+        entry = self.lookup(remote_path)
+        local_stat = os.stat(local_path)
+
+        return entry is not None and entry[:2] == [local_stat.st_size,
+                int(local_stat.st_mtime)]
+
+
+    def record(self, remote_path, size, mtime, digest=None):
+        """ Records the state of a remote file.
+
+        Arguments:
+        remote_path -- str, path to the remote file.
+        size -- int, size of the file.
+        mtime -- int, modification time of the file.
+        digest -- str, checksum of the file, default value None if
+            unknown, the previous one is kept if size and mtime match.
+
+        Returns:
+
+        """
+        entry = self.entries.get(remote_path)
+
+        if digest is None and entry is not None and \
+                entry[:2] == [size, mtime]:
+            digest = entry[2]
+
+        self.entries[remote_path] = self.changes[remote_path] = [size,
+                mtime, digest, int(time.time())]
+
+
+    def forget(self, remote_path):
+        """ Drops the entry of a remote file.
+
+        Arguments:
+        remote_path -- str, path to the remote file.
+
+        Returns:
+
+        """
+        if remote_path in self.entries:
+            del self.entries[remote_path]
+            self.changes[remote_path] = None
+
+
+    def save(self):
+        """ Writes the changes to the cache file.
+
+        The changes are merged with the file under its lock, the
+        transfers to the same server running at the same time do not
+        lose each other's entries.
+        Arguments:
+
+        Returns:
+
+        """
+        if not self.changes:
+            return None
+
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+
+        with serverRegistry.locked(self.file_path):
+            entries = load_entries(self.file_path)
+
+            for remote_path, entry in self.changes.items():
+                if entry is None:
+                    entries.pop(remote_path, None)
+
+                else:
+                    entries[remote_path] = entry
+
+            serverRegistry.write_atomic(self.file_path,
+                    json.dumps(entries, separators=(',', ':')).encode())
+
+        self.changes = {}
@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Delta and resumable transfer helpers.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import json
+import struct
+import hashlib
+import threading
+import concurrent.futures
+from shlex import quote
+import serverLazy
+
+
+# Loaded on first use, see serverLazy.
+scp = serverLazy.lazy_import("scp")
+
+
+BLOCK_SIZE = 131072
+CHUNK_SIZE = 8388608
+MANIFEST_SUFFIX = ".manifest"
+
+# Script run on the server with python3, it answers the stat, sums,
+# patch, list and read requests made by the functions below.
+REMOTE_HELPER = r"""
+import os, sys, json, stat, struct, hashlib
+mode = sys.argv[1]
+if mode == "list":
+    recursive = sys.argv[2] == "1"
+    out = {"files": [], "dirs": [], "missing": []}
+    for src in json.load(sys.stdin):
+        path = os.path.expanduser(src)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            out["files"].append([path, os.path.basename(path), st.st_size,
+                int(st.st_mtime)])
+        elif os.path.isdir(path) and recursive:
+            parent = os.path.dirname(os.path.abspath(path))
+            for root, dirs, files in os.walk(path):
+                out["dirs"].append(os.path.relpath(os.path.abspath(root),
+                    parent))
+                for name in files:
+                    st = os.stat(os.path.join(root, name))
+                    out["files"].append([os.path.join(root, name),
+                        os.path.relpath(os.path.join(os.path.abspath(root),
+                            name), parent), st.st_size, int(st.st_mtime)])
+        else:
+            out["missing"].append(src)
+    json.dump(out, sys.stdout)
+elif mode == "read":
+    chunk = int(sys.argv[2])
+    out = sys.stdout.buffer
+    for i, (path, ranges) in enumerate(json.load(sys.stdin)):
+        with open(path, "rb") as f:
+            for start, end in ranges:
+                f.seek(start)
+                while start < end:
+                    data = f.read(min(chunk, end - start))
+                    if not data:
+                        break
+                    out.write(struct.pack("!IQI", i, start, len(data)) +
+                        data + hashlib.sha1(data).digest())
+                    start += len(data)
+    out.flush()
+elif mode == "stat":
+    out = {}
+    for path in json.load(sys.stdin):
+        try:
+            st = os.stat(os.path.expanduser(path))
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            out[path] = [st.st_size, int(st.st_mtime)]
+    json.dump(out, sys.stdout)
+elif mode == "sums":
+    block = int(sys.argv[2])
+    out = {}
+    for path in json.load(sys.stdin):
+        with open(os.path.expanduser(path), "rb") as f:
+            out[path] = [hashlib.sha1(chunk).hexdigest()
+                for chunk in iter(lambda: f.read(block), b"")]
+    json.dump(out, sys.stdout)
+elif mode == "patch":
+    block = int(sys.argv[2])
+    inp = sys.stdin.buffer
+    count = 0
+    for line in iter(inp.readline, b""):
+        head = json.loads(line.decode())
+        path = os.path.expanduser(head["path"])
+        tmp = path + ".sync-tmp"
+        old = open(path, "rb") if os.path.isfile(path) else None
+        with open(tmp, "wb") as out:
+            while True:
+                op = inp.read(1)
+                if op == b"C":
+                    old.seek(struct.unpack("!Q", inp.read(8))[0] * block)
+                    out.write(old.read(block))
+                elif op == b"L":
+                    out.write(inp.read(struct.unpack("!I", inp.read(4))[0]))
+                else:
+                    break
+        if old is not None:
+            old.close()
+        os.chmod(tmp, head["mode"])
+        os.utime(tmp, (head["mtime"], head["mtime"]))
+        os.replace(tmp, path)
+        count += 1
+    json.dump({"files": count}, sys.stdout)
+"""
+
+
+def helper_command(mode, *args):
+    """ Builds the command running the remote helper.
+
+    Arguments:
+    mode -- str, helper mode, list, read, stat, sums or patch.
+    args -- str, additional arguments of the mode.
+
+    Returns:
+    command -- str, command to execute on the server.
+
+    """
+    return ' '.join(["python3", "-c", quote(REMOTE_HELPER), mode] +
+            [quote(str(arg)) for arg in args])
+
+
+def finish_helper(channel):
+    """ Reads the answer of the remote helper and closes the channel.
+
+    Arguments:
+    channel -- paramiko.channel.Channel, channel running the helper.
+
+    Returns:
+    answer -- dict, decoded answer of the helper, None if the helper
+        did not answer.
+
+    """
+    output = b''.join(iter(lambda: channel.recv(32768), b''))
+    error = b''.join(iter(lambda: channel.recv_stderr(32768), b''))
+
+    if channel.recv_exit_status() != 0:
+        channel.close()
+        raise scp.SCPException("Remote helper failed: {}".format(
+            error.decode(errors="replace").strip()))
+
+    channel.close()
+
+    return json.loads(output.decode()) if output else None
+
+
+def run_helper(transport, mode, request, *args):
+    """ Runs the remote helper with a JSON request.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    mode -- str, helper mode, list, stat or sums.
+    request -- list or dict, request sent on the helper input.
+    args -- str, additional arguments of the mode.
+
+    Returns:
+    answer -- dict, decoded answer of the helper.
+
+    """
+    channel = transport.open_session()
+    channel.exec_command(helper_command(mode, *args))
+    channel.sendall(json.dumps(request).encode())
+    channel.shutdown_write()
+
+    return finish_helper(channel)
+
+
+def plan_delta(transport, transfers, block_size=BLOCK_SIZE):
+    """ Compares the local files with the remote ones.
+
+    Files with the same size and modification time are unchanged, the
+    block checksums of the other files that exist on the server are
+    fetched.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    transfers -- list[tuple(str, str)], local path and remote path of
+        each file.
+    block_size -- int, size of the compared blocks,
+        default value BLOCK_SIZE.
+
+    Returns:
+    changed -- list[tuple(str, str)], local path and remote path of the
+        files to send.
+    remote_sums -- dict, block checksums of the remote files.
+
+    """
+    remote_stats = run_helper(transport, "stat",
+            [remote_path for _, remote_path in transfers])
+    changed = []
+    compare = []
+
+    for local_path, remote_path in transfers:
+        local_stat = os.stat(local_path)
+        remote_stat = remote_stats.get(remote_path)
+
+        if remote_stat == [local_stat.st_size, int(local_stat.st_mtime)]:
+            continue
+
+        changed.append((local_path, remote_path))
+
+        if remote_stat is not None and remote_stat[0] > 0:
+            compare.append(remote_path)
+
+    remote_sums = run_helper(transport, "sums", compare, block_size) \
+            if compare else {}
+
+    return changed, remote_sums
+
+
+def send_delta(transport, changed, remote_sums, progress=None,
+        block_size=BLOCK_SIZE, digests=None):
+    """ Sends the changed blocks of the files in a single stream.
+
+    Blocks already present on the server, at the same or at another
+    block offset, are copied there instead of being sent.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    changed -- list[tuple(str, str)], local path and remote path of the
+        files to send.
+    remote_sums -- dict, block checksums of the remote files.
+    progress -- serverProgress.Progress, progress of the transfer,
+        default value None.
+    block_size -- int, size of the compared blocks,
+        default value BLOCK_SIZE.
+    digests -- serverVerify.Digests, checksums of the files sent,
+        default value None.
+
+    Returns:
+    sent -- int, number of bytes of file content sent.
+
+    """
+    channel = transport.open_session()
+    channel.exec_command(helper_command("patch", block_size))
+    sent = 0
+
+    for local_path, remote_path in changed:
+        sums = remote_sums.get(remote_path, [])
+        index = {value: i for i, value in reversed(list(enumerate(sums)))}
+        local_stat = os.stat(local_path)
+        update = progress.callback(local_path, local_stat.st_size) \
+                if progress else None
+
+        channel.sendall(json.dumps({"path": remote_path,
+            "mode": local_stat.st_mode & 0o7777,
+            "mtime": int(local_stat.st_mtime)}).encode() + b'\n')
+
+        file_hash = digests.new(remote_path) if digests is not None \
+                else None
+
+        with open(local_path, 'rb') as f_handle:
+            position = 0
+
+            for i, chunk in enumerate(iter(lambda: f_handle.read(block_size),
+                    b'')):
+                digest = hashlib.sha1(chunk).hexdigest()
+
+                if file_hash:
+                    file_hash.update(chunk)
+
+                if i < len(sums) and sums[i] == digest:
+                    channel.sendall(b'C' + struct.pack("!Q", i))
+
+                elif digest in index:
+                    channel.sendall(b'C' + struct.pack("!Q", index[digest]))
+
+                else:
+                    channel.sendall(b'L' + struct.pack("!I", len(chunk)) +
+                            chunk)
+                    sent += len(chunk)
+
+                position += len(chunk)
+
+                if update:
+                    update(local_path, local_stat.st_size, position)
+
+        channel.sendall(b'E')
+
+        if update:
+            update(local_path, local_stat.st_size, local_stat.st_size)
+
+    channel.shutdown_write()
+    finish_helper(channel)
+
+    return sent
+
+
+def recv_exact(channel, nbytes):
+    """ Receives an exact number of bytes from a channel.
+
+    Arguments:
+    channel -- paramiko.channel.Channel, channel to read from.
+    nbytes -- int, number of bytes to read.
+
+    Returns:
+    data -- bytes, received data.
+
+    """
+    data = bytearray()
+
+    while len(data) < nbytes:
+        chunk = channel.recv(min(nbytes - len(data), 1048576))
+
+        if not chunk:
+            raise scp.SCPException("Underlying channel was closed")
+
+        data.extend(chunk)
+
+    return bytes(data)
+
+
+def load_manifest(manifest_path):
+    """ Loads the manifest of a partial download.
+
+    Arguments:
+    manifest_path -- str, path to the manifest.
+
+    Returns:
+    manifest -- dict, size and modification time of the remote file
+        and byte ranges already written and verified, None if there
+        is no valid manifest.
+
+    """
+    try:
+        with open(manifest_path, 'r') as f_handle:
+            return json.load(f_handle)
+
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(manifest_path, manifest):
+    """ Saves the manifest of a partial download atomically.
+
+    Arguments:
+    manifest_path -- str, path to the manifest.
+    manifest -- dict, manifest to save.
+
+    Returns:
+
+    """
+    tmp_path = manifest_path + ".tmp"
+
+    with open(tmp_path, 'w') as f_handle:
+        json.dump(manifest, f_handle)
+
+    os.replace(tmp_path, manifest_path)
+
+
+def add_range(ranges, start, end):
+    """ Adds a byte range to a sorted list of disjoint ranges.
+
+    Arguments:
+    ranges -- list[list[int]], sorted disjoint [start, end) ranges.
+    start -- int, start of the range to add.
+    end -- int, end of the range to add.
+
+    Returns:
+    ranges -- list[list[int]], merged ranges.
+
+    """
+    merged = []
+
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+
+        else:
+            merged.append([range_start, range_end])
+
+    return merged
+
+
+def missing_ranges(ranges, size):
+    """ Computes the byte ranges of a file that are not yet written.
+
+    Arguments:
+    ranges -- list[list[int]], sorted disjoint [start, end) ranges
+        already written.
+    size -- int, size of the file.
+
+    Returns:
+    missing -- list[list[int]], ranges left to write.
+
+    """
+    missing = []
+    position = 0
+
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+
+        position = max(position, end)
+
+    if position < size:
+        missing.append([position, size])
+
+    return missing
+
+
+def split_ranges(downloads, jobs, chunk_size=CHUNK_SIZE):
+    """ Splits the missing ranges of the files between the jobs.
+
+    The ranges are cut in pieces of about a job's share of the bytes,
+    aligned on chunk_size, so that a single large file is fetched by
+    all the jobs. Each piece goes to the job with the fewest bytes.
+    Arguments:
+    downloads -- list[dict], files to download, see plan_resume.
+    jobs -- int, number of concurrent fetches.
+    chunk_size -- int, size of the verified chunks,
+        default value CHUNK_SIZE.
+
+    Returns:
+    shards -- list[dict{int: list[list[int]]}], ranges of each file
+        index for each job, empty jobs are left out.
+
+    """
+    total_size = sum(end - start for download in downloads
+            for start, end in download["missing"])
+    share = -(-total_size // max(1, jobs))
+    share = max(chunk_size, -(-share // chunk_size) * chunk_size)
+    pieces = []
+
+    for i, download in enumerate(downloads):
+        for start, end in download["missing"]:
+            for piece_start in range(start, end, share):
+                pieces.append((min(end, piece_start + share) - piece_start,
+                    i, piece_start))
+
+    shards = [{} for _ in range(max(1, jobs))]
+    loads = [0] * len(shards)
+
+    for length, i, start in sorted(pieces, reverse=True):
+        job = loads.index(min(loads))
+        loads[job] += length
+        shards[job].setdefault(i, []).append([start, start + length])
+
+    return [shard for shard in shards if shard]
+
+
+def list_remote(transport, src_path, dest_path, recursive):
+    """ Lists the remote files to download and their local paths.
+
+    The local directories are created. dest_path is used as the file
+    name if a single file is downloaded and dest_path is not a
+    directory, otherwise the files are placed under dest_path.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    src_path -- list[str], paths of the remote files.
+    dest_path -- str, path to the local destination.
+    recursive -- boolean, lists directories recursively if True.
+
+    Returns:
+    files -- list[tuple(str, str, int, int)], remote path, local path,
+        size and modification time of each file.
+    missing -- list[str], remote paths that do not exist or are
+        directories while recursive is False.
+
+    """
+    listing = run_helper(transport, "list", src_path,
+            "1" if recursive else "0")
+    single_file = len(src_path) == 1 and len(listing["files"]) == 1 and \
+            not listing["dirs"] and not os.path.isdir(dest_path)
+
+    for relative in listing["dirs"]:
+        os.makedirs(os.path.join(dest_path, relative), exist_ok=True)
+
+    files = [(remote_path, dest_path if single_file else
+        os.path.join(dest_path, relative), size, mtime)
+        for remote_path, relative, size, mtime in listing["files"]]
+
+    return files, listing["missing"]
+
+
+def plan_resume(transport, src_path, dest_path, recursive):
+    """ Lists the remote files and what is left to download of each.
+
+    Complete local files, recognised by their size and modification
+    time, are skipped. Partial files whose manifest matches the
+    remote file are resumed, the others are downloaded from scratch.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    src_path -- list[str], paths of the remote files.
+    dest_path -- str, path to the local destination.
+    recursive -- boolean, lists directories recursively if True.
+
+    Returns:
+    downloads -- list[dict], remote path, local path, size,
+        modification time and missing ranges of each file to download.
+    skipped -- int, number of complete files.
+    missing -- list[str], remote paths that do not exist or are
+        directories while recursive is False.
+
+    """
+    files, missing = list_remote(transport, src_path, dest_path, recursive)
+    downloads = []
+    skipped = 0
+
+    for remote_path, local_path, size, mtime in files:
+        manifest_path = local_path + MANIFEST_SUFFIX
+        manifest = load_manifest(manifest_path)
+
+        if manifest is None and os.path.isfile(local_path) and \
+                os.path.getsize(local_path) == size and \
+                int(os.path.getmtime(local_path)) == mtime:
+            skipped += 1
+            continue
+
+        if manifest is None or manifest["size"] != size or \
+                manifest["mtime"] != mtime or \
+                not os.path.isfile(local_path):
+            manifest = {"size": size, "mtime": mtime, "done": []}
+
+            with open(local_path, 'wb') as f_handle:
+                preallocate(f_handle, size)
+
+            save_manifest(manifest_path, manifest)
+
+        downloads.append({"remote": remote_path, "local": local_path,
+            "manifest": manifest,
+            "missing": missing_ranges(manifest["done"], size)})
+
+    return downloads, skipped, missing
+
+
+def preallocate(f_handle, size):
+    """ Reserves the space of a file before its ranges are written.
+
+    The blocks are allocated up front where the file system supports
+    it, the ranges written out of order then do not fragment the
+    file. The file is only extended otherwise.
+    Arguments:
+    f_handle -- file object, file opened for writing.
+    size -- int, size of the file.
+
+    Returns:
+
+    """
+    f_handle.truncate(size)
+
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f_handle.fileno(), 0, size)
+
+        except OSError:
+            pass
+
+
+def fetch_shard(transport, downloads, shard, state, chunk_size):
+    """ Downloads the ranges of one job over its own channel.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    downloads -- list[dict], files to download, see plan_resume.
+    shard -- dict{int: list[list[int]]}, ranges of each file index.
+    state -- dict, remaining bytes, progress callbacks, received bytes
+        and lock shared by the jobs, see fetch_ranges.
+    chunk_size -- int, size of the verified chunks.
+
+    Returns:
+
+    """
+    indices = sorted(shard)
+    left = sum(end - start for i in indices for start, end in shard[i])
+    handles = {}
+
+    channel = transport.open_session()
+    channel.exec_command(helper_command("read", chunk_size))
+    channel.sendall(json.dumps([[downloads[i]["remote"], shard[i]]
+        for i in indices]).encode())
+    channel.shutdown_write()
+
+    try:
+        while left:
+            position, start, length = struct.unpack("!IQI",
+                    recv_exact(channel, 16))
+            index = indices[position]
+            data = recv_exact(channel, length)
+
+            if hashlib.sha1(data).digest() != recv_exact(channel, 20):
+                raise scp.SCPException("Checksum mismatch in {}".format(
+                    downloads[index]["remote"]))
+
+            download = downloads[index]
+            manifest = download["manifest"]
+
+            if index not in handles:
+                handles[index] = open(download["local"], 'r+b')
+
+            handles[index].seek(start)
+            handles[index].write(data)
+            handles[index].flush()
+            left -= length
+
+            # The manifest is shared by the jobs fetching the same file.
+            with state["lock"]:
+                manifest["done"] = add_range(manifest["done"], start,
+                        start + length)
+                save_manifest(download["local"] + MANIFEST_SUFFIX, manifest)
+                state["remaining"][index] -= length
+                state["received"] += length
+                remaining = state["remaining"][index]
+
+            if index in state["updates"]:
+                state["updates"][index](download["local"], manifest["size"],
+                        manifest["size"] - remaining)
+
+        finish_helper(channel)
+
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def fetch_ranges(transport, downloads, progress=None, chunk_size=CHUNK_SIZE,
+        jobs=1):
+    """ Downloads the missing ranges of the files.
+
+    Each chunk is checked against the checksum computed on the server
+    before its range is recorded in the manifest. The manifest is
+    removed once a file is complete. With more than one job the
+    ranges are split between concurrent channels, see split_ranges.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    downloads -- list[dict], files to download, see plan_resume.
+    progress -- serverProgress.Progress, progress of the transfer,
+        default value None.
+    chunk_size -- int, size of the verified chunks,
+        default value CHUNK_SIZE.
+    jobs -- int, number of concurrent channels, default value 1.
+
+    Returns:
+    received -- int, number of bytes received.
+
+    """
+    if not downloads:
+        return 0
+
+    state = {"remaining": {}, "updates": {}, "received": 0,
+            "lock": threading.Lock()}
+
+    for i, download in enumerate(downloads):
+        size = download["manifest"]["size"]
+        state["remaining"][i] = sum(end - start
+                for start, end in download["missing"])
+
+        if progress:
+            state["updates"][i] = progress.callback(download["local"], size)
+            state["updates"][i](download["local"], size,
+                    size - state["remaining"][i])
+
+    shards = split_ranges(downloads, jobs, chunk_size)
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(shards))) \
+            as executor:
+        futures = [executor.submit(fetch_shard, transport, downloads, shard,
+            state, chunk_size) for shard in shards]
+
+        # The first error is raised once all the jobs have stopped,
+        # the ranges they received are kept in the manifests.
+        for future in futures:
+            future.exception()
+
+        for future in futures:
+            future.result()
+
+    received = state["received"]
+
+    for download in downloads:
+        manifest = download["manifest"]
+
+        if missing_ranges(manifest["done"], manifest["size"]):
+            raise scp.SCPException("{} is incomplete".format(download["remote"]))
+
+        os.utime(download["local"], (manifest["mtime"], manifest["mtime"]))
+        os.remove(download["local"] + MANIFEST_SUFFIX)
+
+    return received
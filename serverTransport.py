@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Window, packet size, algorithms and keepalive of the paramiko transports.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import socket
+import serverLazy
+import serverRate
+import serverMetrics
+import serverRegistry
+
+
+# Loaded on first use, see serverLazy.
+paramiko = serverLazy.lazy_import("paramiko")
+
+
+# Settings given for the current invocation, see set_tuning.
+overrides = {}
+
+
+def parse_tuning(text):
+    """ Parses the transport settings of a settings field.
+
+    The algorithm lists are separated like the tags, e.g.
+    ciphers=aes128-gcm@openssh.com+aes128-ctr.
+    Arguments:
+    text -- str, comma separated key=value pairs, window and packet
+        sizes accept K, M and G suffixes, keepalive is in seconds.
+
+    Returns:
+    tuning -- dict, window and packet sizes in bytes, tuples of cipher
+        and MAC names and keepalive interval of the keys present.
+
+    """
+    values = serverRegistry.parse_settings(text)
+
+    if values is None:
+        raise ValueError("settings must be key=value pairs with keys in "
+                "{}".format(', '.join(serverRegistry.SETTINGS)))
+
+    tuning = {}
+
+    for key in ("window", "packet"):
+        if values.get(key):
+            tuning[key] = serverRate.parse_rate(values[key])
+
+    for key in ("ciphers", "macs"):
+        if values.get(key):
+            tuning[key] = tuple(name for name in values[key].split(
+                serverRegistry.TAG_SEPARATOR) if name)
+
+    if values.get("keepalive"):
+        tuning["keepalive"] = int(values["keepalive"])
+
+        if tuning["keepalive"] < 0:
+            raise ValueError("keepalive must not be negative: {}".format(
+                values["keepalive"]))
+
+    return tuning
+
+
+def set_tuning(tuning):
+    """ Sets the transport settings of the current invocation.
+
+    They take precedence over the settings of the servers.
+    Arguments:
+    tuning -- dict, transport settings, see parse_tuning, None for
+        none.
+
+    Returns:
+
+    """
+    overrides.clear()
+    overrides.update(tuning or {})
+
+
+def server_tuning(settings):
+    """ Gets the transport settings of a server.
+
+    Arguments:
+    settings -- str, settings field of the server.
+
+    Returns:
+    tuning -- dict, settings of the server updated with the settings
+        of the current invocation.
+
+    """
+    tuning = parse_tuning(settings)
+    tuning.update(overrides)
+
+    return tuning
+
+
+def preferred(names, supported, kind):
+    """ Orders the supported algorithms with the requested ones first.
+
+    Arguments:
+    names -- tuple(str), requested algorithms in order of preference.
+    supported -- tuple(str), algorithms supported by paramiko.
+    kind -- str, kind of the algorithms for the error message.
+
+    Returns:
+    algorithms -- tuple(str), requested algorithms, the others are
+        only used if the server supports none of them.
+
+    """
+    unknown = [name for name in names if name not in supported]
+
+    if unknown:
+        raise paramiko.SSHException("unsupported {}: {}, available: {}"
+                .format(kind, ', '.join(unknown), ', '.join(supported)))
+
+    return tuple(names) + tuple(name for name in supported
+            if name not in names)
+
+
+def transport_factory(tuning):
+    """ Creates the transport factory of SSHClient.connect.
+
+    Arguments:
+    tuning -- dict, transport settings, see parse_tuning.
+
+    Returns:
+    factory -- function, creates a transport applying the settings on
+        a connected socket.
+
+    """
+    def factory(sock, **kwargs):
+        # Small packets such as the channel requests and the window
+        # adjustments are not delayed by Nagle's algorithm.
+        if isinstance(sock, socket.socket) and \
+                sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if "window" in tuning:
+            kwargs["default_window_size"] = tuning["window"]
+
+        if "packet" in tuning:
+            kwargs["default_max_packet_size"] = tuning["packet"]
+
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        start_client = transport.start_client
+
+        def timed_start_client(*args, **kwargs):
+            with serverMetrics.phase("kex"):
+                return start_client(*args, **kwargs)
+
+        # SSHClient.connect runs the key exchange and authenticates in
+        # a single call, the key exchange is timed on its own.
+        transport.start_client = timed_start_client
+
+        if "ciphers" in tuning:
+            options.ciphers = preferred(tuning["ciphers"], options.ciphers,
+                    "cipher(s)")
+
+        if "macs" in tuning:
+            options.digests = preferred(tuning["macs"], options.digests,
+                    "MAC(s)")
+
+        return transport
+
+    return factory
+
+
+def open_socket(host, port):
+    """ Connects a socket to a server, timing the name resolution.
+
+    Arguments:
+    host -- str, host name or address.
+    port -- int, port number.
+
+    Returns:
+    sock -- socket.socket, connected socket.
+
+    """
+    with serverMetrics.phase("dns"):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    error = None
+
+    with serverMetrics.phase("connect"):
+        for family, sock_type, proto, _, address in addresses:
+            sock = socket.socket(family, sock_type, proto)
+
+            try:
+                sock.connect(address)
+                return sock
+
+            except OSError as err:
+                sock.close()
+                error = err
+
+    raise error
+
+
+def apply_keepalive(transport, tuning, default=0):
+    """ Sets the keepalive interval of a connected transport.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    tuning -- dict, transport settings, see parse_tuning.
+    default -- int, interval in seconds if the settings have none,
+        default value 0 for no keepalive.
+
+    Returns:
+
+    """
+    interval = tuning.get("keepalive", default)
+
+    if interval:
+        transport.set_keepalive(interval)
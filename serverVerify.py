@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Checksums computed during the transfers and checked on the server.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import hashlib
+import threading
+import contextlib
+import serverLazy
+
+
+# Loaded on first use, see serverLazy.
+scp = serverLazy.lazy_import("scp")
+
+
+ALGORITHM = "sha256"
+
+# Hashes the NUL separated paths of the standard input in order,
+# shasum is used where coreutils are missing.
+REMOTE_HASH = "if command -v sha256sum >/dev/null 2>&1; then " \
+        "xargs -0 sha256sum --; else xargs -0 shasum -a 256 --; fi"
+
+
+class Digests:
+    """ Checksums of the files of a transfer by remote path.
+
+    The hashes are fed with the chunks as they are read or written
+    by the transfer, the files are not read a second time.
+    """
+
+    def __init__(self):
+        """ Initialise digests object.
+
+        Arguments:
+
+        Returns:
+        digests -- Digests, digests object.
+
+        """
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+
+    def new(self, remote_path):
+        """ Starts the checksum of a file.
+
+        Arguments:
+        remote_path -- str, path to the file on the server.
+
+        Returns:
+        file_hash -- hashlib hash, hash to update with the content of
+            the file.
+
+        """
+        file_hash = hashlib.new(ALGORITHM)
+
+        with self.lock:
+            self.hashes[remote_path] = file_hash
+
+        return file_hash
+
+
+    def __len__(self):
+        """ Overloaded __len__ function.
+
+        Arguments:
+
+        Returns:
+        count -- int, number of files.
+
+        """
+        return len(self.hashes)
+
+
+    def hexdigests(self):
+        """ Gets the checksums of the files.
+
+        Arguments:
+
+        Returns:
+        digests -- dict{str: str}, hexadecimal checksum by remote path.
+
+        """
+        with self.lock:
+            return {remote_path: file_hash.hexdigest()
+                    for remote_path, file_hash in self.hashes.items()}
+
+
+class HashingReader:
+    """ File object hashing the data read through it. """
+
+    def __init__(self, f_handle, file_hash):
+        """ Initialise hashing reader object.
+
+        Arguments:
+        f_handle -- file, opened file.
+        file_hash -- hashlib hash, hash of the data read.
+
+        Returns:
+        reader -- HashingReader, hashing reader object.
+
+        """
+        self.f_handle = f_handle
+        self.file_hash = file_hash
+
+
+    def read(self, nbytes=-1):
+        """ Reads data from the file.
+
+        Arguments:
+        nbytes -- int, maximum number of bytes, default value -1.
+
+        Returns:
+        data -- bytes, read data.
+
+        """
+        data = self.f_handle.read(nbytes)
+        self.file_hash.update(data)
+
+        return data
+
+
+    def seek(self, offset, *whence):
+        """ Moves in the file, the hashed data is not rewound.
+
+        Arguments:
+        offset -- int, offset.
+        whence -- int, optional reference of the offset, the streams
+            of tarfile only accept an offset.
+
+        Returns:
+        position -- int, new position.
+
+        """
+        return self.f_handle.seek(offset, *whence)
+
+
+    def tell(self):
+        """ Gets the position in the file.
+
+        Arguments:
+
+        Returns:
+        position -- int, current position.
+
+        """
+        return self.f_handle.tell()
+
+
+def hash_path(remote_path):
+    """ Converts a remote path for the hash command.
+
+    The paths are not expanded by a shell, ~ is the working directory
+    of the command.
+    Arguments:
+    remote_path -- str, path to the remote file.
+
+    Returns:
+    path -- str, path for the hash command.
+
+    """
+    if remote_path == '~' or remote_path.startswith('~/'):
+        return remote_path[2:] or '.'
+
+    return remote_path
+
+
+def unescape(path):
+    """ Decodes a path escaped in the output of sha256sum.
+
+    Arguments:
+    path -- str, escaped path.
+
+    Returns:
+    path -- str, decoded path.
+
+    """
+    return path.replace("\\\\", "\0").replace("\\n", "\n").replace(
+            "\0", "\\")
+
+
+def remote_digests(transport, remote_paths):
+    """ Hashes files on the server with a single command.
+
+    The names are sent and the errors are discarded in separate threads
+    while the checksums are read, the command would otherwise block
+    once the window of its output is full.
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    remote_paths -- list[str], paths to the remote files.
+
+    Returns:
+    digests -- dict{str: str}, hexadecimal checksum by remote path,
+        the files that could not be read are missing.
+
+    """
+    names = {hash_path(remote_path): remote_path
+            for remote_path in remote_paths}
+    channel = transport.open_session()
+    channel.exec_command(REMOTE_HASH)
+
+    def send_names():
+        # The command stops reading if it fails, its output tells.
+        with contextlib.suppress(OSError):
+            channel.sendall(b''.join(name.encode() + b'\0'
+                for name in names))
+            channel.shutdown_write()
+
+    def drain_stderr():
+        for _ in iter(lambda: channel.recv_stderr(32768), b''):
+            pass
+
+    threads = [threading.Thread(target=send_names, daemon=True),
+            threading.Thread(target=drain_stderr, daemon=True)]
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        output = b''.join(iter(lambda: channel.recv(32768), b''))
+
+        for thread in threads:
+            thread.join()
+
+        channel.recv_exit_status()
+
+    finally:
+        channel.close()
+
+    digests = {}
+
+    for line in output.decode(errors="replace").splitlines():
+        escaped = line.startswith('\\')
+        digest, _, name = line.lstrip('\\').partition('  ')
+        name = unescape(name) if escaped else name
+
+        if name in names:
+            digests[names[name]] = digest
+
+    return digests
+
+
+def check_digests(transport, digests):
+    """ Compares the checksums of a transfer with the server.
+
+    Arguments:
+    transport -- paramiko.transport.Transport, connected transport.
+    digests -- Digests, checksums computed during the transfer.
+
+    Returns:
+    mismatches -- list[tuple(str, str)], remote path and reason of the
+        files that differ.
+
+    """
+    local = digests.hexdigests()
+
+    if not local:
+        return []
+
+    remote = remote_digests(transport, list(local))
+
+    if not remote:
+        raise scp.SCPException("sha256sum or shasum is required on the "
+                "server")
+
+    return [(remote_path, "checksum mismatch" if remote_path in remote
+        else "cannot be read on the server")
+        for remote_path, digest in sorted(local.items())
+        if remote.get(remote_path) != digest]
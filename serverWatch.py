@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Changes of a local directory collected for continuous uploads.
+# Author: Mathias Roesler
+# Last modified: 10/26
+
+import os
+import time
+import errno
+import ctypes
+import struct
+import select
+import fnmatch
+import posixpath
+import ctypes.util
+import serverCompress
+
+
+# Seconds without changes after which a batch of changes is sent and
+# maximum seconds a batch waits while changes keep coming.
+DEBOUNCE = 0.3
+MAX_DELAY = 2.0
+
+# Seconds between two scans of the tree when inotify is not available.
+POLL_INTERVAL = 1.0
+
+# Number of removals and renames per remote command.
+BATCH_SIZE = 200
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+        IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.inotify_init1
+
+except (OSError, AttributeError):
+    libc = None
+
+
+def is_excluded(relative, excludes):
+    """ Checks if a path matches one of the exclude patterns.
+
+    Arguments:
+    relative -- str, path relative to the watched directory, with /
+        separators.
+    excludes -- list[str], shell patterns matched against the relative
+        path and each of its parts.
+
+    Returns:
+    excluded -- boolean, True if the path is excluded.
+
+    """
+    return any(fnmatch.fnmatch(relative, pattern) or any(fnmatch.fnmatch(
+        part, pattern) for part in relative.split('/'))
+        for pattern in excludes)
+
+
+def list_tree(root, excludes):
+    """ Lists the files and directories of a local directory.
+
+    Arguments:
+    root -- str, path to the directory.
+    excludes -- list[str], exclude patterns, see is_excluded.
+
+    Returns:
+    entries -- dict{str: tuple(int, int)}, size and modification time
+        in nanoseconds of each file, None for the directories, by path
+        relative to root.
+
+    """
+    entries = {}
+
+    for directory, dirs, files in os.walk(root):
+        relative = os.path.relpath(directory, root)
+        prefix = '' if relative == '.' else relative.replace(os.sep, '/') + \
+                '/'
+        dirs[:] = [name for name in dirs
+                if not is_excluded(prefix + name, excludes)]
+
+        for name in dirs:
+            entries[prefix + name] = None
+
+        for name in files:
+            if is_excluded(prefix + name, excludes):
+                continue
+
+            try:
+                file_stat = os.stat(os.path.join(directory, name))
+
+            except OSError:
+                continue
+
+            entries[prefix + name] = (file_stat.st_size, file_stat.st_mtime_ns)
+
+    return entries
+
+
+class InotifyWatcher:
+    """ Changes of a directory tree reported by inotify.
+
+    The events are changed, deleted and moved, with the paths relative
+    to the watched directory. A rename is reported as a single moved
+    event when both of its halves are read together, a file moved out
+    of the tree as deleted and a file moved into it as changed.
+    """
+
+    def __init__(self, root, excludes):
+        """ Initialise inotify watcher object.
+
+        Arguments:
+        root -- str, path to the directory to watch.
+        excludes -- list[str], exclude patterns, see is_excluded.
+
+        Returns:
+        watcher -- InotifyWatcher, inotify watcher object.
+
+        """
+        self.root = root
+        self.excludes = excludes
+        self.paths = {}
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.add_tree('')
+
+
+    def add_watch(self, relative):
+        """ Watches a directory of the tree.
+
+        Arguments:
+        relative -- str, path of the directory relative to the root,
+            '' for the root.
+
+        Returns:
+
+        """
+        path = os.path.join(self.root, *relative.split('/'))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+
+        if wd < 0:
+            error = ctypes.get_errno()
+
+            # The directory can be removed before it is watched.
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return None
+
+            raise OSError(error, os.strerror(error), path)
+
+        self.paths[wd] = relative
+
+
+    def add_tree(self, relative):
+        """ Watches a directory and its sub directories.
+
+        Arguments:
+        relative -- str, path of the directory relative to the root.
+
+        Returns:
+        files -- list[str], relative paths of the files and directories
+            found in the directory.
+
+        """
+        self.add_watch(relative)
+        root = os.path.join(self.root, *relative.split('/')) if relative \
+                else self.root
+        prefix = relative + '/' if relative else ''
+        found = []
+
+        for path, entry in list_tree(root, self.excludes).items():
+            if entry is None:
+                self.add_watch(prefix + path)
+
+            found.append(prefix + path)
+
+        return found
+
+
+    def move_watches(self, old, new):
+        """ Renames the watched directories of a moved directory.
+
+        Arguments:
+        old -- str, previous relative path of the directory.
+        new -- str, new relative path of the directory.
+
+        Returns:
+
+        """
+        for wd, path in self.paths.items():
+            if path == old or path.startswith(old + '/'):
+                self.paths[wd] = new + path[len(old):]
+
+
+    def read(self, timeout=None):
+        """ Reads the changes of the tree.
+
+        Arguments:
+        timeout -- float, seconds to wait for changes, None to wait
+            until there are changes, default value None.
+
+        Returns:
+        events -- list[tuple(str, str, str)], kind of the change, path
+            and new path of a moved path, None otherwise. A rescan
+            event with empty paths is returned if changes were lost.
+
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        try:
+            data = os.read(self.fd, 65536)
+
+        except BlockingIOError:
+            return []
+
+        events = []
+        moved_from = {}
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:
+                offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(("rescan", '', None))
+                continue
+
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+
+            if wd not in self.paths:
+                continue
+
+            relative = posixpath.join(self.paths[wd], name) \
+                    if self.paths[wd] else name
+
+            if is_excluded(relative, self.excludes):
+                continue
+
+            if mask & IN_MOVED_FROM:
+                moved_from[cookie] = relative
+                events.append(("deleted", relative, None))
+
+            elif mask & IN_MOVED_TO and cookie in moved_from:
+                old = moved_from.pop(cookie)
+                events.remove(("deleted", old, None))
+                events.append(("moved", old, relative))
+
+                if mask & IN_ISDIR:
+                    self.move_watches(old, relative)
+
+            elif mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                # The files created before the directory is watched are
+                # not reported.
+                events.append(("changed", relative, None))
+                events.extend(("changed", path, None)
+                        for path in self.add_tree(relative))
+
+            elif mask & (IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO):
+                events.append(("changed", relative, None))
+
+            elif mask & IN_DELETE:
+                events.append(("deleted", relative, None))
+
+        return events
+
+
+    def close(self):
+        """ Stops watching the tree.
+
+        Arguments:
+
+        Returns:
+
+        """
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """ Changes of a directory tree found by scanning it periodically.
+
+    Used when inotify is not available, the renames are reported as
+    deleted and changed events.
+    """
+
+    def __init__(self, root, excludes, interval=POLL_INTERVAL):
+        """ Initialise polling watcher object.
+
+        Arguments:
+        root -- str, path to the directory to watch.
+        excludes -- list[str], exclude patterns, see is_excluded.
+        interval -- float, seconds between two scans,
+            default value POLL_INTERVAL.
+
+        Returns:
+        watcher -- PollingWatcher, polling watcher object.
+
+        """
+        self.root = root
+        self.excludes = excludes
+        self.interval = interval
+        self.entries = list_tree(root, excludes)
+
+
+    def read(self, timeout=None):
+        """ Reads the changes of the tree, see InotifyWatcher.read.
+
+        Arguments:
+        timeout -- float, seconds to wait for changes, None to wait
+            until there are changes, default value None.
+
+        Returns:
+        events -- list[tuple(str, str, str)], kind of the change, path
+            and None.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            delay = self.interval if deadline is None else min(self.interval,
+                    max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+            entries = list_tree(self.root, self.excludes)
+            events = [("deleted", path, None) for path in self.entries
+                    if path not in entries]
+            events.extend(("changed", path, None)
+                    for path, entry in entries.items()
+                    if path not in self.entries or
+                    entry != self.entries[path])
+            self.entries = entries
+
+            if events or deadline is not None and \
+                    time.monotonic() >= deadline:
+                return events
+
+
+    def close(self):
+        """ Stops watching the tree.
+
+        Arguments:
+
+        Returns:
+
+        """
+        self.entries = {}
+
+
+def open_watcher(root, excludes, interval=None):
+    """ Starts watching a directory tree.
+
+    Arguments:
+    root -- str, path to the directory to watch.
+    excludes -- list[str], exclude patterns, see is_excluded.
+    interval -- float, seconds between two scans, None to use inotify
+        if it is available, default value None.
+
+    Returns:
+    watcher -- InotifyWatcher or PollingWatcher, watcher of the tree.
+
+    """
+    if interval is None and libc is not None:
+        return InotifyWatcher(root, excludes)
+
+    return PollingWatcher(root, excludes, interval or POLL_INTERVAL)
+
+
+def collect(watcher, debounce=DEBOUNCE, max_delay=MAX_DELAY):
+    """ Waits for changes and gathers them until the tree is quiet.
+
+    Arguments:
+    watcher -- InotifyWatcher or PollingWatcher, watcher of the tree.
+    debounce -- float, seconds without changes ending the batch,
+        default value DEBOUNCE.
+    max_delay -- float, maximum seconds the batch waits for changes,
+        default value MAX_DELAY.
+
+    Returns:
+    events -- list[tuple(str, str, str)], changes of the batch in
+        order, see InotifyWatcher.read.
+
+    """
+    events = []
+
+    while not events:
+        events = watcher.read()
+
+    deadline = time.monotonic() + max_delay
+
+    while time.monotonic() < deadline:
+        more = watcher.read(min(debounce, deadline - time.monotonic()))
+
+        if not more:
+            break
+
+        events.extend(more)
+
+    return events
+
+
+def is_under(path, parent):
+    """ Checks if a relative path is a directory or inside it.
+
+    Arguments:
+    path -- str, relative path.
+    parent -- str, relative path of the directory.
+
+    Returns:
+    under -- boolean, True if path is parent or inside parent.
+
+    """
+    return path == parent or path.startswith(parent + '/')
+
+
+def plan_changes(events):
+    """ Merges the changes of a batch.
+
+    The removals and renames are kept in order, the changed paths are
+    sent afterwards with their content at that time.
+    Arguments:
+    events -- list[tuple(str, str, str)], changes of the batch, see
+        InotifyWatcher.read.
+
+    Returns:
+    operations -- list[tuple], ("rm", path) and ("mv", path, new_path)
+        operations to run on the server in order.
+    changed -- list[str], relative paths of the changed files and
+        directories.
+    rescan -- boolean, True if changes were lost and the whole tree
+        must be compared.
+
+    """
+    operations = []
+    changed = {}
+    rescan = False
+
+    for kind, path, new_path in events:
+        if kind == "rescan":
+            rescan = True
+
+        elif kind == "changed":
+            changed[path] = None
+
+        elif kind == "deleted":
+            changed = {other: None for other in changed
+                    if not is_under(other, path)}
+            operations.append(("rm", path))
+
+        else:
+            changed = {new_path + other[len(path):] if is_under(other, path)
+                    else other: None for other in changed}
+            operations.append(("mv", path, new_path))
+
+    return operations, list(changed), rescan
+
+
+def remote_commands(remote_root, operations, batch_size=BATCH_SIZE):
+    """ Builds the commands applying removals and renames on the server.
+
+    The renames of paths that do not exist on the server, e.g. files
+    created and renamed in the same batch, are skipped.
+    Arguments:
+    remote_root -- str, path to the remote directory.
+    operations -- list[tuple], operations, see plan_changes.
+    batch_size -- int, number of operations per command,
+        default value BATCH_SIZE.
+
+    Returns:
+    commands -- list[str], shell commands to run in order.
+
+    """
+    steps = []
+
+    for operation in operations:
+        path = serverCompress.quote_path(posixpath.join(remote_root,
+            operation[1]))
+
+        if operation[0] == "rm":
+            steps.append("rm -rf -- {}".format(path))
+            continue
+
+        new_path = posixpath.join(remote_root, operation[2])
+        steps.append("{{ ! [ -e {0} ] || {{ mkdir -p -- {1} && "
+                "rm -rf -- {2} && mv -- {0} {2}; }}; }}".format(path,
+                    serverCompress.quote_path(posixpath.dirname(new_path)),
+                    serverCompress.quote_path(new_path)))
+
+    return [' && '.join(steps[i:i+batch_size])
+            for i in range(0, len(steps), batch_size)]
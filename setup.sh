@@ -1,7 +1,7 @@
 #!/bin/bash
 
-PACKAGES=("scp" "paramiko")
-SCRIPTS=("serverFunctions.py" "server-cli.py" "server")
+PACKAGES=("scp" "paramiko>=3.2")
+SCRIPTS=("serverFunctions.py" "serverProgress.py" "serverRegistry.py" "serverRate.py" "serverLazy.py" "serverBundle.py" "serverCompress.py" "serverSync.py" "serverSftp.py" "serverState.py" "serverVerify.py" "serverProbe.py" "serverTransport.py" "serverMetrics.py" "serverProfile.py" "serverWatch.py" "serverExec.py" "serverBatch.py" "serverBroker.py" "server-cli.py" "server")
 SERVER_DEST="$HOME/.local/var"
 EXEC_DEST="$HOME/.local/bin"
 SERVER_FILE="$SERVER_DEST/servers"
@@ -12,11 +12,16 @@ echo "Server program setup"
 # Install any required packages
 for PACKAGE in "${PACKAGES[@]}"
 do
-	PRESENT=$(pip3 list | grep $PACKAGE)
+	NAME=${PACKAGE%%[<>=]*}
+	PRESENT=$(pip3 list | grep $NAME)
 
 	if [[ -z $PRESENT ]]; then
-		echo "Required package $PACKAGE missing."
-		pip3 install $PACKAGE
+		echo "Required package $NAME missing."
+		pip3 install "$PACKAGE"
+
+	elif [[ $NAME != $PACKAGE ]]; then
+		# Upgrades the package if the installed version is too old.
+		pip3 install -q "$PACKAGE"
 	fi
 done
 